@@ -128,18 +128,157 @@ void setup() {
   controller.add(ambient_temp_thread);
 }
 
-void loop() {
-  // put main program code here, to loop forever:
+// Framed protocol. Instead of a bare command the Pi can send @<seq><length><command>, with seq 2 and length 3 hex
+// digits, and the response line is sent back as @<seq>:<response>. The Pi can then queue several commands without
+// waiting for each response and match responses to commands by seq. Bare commands still work as before.
+char frame_buffer[262];   // bytes of frames received but not handled yet
+int frame_length = 0;     // number of bytes in frame_buffer
+#define FRAME_HEADER_LEN 6
+
+// Send a response line to the Pi, prefixed with the seq of the framed command it answers (seq < 0 for bare commands).
+void sendResponse(String response, int seq) {
+  if (seq >= 0) {
+    char prefix[5];
+    sprintf(prefix, "@%02X:", seq);
+    Serial.print(prefix);
+  }
+  Serial.println(response);
+}
+
+// Value of num hex digits starting at buf[off], -1 if they are not all hex digits.
+int hexValue(char* buf, int off, int num) {
+  int value = 0;
+  for (int i = off; i < off + num; i++) {
+    char c = buf[i];
+    value *= 16;
+    if (c >= '0' && c <= '9') value += c - '0';
+    else if (c >= 'A' && c <= 'F') value += c - 'A' + 10;
+    else if (c >= 'a' && c <= 'f') value += c - 'a' + 10;
+    else return -1;
+  }
+  return value;
+}
 
+// Carry out one command from the Pi. len is the number of bytes of the command.
+void handleCommand(char* pi_command, int len, int seq) {
   String full_data;  // full data array to send to Pi
   String temp_data;  // temporary data holder for each sensor
+  String deviceName = "MajorTomLight";
+
+  if (likeStr(pi_command, 0, "ID", 2, 1)) {
+    // Pi has asked for arduino ID and sensor(s) ID.
+    full_data.concat(deviceName);
+    for (int i = 0; i < controller.size(); i++)
+    {
+      // get sensor ID
+      temp_data = ((SensorThread*) controller.get(i))->getSensorName();
+      // append to final data output
+      full_data.concat(",");
+      full_data.concat(temp_data);
+    }
+    // Send data to Pi
+    sendResponse(full_data, seq);
+  }
+
+  else if (likeStr(pi_command, 0, "HEADER", 6, 1)) {
+    // Pi has asked for data headers
+    full_data.concat("ATSms");
+    for (int i = 0; i < controller.size(); i++)
+    {
+      // get sensor ID
+      temp_data = ((SensorThread*) controller.get(i))->getSensorHeader();
+      // append to final data output
+      full_data.concat(",");
+      full_data.concat(temp_data);
+    }
+    // Send data to Pi
+    sendResponse(full_data, seq);
+  }
+
+  else if (likeStr(pi_command, 0, "DATA", 4, 1)) {
+    // Pi has asked for new sensor data
+    // This will instruct each sensor thread to measure and save its data
+    controller.run();
+    // get the current time
+    unsigned long time = millis();
+    full_data.concat(time);
+    for (int i = 0; i < controller.size(); i++) {
+      // get sensor data
+      temp_data = ((SensorThread*) controller.get(i))->getSensorData();
+      // append to final data output
+      full_data.concat(",");
+      full_data.concat(temp_data);
+    }
+    // Send data to Pi
+    sendResponse(full_data, seq);
+  }
+
+  else if (likeStr(pi_command, 0, "TX", 2, 1)) {
+    // Pi has asked to transmit data to ground
+    if (doTelemetry) {
+      char radiopacket[len - 1];
+      memcpy(&radiopacket[0], &pi_command[2], len - 2);
+
+      // send data to the ground
+      rf95.send((uint8_t *)radiopacket, len - 1);
+      //Serial.println(radiopacket);
+      rf95.waitPacketSent();
+    }
+    // send OK to the Pi
+    sendResponse("OK", seq);
+  }
+  else if (likeStr(pi_command, 0, "RX", 2, 1)) {
+    // Pi has asked for commands from ground
+    // Send the command list
+    sendResponse(ground_commands, seq);
+    // Clear the command list
+    ground_commands = "";
+  }
+  else {// Do nothing. Pi will know of error on timeout.
+  }
+}
+
+// Read what the Pi has sent into frame_buffer and carry out every complete framed command in it.
+void readFrames() {
+  char command[251];
+  while (Serial.available() > 0 && frame_length < (int)sizeof(frame_buffer)) {
+    frame_buffer[frame_length++] = (char)Serial.read();
+  }
+  while (frame_length >= FRAME_HEADER_LEN) {
+    int seq = hexValue(frame_buffer, 1, 2);
+    int command_len = hexValue(frame_buffer, 3, 3);
+    if (frame_buffer[0] != '@' || seq < 0 || command_len < 0 || command_len > 250) {
+      // Not the start of a frame, skip to the next '@'.
+      int skip = 1;
+      while (skip < frame_length && frame_buffer[skip] != '@') skip++;
+      memmove(frame_buffer, &frame_buffer[skip], frame_length - skip);
+      frame_length -= skip;
+      continue;
+    }
+    if (frame_length < FRAME_HEADER_LEN + command_len) {
+      break;  // rest of the frame has not arrived yet
+    }
+    memcpy(command, &frame_buffer[FRAME_HEADER_LEN], command_len);
+    command[command_len] = 0;
+    frame_length -= FRAME_HEADER_LEN + command_len;
+    memmove(frame_buffer, &frame_buffer[FRAME_HEADER_LEN + command_len], frame_length);
+    handleCommand(command, command_len, seq);
+  }
+}
+
+void loop() {
+  // put main program code here, to loop forever:
+
   char pi_command[251]; // command from Pi to do something
   int j = 0;
-  String deviceName = "MajorTomLight";
   char blanks[3]={10, 13, 32};
 
   // check for instruction from Pi
-  if (Serial.available() > 0) {
+  if (Serial.available() > 0 && (frame_length > 0 || Serial.peek() == '@')) {
+    // framed command(s)
+    readFrames();
+  }
+  else if (Serial.available() > 0) {
     int len = Serial.available();
     // read in instruction
     while (Serial.available() > 0) {
@@ -154,77 +293,7 @@ void loop() {
     }
     //Serial.print(pi_command);Serial.println(j);
 
-    if (likeStr(pi_command, 0, "ID", 2, 1)) {
-      // Pi has asked for arduino ID and sensor(s) ID.
-      full_data.concat(deviceName);
-      for (int i = 0; i < controller.size(); i++)
-      {
-        // get sensor ID
-        temp_data = ((SensorThread*) controller.get(i))->getSensorName();
-        // append to final data output
-        full_data.concat(",");
-        full_data.concat(temp_data);
-      }
-      // Send data to Pi
-      Serial.println(full_data);
-    }
-
-    else if (likeStr(pi_command, 0, "HEADER", 6, 1)) {
-      // Pi has asked for data headers
-      full_data.concat("ATSms");
-      for (int i = 0; i < controller.size(); i++)
-      {
-        // get sensor ID
-        temp_data = ((SensorThread*) controller.get(i))->getSensorHeader();
-        // append to final data output
-        full_data.concat(",");
-        full_data.concat(temp_data);
-      }
-      // Send data to Pi
-      Serial.println(full_data);
-    }
-
-    else if (likeStr(pi_command, 0, "DATA", 4, 1)) {
-      // Pi has asked for new sensor data
-      // This will instruct each sensor thread to measure and save its data
-      controller.run();
-      // get the current time
-      unsigned long time = millis();
-      full_data.concat(time);
-      for (int i = 0; i < controller.size(); i++) {
-        // get sensor data
-        temp_data = ((SensorThread*) controller.get(i))->getSensorData();
-        // append to final data output
-        full_data.concat(",");
-        full_data.concat(temp_data);
-      }
-      // Send data to Pi
-      Serial.println(full_data);
-    }
-
-    else if (likeStr(pi_command, 0, "TX", 2, 1)) {
-      // Pi has asked to transmit data to ground
-      if (doTelemetry) {
-        char radiopacket[len - 1];
-        memcpy(&radiopacket[0], &pi_command[2], len - 2);
-
-        // send data to the ground
-        rf95.send((uint8_t *)radiopacket, len - 1);
-        //Serial.println(radiopacket);
-        rf95.waitPacketSent();
-      }
-      // send OK to the Pi
-      Serial.println("OK");
-    }
-    else if (likeStr(pi_command, 0, "RX", 2, 1)) {
-      // Pi has asked for commands from ground
-      // Send the command list
-      Serial.println(ground_commands);
-      // Clear the command list
-      ground_commands = "";
-    }
-    else {// Do nothing. Pi will know of error on timeout.
-    }
+    handleCommand(pi_command, len, -1);
   }
 
   // Check for commands from ground
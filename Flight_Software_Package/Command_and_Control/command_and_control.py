@@ -1,5 +1,7 @@
 from Common.FSW_Common import *
 from Serial_Communication.serial_communication import SerialCommunication
+from Serial_Communication.serial_request import HIGH_PRIORITY, NORMAL_PRIORITY, priority_from_name
+from Command_and_Control.deadline_scheduler import DeadlineScheduler
 from Telemetry.telemetry import Telemetry
 from System_Control.system_control import SystemControl
 
@@ -26,13 +28,21 @@ class CommandAndControl(FlightSoftwareParent):
 
         Written by Daniel Letros, 2018-06-27
         """
-        self.buffering_delay              = 0.1  # A time delay for some aspects of code. Used primarily to debugging.
         self.que_data_delay               = 5    # How often data from the sensors will be asked for.
+        self.device_data_delays           = {}   # How often data is asked for from a device, by its ID.
+        self.schedule_report_interval     = 60   # How often the data schedule stats are logged.
+        self.data_priority                = NORMAL_PRIORITY  # Priority of data requests.
+        self.registration_priority        = HIGH_PRIORITY    # Priority of ID and HEADER requests.
 
         super().__init__("CommandAndControl", logging_object)  # Call parent init.
         self.serial_object         = serial_object             # Reference to serial object
         self.system_control_object = system_control_object     # Reference to system control object
         self.telemetry_object      = telemetry_object          # Reference to telemetry object.
+        self.registration_requests = []                        # ID and HEADER requests not yet checked on.
+        self.registered_connection = 0                         # serial_object.connections_made when devices were
+                                                               # last registered.
+        self.data_schedule         = DeadlineScheduler()       # When to next ask each port for data.
+        self.last_schedule_report  = time.monotonic()
 
     def load_yaml_settings(self)->None:
         """
@@ -45,9 +55,113 @@ class CommandAndControl(FlightSoftwareParent):
         dirname = os.path.dirname(__file__)
         filename = os.path.join(dirname, self.yaml_config_path)
         with open(filename, 'r') as stream:
-            content = yaml.load(stream)['command_and_control']
-        self.buffering_delay              = content['buffering_delay']
-        self.que_data_delay               = content['que_data_delay']
+            content = yaml.load(stream)
+        streams = content['streams']
+        content = content['command_and_control']
+        self.que_data_delay               = streams['data']['period']
+        self.data_priority                = priority_from_name(streams['data']['priority'])
+        self.registration_priority        = priority_from_name(streams['registration']['priority'])
+        self.device_data_delays           = content['device_data_delays'] or {}  # None when no device is listed.
+        self.schedule_report_interval     = content['schedule_report_interval']
+
+    def check_registration_requests(self) -> None:
+        """
+        This function logs a warning for each ID or HEADER request which has failed, and sets the data rate of each
+        port from the ID of the device on it. The requests are checked without waiting, ones still in progress are
+        checked again next time.
+
+        :return: None
+        """
+        pending = []
+        for request in self.registration_requests:
+            if not request.future.done():
+                pending.append(request)
+            elif request.future.exception() is not None:
+                self.log_warning("No [%s] from [%s] [%s]" % (request.response_type, request.port,
+                                                             str(request.future.exception())))
+            elif request.response_type == "ID" and request.port in self.data_schedule:
+                device = request.future.result().split(',')[0]
+                period = None
+                if self.device_data_delays is not None:
+                    period = self.device_data_delays.get(device)
+                if period is None:
+                    # Not listed, or listed without a delay.
+                    period = self.que_data_delay
+                if period != self.data_schedule.period(request.port):
+                    self.log_info("Asking [%s] on [%s] for data every [%s] sec" % (device, request.port, period))
+                    self.data_schedule.set_period(request.port, period)
+        self.registration_requests = pending
+
+    def update_data_schedule(self) -> None:
+        """
+        This function keeps a data schedule entry for each open port. New ports start at que_data_delay until their
+        device ID is known.
+
+        :return: None
+        """
+        ports = list(self.serial_object.port_list) if self.serial_object.ports_are_good else []
+        for port in self.data_schedule.keys():
+            if port not in ports:
+                self.data_schedule.remove(port)
+        for port in ports:
+            if port not in self.data_schedule:
+                self.data_schedule.add(port, self.que_data_delay)
+
+    def report_data_schedule(self) -> None:
+        """
+        This function logs how well the data requests kept to their schedule since the last report.
+
+        :return: None
+        """
+        for port, stats in self.data_schedule.stats(reset=True).items():
+            message = "Data schedule [%s] every [%s] sec: [%d] requested, [%d] deadlines missed, jitter mean [%.1f] " \
+                      "max [%.1f] ms" % (port, stats['period'], stats['issued'], stats['missed'],
+                                         stats['mean_jitter'] * 1000, stats['max_jitter'] * 1000)
+            if stats['missed'] > 0:
+                self.log_warning(message)
+            else:
+                self.log_info(message)
+
+    def run_once(self) -> None:
+        """
+        This function does one pass of the command and control main loop: registers devices if the serial ports have
+        been found (again) since last time, then asks each port whose deadline has come for data.
+
+        :return: None
+        """
+        try:
+            # Register all devices/sensors which this software can reach. The serial object finds the ports, and
+            # finds them again after a communication error.
+            if self.serial_object.ports_are_good and \
+                    self.registered_connection != self.serial_object.connections_made:
+                self.registered_connection = self.serial_object.connections_made
+                # Get ID's of devices and data headers. Their priority is that of the registration stream, high so
+                # each port serves them before any data request.
+                for port in self.serial_object.port_list:
+                    self.registration_requests.append(self.serial_object.submit_request(port, "ID", "ID",
+                                                                                        self.registration_priority))
+                    self.registration_requests.append(self.serial_object.submit_request(port, "HEADER",
+                                                                                        "HEADER",
+                                                                                        self.registration_priority))
+
+            # Once everything is established collect data. A request still waiting when the next one for the port
+            # is queued is dropped, the newer one will do.
+            self.update_data_schedule()
+            for port in self.data_schedule.due():
+                self.serial_object.submit_request(port, "DATA", "DATA", self.data_priority,
+                                                  timeout=self.data_schedule.period(port))
+            self.check_registration_requests()
+            if time.monotonic() - self.last_schedule_report > self.schedule_report_interval:
+                self.last_schedule_report = time.monotonic()
+                self.report_data_schedule()
+        except Exception as err:
+            self.log_error("Main function error [%s]" % str(err))
+
+    def time_until_next_run(self) -> float:
+        """
+        :return: Time [sec] until the next data deadline, at most que_data_delay so new ports are noticed.
+        """
+        return min(self.data_schedule.time_until_next(), self.que_data_delay)
 
     def run(self) -> None:
         """
@@ -61,43 +175,6 @@ class CommandAndControl(FlightSoftwareParent):
 
         print("%s << %s << Starting Thread" % (self.system_name, self.class_name))
         while self.should_thread_run:
-            try:
-                # Register all devices/sensors which this software can reach.
-                # This will get re run if there is an error in communication
-                if not self.serial_object.ports_are_good:
-                    # Don't see anything connected, try to find devices.
-                    self.serial_object.find_serial_ports()
-                    if len(self.serial_object.port_list) > 0:
-                        # Found some devices, YAY!
-                        self.serial_object.ports_are_good = True
-                        # Get ID's of devices and data headers.
-                        with self.serial_object.serial_mutex:
-                            for port in self.serial_object.port_list:
-                                time.sleep(self.buffering_delay)
-                                self.serial_object.write_request_buffer.append([port, "ID"])
-                                time.sleep(self.buffering_delay)
-                                self.serial_object.read_request_buffer.append( [port, "ID"])
-                                time.sleep(self.buffering_delay)
-                                self.serial_object.write_request_buffer.append([port, "HEADER"])
-                                time.sleep(self.buffering_delay)
-                                self.serial_object.read_request_buffer.append( [port, "HEADER"])
-                                time.sleep(self.buffering_delay)
-
-                if self.serial_object.ports_are_good:
-                    with self.serial_object.serial_mutex:
-                        # Everything is established so collect data.
-                        for port in self.serial_object.port_list:
-                            # Get some data and log it
-                            time.sleep(self.buffering_delay)
-                            self.serial_object.write_request_buffer.append([port, "DATA"])
-                            time.sleep(self.buffering_delay)
-                            self.serial_object.read_request_buffer.append([port, "DATA"])
-                            time.sleep(self.buffering_delay)
-
-
-                else:
-                    self.log_warning("Don't see any devices.")
-            except Exception as err:
-                self.log_error("Main function error [%s]" % str(err))
-            time.sleep(self.que_data_delay)
-        print("%s << %s << End Thread" % (self.system_name, self.class_name))
\ No newline at end of file
+            self.run_once()
+            time.sleep(self.time_until_next_run())
+        print("%s << %s << End Thread" % (self.system_name, self.class_name))
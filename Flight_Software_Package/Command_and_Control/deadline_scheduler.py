@@ -0,0 +1,113 @@
+import math
+import time
+
+
+class DeadlineScheduler(object):
+    """
+    Keeps a fixed cadence for each of a set of periodic tasks, e.g. asking each arduino for data.
+
+    Deadlines are kept on the time.monotonic() clock and each one is the previous deadline plus the period, so the
+    cadence does not drift by however long the work or the sleep took. How late each task is started (jitter) is
+    recorded. Deadlines which are missed by a whole period or more are skipped and counted instead of being run in a
+    burst to catch up.
+    """
+
+    def __init__(self) -> None:
+        """
+        Init of class.
+        """
+        self.tasks = dict()  # key: task dict, see add.
+
+    def __contains__(self, key) -> bool:
+        return key in self.tasks
+
+    def keys(self) -> list:
+        return list(self.tasks)
+
+    def add(self, key, period: float, start: float = None) -> None:
+        """
+        This function adds a task, or changes its period if it is already there.
+
+        :param key: Name of the task, e.g. a port.
+        :param period: Time [sec] between deadlines.
+        :param start: time.monotonic() of the first deadline, now if None.
+        :return: None
+        """
+        if key in self.tasks:
+            self.set_period(key, period)
+            return
+        if start is None:
+            start = time.monotonic()
+        self.tasks[key] = dict(period=period, deadline=start, issued=0, missed=0, lateness_sum=0.0,
+                               lateness_max=0.0)
+
+    def set_period(self, key, period: float) -> None:
+        """
+        This function changes the period of a task. The next deadline moves to one new period after the last one.
+
+        :param key: Name of the task.
+        :param period: Time [sec] between deadlines.
+        :return: None
+        """
+        task = self.tasks[key]
+        task['deadline'] += period - task['period']
+        task['period']    = period
+
+    def remove(self, key) -> None:
+        self.tasks.pop(key, None)
+
+    def period(self, key) -> float:
+        return self.tasks[key]['period']
+
+    def due(self, now: float = None) -> list:
+        """
+        This function finds the tasks whose deadline has come and moves their deadlines on. The caller runs them.
+
+        :param now: time.monotonic() time, now if None.
+        :return: Keys of the tasks to run now.
+        """
+        if now is None:
+            now = time.monotonic()
+        keys = []
+        for key, task in self.tasks.items():
+            lateness = now - task['deadline']
+            if lateness < 0:
+                continue
+            # Whole periods late means those deadlines were missed, run once for the latest.
+            skipped           = int(math.floor(lateness / task['period']))
+            task['missed']   += skipped
+            lateness         -= skipped * task['period']
+            task['deadline'] += (skipped + 1) * task['period']
+            task['issued']   += 1
+            task['lateness_sum'] += lateness
+            task['lateness_max']  = max(task['lateness_max'], lateness)
+            keys.append(key)
+        return keys
+
+    def time_until_next(self, now: float = None) -> float:
+        """
+        :param now: time.monotonic() time, now if None.
+        :return: Time [sec] until the next deadline, 0 if one has passed, inf if there are no tasks.
+        """
+        if len(self.tasks) == 0:
+            return math.inf
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, min(task['deadline'] for task in self.tasks.values()) - now)
+
+    def stats(self, reset: bool = False) -> dict:
+        """
+        This function reports how well each task kept to its deadlines.
+
+        :param reset: Start the counts again after reporting.
+        :return: Dict keyed by task of dicts with period, issued (runs), missed (deadlines skipped), mean_jitter and
+                 max_jitter [sec] (how late runs started).
+        """
+        report = dict()
+        for key, task in self.tasks.items():
+            report[key] = dict(period=task['period'], issued=task['issued'], missed=task['missed'],
+                               mean_jitter=task['lateness_sum'] / max(task['issued'], 1),
+                               max_jitter=task['lateness_max'])
+            if reset:
+                task.update(issued=0, missed=0, lateness_sum=0.0, lateness_max=0.0)
+        return report
@@ -13,6 +13,7 @@ if socket.gethostname() == "Rocky" or socket.gethostname() == "MajorTom" or sock
     import RPi.GPIO as GPIO
     import smbus
 from Logger.logger import *
+from Logger.timestamp import utc_timestamp
 
 
 """
@@ -94,8 +95,8 @@ class FlightSoftwareParent(threading.Thread):
         :param log_message: Error message to log
         :return: None
         """
-        self.logger.notifications_logging_buffer.append("ERROR << %s << %s << %s << %s\n" % (
-            datetime.datetime.utcnow().strftime("%Y%m%d_%H:%M:%S.%f"), self.system_name, self.class_name, log_message))
+        self.logger.notifications_logging_buffer.put("ERROR << %s << %s << %s << %s\n" % (
+            utc_timestamp(), self.system_name, self.class_name, log_message), "ERROR")
 
     def log_warning(self, log_message: str) -> None:
         """
@@ -106,8 +107,8 @@ class FlightSoftwareParent(threading.Thread):
         :param log_message: Warning message to log
         :return: None
         """
-        self.logger.notifications_logging_buffer.append("WARNING << %s << %s << %s << %s\n" % (
-            datetime.datetime.utcnow().strftime("%Y%m%d_%H:%M:%S.%f"), self.system_name, self.class_name, log_message))
+        self.logger.notifications_logging_buffer.put("WARNING << %s << %s << %s << %s\n" % (
+            utc_timestamp(), self.system_name, self.class_name, log_message), "WARNING")
 
     def log_info(self, log_message: str) -> None:
         """
@@ -118,25 +119,29 @@ class FlightSoftwareParent(threading.Thread):
         :param log_message: Info message to log
         :return: None
         """
-        self.logger.notifications_logging_buffer.append("INFO << %s << %s << %s << %s\n" % (
-            datetime.datetime.utcnow().strftime("%Y%m%d_%H:%M:%S.%f"), self.system_name, self.class_name, log_message))
+        self.logger.notifications_logging_buffer.put("INFO << %s << %s << %s << %s\n" % (
+            utc_timestamp(), self.system_name, self.class_name, log_message), "INFO")
 
-    def log_data(self, log_message: str) -> None:
+    def log_data(self, log_message: str) -> str:
         """
         This function will que the input message to be logged as data to the data log file.
 
         Written by Daniel Letros, 2018-06-27
 
         :param log_message: Info message to log
-        :return: None
+        :return: The line as it will appear in the data log file
         """
-        self.logger.data_logging_buffer.append("%s,%s\n" % (
-            datetime.datetime.utcnow().strftime("%Y%m%d_%H:%M:%S.%f"), log_message))
+        line = "%s,%s\n" % (utc_timestamp(), log_message)
+        self.logger.data_logging_buffer.put(line, "DATA")
+        return line
 
     def read_last_line_in_data_log(self) -> str:
         """
         This function will read the last line in the data log file and return it
 
+        Threads that only need the newest sample should use SerialCommunication.latest_sample instead, which needs no
+        file I/O and also has lines the logger has not written yet.
+
         Written by Daniel Letros, 2018-07-03
 
         :return: None
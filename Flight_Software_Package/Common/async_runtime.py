@@ -0,0 +1,218 @@
+import asyncio
+import os
+import queue
+import yaml
+from Serial_Communication.async_serial import AsyncPortWorker
+
+"""
+Optional asyncio runtime for the flight software, selected with general: runtime: asyncio in master_config.yaml.
+
+The threaded runtime runs each FlightSoftwareParent object (and the logger) as its own thread, sleeping between passes
+of its main loop. Here the same objects are not started as threads. Instead one event loop calls their run_once on
+timers, or for the logger when lines are put in its buffers, and does the serial I/O through non-blocking port file
+descriptors (see Serial_Communication/async_serial.py), so everything runs on one OS thread. Stopping is done by
+cancelling the tasks.
+
+run_once steps must not block for long since nothing else runs meanwhile. The known exception is opening the ports
+when SerialCommunication finds them again, which is rare. SystemControl sets the cutoff pin low again with a timer on
+the event loop instead of sleeping while it is held high.
+"""
+
+
+def load_runtime_setting(flight_software_object) -> str:
+    """
+    This function reads which runtime to use from the master_config.yaml file.
+
+    :param flight_software_object: Any FlightSoftwareParent object, for the path to the config file.
+    :return: "threads" or "asyncio". "threads" if the setting can not be read.
+    """
+    try:
+        filename = os.path.join(os.path.dirname(__file__), flight_software_object.yaml_config_path)
+        with open(filename, 'r') as stream:
+            return yaml.load(stream)['general']['runtime']
+    except Exception as err:
+        flight_software_object.log_warning("Could not read runtime setting [%s]. Using threads." % str(err))
+        return "threads"
+
+
+class AsyncMailbox(queue.SimpleQueue):
+    """
+    Command bus mailbox which also wakes a task on the event loop when something is put in it.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Init of class.
+
+        :param loop: Event loop of the task which waits on the mailbox.
+        """
+        super().__init__()
+        self.loop     = loop
+        self.has_mail = asyncio.Event()  # Set when something is put, cleared by the task.
+
+    def put(self, item, block: bool = True, timeout: float = None) -> None:
+        super().put(item)
+        self.loop.call_soon_threadsafe(self.has_mail.set)
+
+
+class AsyncRuntime(object):
+    """
+    Runs the flight software objects as tasks on one event loop.
+    """
+
+    def __init__(self, logging_object, serial_object, telemetry_object, system_control_object,
+                 command_and_control_object) -> None:
+        """
+        Init of class.
+
+        :param logging_object: Reference to the logging object.
+        :param serial_object: Reference to the serial object.
+        :param telemetry_object: Reference to the telemetry object.
+        :param system_control_object: Reference to the system control object.
+        :param command_and_control_object: Reference to the command and control object.
+        """
+        self.logger                     = logging_object
+        self.serial_object              = serial_object
+        self.telemetry_object           = telemetry_object
+        self.system_control_object      = system_control_object
+        self.command_and_control_object = command_and_control_object
+
+    async def run_periodically(self, owner, delay: float) -> None:
+        """
+        This function runs the main loop of an object as a task, calling its run_once every delay seconds until its
+        should_thread_run is cleared or the task is cancelled.
+
+        :param owner: Object with run_once and should_thread_run.
+        :param delay: Time [sec] between passes.
+        :return: None
+        """
+        print("%s << %s << Starting Task" % (self.serial_object.system_name, owner.class_name))
+        try:
+            while owner.should_thread_run:
+                owner.run_once()
+                await asyncio.sleep(delay)
+        finally:
+            print("%s << %s << End Task" % (self.serial_object.system_name, owner.class_name))
+
+    async def run_on_deadlines(self, owner) -> None:
+        """
+        This function runs the main loop of an object as a task, calling its run_once whenever its
+        time_until_next_run says to, until its should_thread_run is cleared or the task is cancelled.
+
+        :param owner: Object with run_once, time_until_next_run and should_thread_run.
+        :return: None
+        """
+        print("%s << %s << Starting Task" % (self.serial_object.system_name, owner.class_name))
+        try:
+            while owner.should_thread_run:
+                owner.run_once()
+                await asyncio.sleep(owner.time_until_next_run())
+        finally:
+            print("%s << %s << End Task" % (self.serial_object.system_name, owner.class_name))
+
+    async def run_logger(self) -> None:
+        """
+        This function runs the main loop of the logger as a task. Like the threaded batched writer it waits until a
+        line is put in either buffer, or at most max_flush_delay seconds, then waits batch_window so a burst is one
+        write.
+
+        :return: None
+        """
+        owner     = self.logger
+        loop      = asyncio.get_running_loop()
+        has_lines = asyncio.Event()
+        buffers   = [owner.notifications_logging_buffer, owner.data_logging_buffer]
+        for buffer in buffers:
+            buffer.wake_event_loop(loop, has_lines)
+        print("%s << %s << Starting Task" % (self.serial_object.system_name, owner.class_name))
+        try:
+            while owner.should_thread_run:
+                has_lines.clear()
+                owner.run_once()
+                if len(buffers[0]) > 0 or len(buffers[1]) > 0:
+                    # Not batched, one line is written a pass. Let the other tasks run in between.
+                    await asyncio.sleep(0)
+                    continue
+                try:
+                    await asyncio.wait_for(has_lines.wait(), owner.max_flush_delay)
+                    await asyncio.sleep(owner.batch_window)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for buffer in buffers:
+                buffer.wake_event_loop(None, None)
+            print("%s << %s << End Task" % (self.serial_object.system_name, owner.class_name))
+
+    async def run_system_control(self) -> None:
+        """
+        This function runs the main loop of the system control as a task, calling its run_once every main_delay seconds
+        and carrying out uplink commands as soon as they are published in between.
+
+        :return: None
+        """
+        owner   = self.system_control_object
+        loop    = asyncio.get_running_loop()
+        mailbox = AsyncMailbox(loop)
+        owner.subscribe_to_uplink_commands(mailbox)
+        owner.event_loop = loop
+        print("%s << %s << Starting Task" % (self.serial_object.system_name, owner.class_name))
+        try:
+            while owner.should_thread_run:
+                owner.run_once()
+                next_run = loop.time() + owner.main_delay
+                while owner.should_thread_run and loop.time() < next_run:
+                    mailbox.has_mail.clear()
+                    owner.wait_for_uplink_commands(0.0)
+                    try:
+                        await asyncio.wait_for(mailbox.has_mail.wait(), next_run - loop.time())
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            # A timer setting the cutoff pin low will not run once the loop stops.
+            owner.end_cutoff()
+            print("%s << %s << End Task" % (self.serial_object.system_name, owner.class_name))
+
+    async def main(self) -> None:
+        """
+        This function is the main coroutine. It hands the serial ports to the event loop, runs every main loop until
+        they all stop, then gets the last log lines onto disk.
+
+        :return: None
+        """
+        self.serial_object.event_loop        = asyncio.get_running_loop()
+        self.serial_object.port_worker_class = AsyncPortWorker
+        if self.logger.batched_writer:
+            self.logger.open_log_files()
+        # The i2c reads block, the photosensor sampler keeps its own thread.
+        self.serial_object.photosensor_sampler.start()
+        tasks = [asyncio.ensure_future(self.run_logger()),
+                 asyncio.ensure_future(self.run_periodically(self.serial_object, self.serial_object.main_delay)),
+                 asyncio.ensure_future(self.run_on_deadlines(self.command_and_control_object)),
+                 asyncio.ensure_future(self.run_periodically(self.telemetry_object,
+                                                             self.telemetry_object.main_delay)),
+                 asyncio.ensure_future(self.run_system_control())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.serial_object.stop_port_workers(ConnectionResetError("serial communication stopped"))
+            self.serial_object.photosensor_sampler.should_thread_run = False
+            self.serial_object.photosensor_sampler.join()
+            if self.logger.batched_writer:
+                self.logger.write_buffers_to_log()
+                self.logger.close_log_files()
+            else:
+                while len(self.logger.notifications_logging_buffer) > 0 or len(self.logger.data_logging_buffer) > 0:
+                    self.logger.run_once()
+
+    def run(self) -> None:
+        """
+        This function runs the flight software until it is stopped, e.g. by Ctrl+C.
+
+        :return: None
+        """
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,90 @@
+import time
+
+"""
+Stand-in for smbus.SMBus with TSL2561 light sensors on it, to run and benchmark I2C_Photosensor off the Pi:
+
+    python3 -m I2C.fake_smbus
+
+from the Flight_Software_Package directory.
+"""
+
+
+class FakeSMBus(object):
+    """
+    Fake i2c bus with a TSL2561 at each address it is given. Transactions take as long as they would on the real bus.
+    """
+
+    def __init__(self, addresses: list = (0x29, 0x39, 0x49), bus_speed: float = 100000.0, light=None) -> None:
+        """
+        Init of class.
+
+        :param addresses: Addresses with a sensor.
+        :param bus_speed: i2c clock [Hz]. 0 for transactions which take no time.
+        :param light: Function of time.monotonic() giving the (full spectrum, infrared) counts at 1x gain. Constant
+                      (1000, 100) if None.
+        """
+        self.bus_speed    = bus_speed
+        self.light        = light if light is not None else (lambda now: (1000, 100))
+        self.registers    = {address: [0] * 16 for address in addresses}
+        self.transactions = 0  # Number of transactions so far.
+
+    def transfer(self, number_of_bytes: int) -> None:
+        """
+        This function takes the time of a transaction: address and command byte written, then a repeated start and
+        address before the bytes read or written. 9 clocks a byte.
+
+        :param number_of_bytes: Data bytes moved.
+        :return: None
+        """
+        self.transactions += 1
+        if self.bus_speed > 0:
+            end = time.perf_counter() + (number_of_bytes + 3) * 9 / self.bus_speed
+            while time.perf_counter() < end:
+                pass
+
+    def write_byte_data(self, address: int, command: int, value: int) -> None:
+        self.transfer(1)
+        self.registers[address][command & 0x0F] = value
+
+    def read_i2c_block_data(self, address: int, command: int, length: int) -> list:
+        self.transfer(length)
+        registers = self.registers[address]
+        gain      = 16 if registers[0x01] & 0x10 else 1
+        full, ir  = self.light(time.monotonic())
+        full      = min(int(full * gain), 5047)
+        ir        = min(int(ir * gain), 5047)
+        registers[0x0C:0x10] = [full & 0xFF, full >> 8, ir & 0xFF, ir >> 8]
+        start = command & 0x0F
+        return registers[start:start + length]
+
+
+if __name__ == '__main__':
+    from I2C.i2c import I2C_Photosensor
+
+    bus    = FakeSMBus()
+    sensor = I2C_Photosensor(0x39, "PiPto1", bus=bus)
+    runs   = 2000
+
+    # Two 2 byte reads, as _get_data used to do.
+    start = time.perf_counter()
+    for i in range(runs):
+        data  = bus.read_i2c_block_data(0x39, 0x0C | 0x80, 2)
+        data1 = bus.read_i2c_block_data(0x39, 0x0E | 0x80, 2)
+    print("two block reads  %8.1f us/sample" % ((time.perf_counter() - start) / runs * 1e6))
+
+    start = time.perf_counter()
+    for i in range(runs):
+        sensor._get_data()
+    print("_get_data        %8.1f us/sample" % ((time.perf_counter() - start) / runs * 1e6))
+    assert sensor._get_data() == (900, 100)
+
+    samples = sensor.read_burst(runs, interval=0.0)
+    print("read_burst       %8.1f us/sample" % ((samples[-1, 0] - samples[0, 0]) / (runs - 1) * 1e6))
+
+    # Dim light, adaptive gain should go to 16x and keep the 1/16 count precision.
+    dim    = FakeSMBus(light=lambda now: (20.25, 3.5))
+    sensor = I2C_Photosensor(0x39, "PiPto1", bus=dim, adaptive_gain=True)
+    samples = sensor.read_burst(10)
+    print("adaptive gain    %dx, last sample VIS %d IR %d (16x counts)" % (sensor.gain, samples[-1, 1],
+                                                                           samples[-1, 2]))
+    assert sensor.gain == 16 and samples[-1, 1] == 324 - 56
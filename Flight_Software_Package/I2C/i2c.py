@@ -11,15 +11,42 @@ Class which handles the i2c light sensors for the RMC 549 Balloons
 Written by Lukas Fehr, 2018-07-05, extremely minor adaptation by Daniel Letros, 2018-07-05
 """
 
+# TSL2561 registers, used with the command bit 0x80.
+TSL2561_COMMAND      = 0x80
+TSL2561_CONTROL      = 0x00
+TSL2561_TIMING       = 0x01
+TSL2561_DATA0LOW     = 0x0C  # ch0 LSB, ch0 MSB, ch1 LSB, ch1 MSB follow in order.
+TSL2561_POWER_ON     = 0x03
+TSL2561_GAIN_16X     = 0x10  # Timing register gain bit, clear for 1x.
+TSL2561_INTEG_13MS   = 0x00  # Timing register integration bits.
+TSL2561_INTEG_TIME   = 0.0137  # [sec] integration time of TSL2561_INTEG_13MS.
+TSL2561_MAX_COUNT    = 5047    # Full scale count at TSL2561_INTEG_13MS.
+
+
 class I2C_Photosensor(object):
-    def __init__(self, i2c_address: hex=0x39, class_name: str="I2CPhotosensor") -> None:
+    def __init__(self, i2c_address: hex=0x39, class_name: str="I2CPhotosensor", bus=None,
+                 adaptive_gain: bool=False) -> None:
+        """
+        Init of class.
+
+        :param i2c_address: Address of the sensor, 0x29, 0x39 or 0x49.
+        :param class_name: Name of the sensor in the data header.
+        :param bus: Object with the smbus.SMBus read_i2c_block_data/write_byte_data methods, e.g. a FakeSMBus. The
+                    Pi's i2c bus 1 if None, on Rocky only.
+        :param adaptive_gain: Switch between 1x and 16x gain to keep readings away from full scale and from zero.
+                              Readings are then in counts at 16x gain, 1x readings are multiplied by 16.
+        """
         super().__init__()
         self.class_name           = class_name
         self.system_name          = socket.gethostname()
         self.data_header_addition = "%sVIS, %sIR" % (self.class_name, self.class_name)
+        self.adaptive_gain        = adaptive_gain
+        self.gain                 = 1     # 1 or 16.
+        self.gain_settle_time     = 0.0   # time.monotonic() before which a reading may be from the old gain.
+        self._bus                 = bus
         if i2c_address not in [0x29, 0x39, 0x49]:
             self.sensor_is_valid = False
-        elif socket.gethostname() != "Rocky":
+        elif bus is None and socket.gethostname() != "Rocky":
             self.sensor_is_valid = False
         else:
             self.sensor_is_valid = True
@@ -31,37 +58,72 @@ class I2C_Photosensor(object):
         if self.sensor_is_valid:
             try:
                 # Get I2C bus
-                self._bus = smbus.SMBus(1)
+                if self._bus is None:
+                    self._bus = smbus.SMBus(1)
 
                 # TSL2561 address, 0x39(57)
                 # Select control register, 0x00(00) with command register, 0x80(128)
                 #		0x03(03)	Power ON mode
-                self._bus.write_byte_data(self._addr, 0x00 | 0x80, 0x03)
+                self._bus.write_byte_data(self._addr, TSL2561_CONTROL | TSL2561_COMMAND, TSL2561_POWER_ON)
                 # TSL2561 address, 0x39(57)
                 # Select timing register, 0x01(01) with command register, 0x80(128)
                 #		0x02(02)	Nominal integration time = 402ms (not doing this)
 
                 # 13 ms, 0 gain (0x00) (0x10 would be 16x gain 13 ms, 0x01 would be 1x gain and 101 ms, etc)
-                self._bus.write_byte_data(self._addr, 0x01 | 0x80, 0x00)
+                self._set_gain(1)
             except:
                 self.sensor_is_valid = False
 
+    def _set_gain(self, gain: int) -> None:
+        """
+        This function sets the gain, keeping the 13 ms integration.
+
+        :param gain: 1 or 16.
+        :return: None
+        """
+        timing = TSL2561_INTEG_13MS | (TSL2561_GAIN_16X if gain == 16 else 0x00)
+        self._bus.write_byte_data(self._addr, TSL2561_TIMING | TSL2561_COMMAND, timing)
+        self.gain             = gain
+        # The conversion in progress was started at the old gain.
+        self.gain_settle_time = time.monotonic() + 2 * TSL2561_INTEG_TIME
+
+    def _read_channels(self) -> tuple:
+        """
+        This function reads both channels in one i2c transaction. The sensor moves on to the next register for each
+        byte read, so the 4 bytes from 0x0C are ch0 LSB, ch0 MSB, ch1 LSB, ch1 MSB.
+
+        :return: Raw (ch0, ch1) counts.
+        """
+        data = self._bus.read_i2c_block_data(self._addr, TSL2561_DATA0LOW | TSL2561_COMMAND, 4)
+        return data[1] * 256 + data[0], data[3] * 256 + data[2]
+
+    def _adapt_gain(self, ch0: int) -> bool:
+        """
+        This function switches gain if the full spectrum count is near full scale or near zero.
+
+        :param ch0: Raw full spectrum count.
+        :return: True if the gain was changed.
+        """
+        if self.gain == 16 and ch0 > 0.9 * TSL2561_MAX_COUNT:
+            self._set_gain(1)
+            return True
+        if self.gain == 1 and ch0 < 0.9 * TSL2561_MAX_COUNT / 16:
+            self._set_gain(16)
+            return True
+        return False
+
     def _get_data(self):
         """ Read the data from the sensor. Returns lux values (VIS, IR). Taken from TSL2561.py script. """
         try:
             if self.sensor_is_valid:
-                # Read data back from 0x0C(12) with command register, 0x80(128), 2 bytes
-                # ch0 LSB, ch0 MSB
-                data = self._bus.read_i2c_block_data(self._addr, 0x0C | 0x80, 2)
-
-                # Read data back from 0x0E(14) with command register, 0x80(128), 2 bytes
-                # ch1 LSB, ch1 MSB
-                data1 = self._bus.read_i2c_block_data(self._addr, 0x0E | 0x80, 2)
-
-                # Convert the data
-                ch0 = data[1] * 256 + data[0]
-                ch1 = data1[1] * 256 + data1[0]
-
+                if self.adaptive_gain and time.monotonic() < self.gain_settle_time:
+                    return None  # May be a conversion from before the gain change.
+                ch0, ch1 = self._read_channels()
+                if self.adaptive_gain:
+                    scale = 16 // self.gain
+                    self._adapt_gain(ch0)
+                    ch0  *= scale
+                    ch1  *= scale
                 return ch0 - ch1, ch1
             else:
                 return None
@@ -69,4 +131,24 @@ class I2C_Photosensor(object):
             self.sensor_is_valid = False
             return None
 
+    def read_burst(self, number_of_samples: int, interval: float = TSL2561_INTEG_TIME) -> np.ndarray:
+        """
+        This function takes samples back to back.
 
+        :param number_of_samples: Number of samples.
+        :param interval: Time [sec] between samples. Reading faster than the integration time returns repeats.
+        :return: Array of shape (number_of_samples, 3), columns time.monotonic(), VIS, IR. VIS and IR are nan for
+                 samples which failed.
+        """
+        samples   = np.full((number_of_samples, 3), np.nan)
+        next_time = time.monotonic()
+        for i in range(number_of_samples):
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            data          = self._get_data()
+            samples[i, 0] = time.monotonic()
+            if data is not None:
+                samples[i, 1:3] = data
+            next_time += interval
+        return samples
@@ -0,0 +1,119 @@
+from Common.FSW_Common import *
+
+
+class PhotosensorSampler(FlightSoftwareParent):
+    """
+    This class reads the i2c photosensors on a fixed cadence, in its own thread, into a ring buffer of timestamped
+    readings. SerialCommunication attaches the reading nearest in time to each arduino data line instead of reading
+    the sensors while the line waits, so the serial link does not wait on the i2c bus and the light data is sampled
+    at its own rate.
+    """
+
+    def __init__(self, logging_object: Logger, list_of_photosensors: list) -> None:
+        """
+        Init of class.
+
+        :param logging_object: Reference to logging object.
+        :param list_of_photosensors: List of I2C_Photosensor. Only the valid ones are sampled.
+        """
+        self.sample_period   = 0.05  # Time [sec] between readings of all the sensors.
+        self.buffer_length   = 512   # Number of readings kept.
+        self.max_reading_age = 0.5   # Readings further than this [sec] from a data line are not attached to it.
+
+        super().__init__("PhotosensorSampler", logging_object)  # Run parent init.
+
+        self.sensors = [sensor for sensor in list_of_photosensors if sensor.sensor_is_valid]
+        self.mutex   = threading.Lock()
+        # Ring buffer. Row count % buffer_length is the next one written. Failed readings are nan.
+        self.times   = np.full(self.buffer_length, np.nan)                          # time.monotonic() of each row.
+        self.values  = np.full((self.buffer_length, len(self.sensors), 2), np.nan)  # [VIS, IR] of each sensor.
+        self.count   = 0                                                            # Rows written so far.
+
+    def load_yaml_settings(self) -> None:
+        """
+        This function loads in settings from the master_config.yaml file.
+
+        :return: None
+        """
+        dirname = os.path.dirname(__file__)
+        filename = os.path.join(dirname, self.yaml_config_path)
+        with open(filename, 'r') as stream:
+            content = yaml.load(stream)['photosensor_sampler']
+        self.sample_period   = content['sample_period']
+        self.buffer_length   = content['buffer_length']
+        self.max_reading_age = content['max_reading_age']
+
+    def sample(self) -> None:
+        """
+        This function reads every sensor once and puts the readings in the ring buffer.
+
+        :return: None
+        """
+        self.start_function_diagnostics("sample")
+        readings   = np.full((len(self.sensors), 2), np.nan)
+        start_time = time.monotonic()
+        for i, sensor in enumerate(self.sensors):
+            data = sensor._get_data()
+            if data is not None:
+                readings[i] = data
+        # Time the middle of the readings.
+        now = (start_time + time.monotonic()) / 2
+        with self.mutex:
+            row              = self.count % self.buffer_length
+            self.times[row]  = now
+            self.values[row] = readings
+            self.count      += 1
+        self.end_function_diagnostics("sample")
+
+    def nearest(self, timestamp: float = None) -> list:
+        """
+        This function finds the reading closest in time to the given time.
+
+        :param timestamp: time.monotonic() time, now if None.
+        :return: [VIS, IR] pair for each sampled sensor, None in place of a pair if its reading failed. None if
+                 there is no reading within max_reading_age.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self.mutex:
+            if self.count == 0:
+                return None
+            offsets = np.abs(self.times - timestamp)
+            row     = int(np.nanargmin(offsets))
+            if offsets[row] > self.max_reading_age:
+                return None
+            readings = self.values[row].copy()
+        return [None if np.isnan(reading).any() else [int(reading[0]), int(reading[1])] for reading in readings]
+
+    def run_once(self) -> None:
+        """
+        This function does one pass of the sampler main loop.
+
+        :return: None
+        """
+        try:
+            self.sample()
+        except Exception as err:
+            self.log_error("Main function error [%s]" % str(err))
+
+    def run(self) -> None:
+        """
+        This function is the main loop of the sampler. It samples every sample_period seconds, from a fixed start so
+        the cadence does not drift with the time taken by each reading.
+
+        :return: None
+        """
+        print("%s << %s << Starting Thread" % (self.system_name, self.class_name))
+        if len(self.sensors) == 0:
+            print("%s << %s << No valid photosensors, End Thread" % (self.system_name, self.class_name))
+            return
+        next_time = time.monotonic()
+        while self.should_thread_run:
+            self.run_once()
+            next_time += self.sample_period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.monotonic()  # Fell behind, start again from now instead of rushing to catch up.
+        print("%s << %s << End Thread" % (self.system_name, self.class_name))
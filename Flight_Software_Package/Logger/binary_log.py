@@ -0,0 +1,181 @@
+import os
+import struct
+import hashlib
+import calendar
+import numpy as np
+
+"""
+Binary version of the data log. Every data line is stored as a fixed width record of little endian float64 values, one
+per column of the most recent HEADER line, so a whole day of data can be memory mapped by NumPy instead of parsed.
+
+Each header gets its own file, YYYYMMDD_data_<header hash>.bin, laid out as:
+
+    RMC549BIN1\n
+    <header line, comma separated column names, padded with spaces to a multiple of 8 bytes>\n
+    <record><record>...
+
+Column values are stored as follows:
+    PiTS                        -- Unix time [sec] of the Pi timestamp.
+    numbers                     -- The number.
+    single character text       -- The character code, e.g. N/S, E/W and altitude units.
+    anything else or missing    -- NaN.
+"""
+
+BINARY_LOG_MAGIC = b"RMC549BIN1\n"
+
+
+def pi_timestamp_to_unix(timestamp: str) -> float:
+    """
+    This function converts a log timestamp to Unix time.
+
+    :param timestamp: Log timestamp, e.g. 20190717_08:32:39.021639
+    :return: Unix time [sec]
+    """
+    return calendar.timegm((int(timestamp[0:4]), int(timestamp[4:6]), int(timestamp[6:8]),
+                            int(timestamp[9:11]), int(timestamp[12:14]), 0)) + float(timestamp[15:])
+
+
+def data_field_to_float(field: str) -> float:
+    """
+    This function converts one field of a data line to the value stored in the binary log.
+
+    :param field: Text of the field.
+    :return: Value to store.
+    """
+    try:
+        return float(field)
+    except ValueError:
+        field = field.strip()
+        if len(field) == 1:
+            return float(ord(field))
+        return float('nan')
+
+
+class BinaryDataLog(object):
+    """
+    Append only writer of the binary data log. Used by the Logger thread only.
+    """
+
+    def __init__(self, log_file_path: str, date_stamp: str) -> None:
+        """
+        Init of class.
+
+        :param log_file_path: Folder the log files for the day are kept in.
+        :param date_stamp: Date part of the log file names, e.g. 20190717
+        """
+        self.log_file_path = log_file_path
+        self.date_stamp    = date_stamp
+        self.header        = None  # Column names of the current file.
+        self.file          = None  # Open handle of the current file.
+        self.record_struct = None  # Packs one record of the current file.
+        self.path          = None  # Path of the current file.
+
+    def set_header(self, header_line: str) -> None:
+        """
+        This function switches the writer to the file for the given header, making it if needed.
+
+        :param header_line: Comma separated column names, as logged on HEADER lines.
+        :return: None
+        """
+        header = [name.strip() for name in header_line.strip().split(',')]
+        if header == self.header:
+            return
+        self.close()
+        header_text = ",".join(header)
+        self.path   = self.log_file_path + os.sep + "%s_data_%s.bin" % (
+            self.date_stamp, hashlib.sha1(header_text.encode('utf-8')).hexdigest()[0:8])
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            header_block = header_text.encode('utf-8')
+            header_block += b" " * (-(len(BINARY_LOG_MAGIC) + len(header_block) + 1) % 8) + b"\n"
+            with open(self.path, 'wb') as file:
+                file.write(BINARY_LOG_MAGIC + header_block)
+        else:
+            # Appending to an existing file. Cut off any record left partly written by a power loss so the records
+            # written from now on stay aligned.
+            with open(self.path, 'rb') as file:
+                file.readline()
+                file.readline()
+                offset = file.tell()
+            partial_record_size = (os.path.getsize(self.path) - offset) % (8 * len(header))
+            if partial_record_size != 0:
+                os.truncate(self.path, os.path.getsize(self.path) - partial_record_size)
+        self.file          = open(self.path, 'ab')
+        self.header        = header
+        self.record_struct = struct.Struct("<%dd" % len(header))
+
+    def write_lines(self, lines: list) -> None:
+        """
+        This function appends data lines to the binary log as records. Lines are dropped if no header is known yet.
+
+        :param lines: Data lines as written to the text data log.
+        :return: None
+        """
+        if self.file is None:
+            return
+        column_count = len(self.header)
+        records      = []
+        for line in lines:
+            fields = line.strip().split(',')
+            try:
+                values = [pi_timestamp_to_unix(fields[0])]
+            except ValueError:
+                # Not a timestamped data line, it stays in the text log only.
+                continue
+            values += [data_field_to_float(field) for field in fields[1:column_count]]
+            values += [float('nan')] * (column_count - len(values))
+            records.append(self.record_struct.pack(*values))
+        self.file.write(b"".join(records))
+        self.file.flush()
+
+    def fsync(self) -> None:
+        """
+        This function forces the current file to disk.
+
+        :return: None
+        """
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        """
+        This function flushes and closes the current file.
+
+        :return: None
+        """
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+        self.file = None
+
+
+def load_binary_data_log(path: str) -> np.ndarray:
+    """
+    This function memory maps a binary data log. Nothing is read from disk until the data is used.
+
+    A record cut short at the end of the file (power loss mid write) is ignored.
+
+    :param path: Path of a YYYYMMDD_data_<header hash>.bin file.
+    :return: Read only NumPy structured array with one float64 field per column of the header.
+    """
+    with open(path, 'rb') as file:
+        if file.readline() != BINARY_LOG_MAGIC:
+            raise ValueError("[%s] is not a binary data log" % path)
+        header = file.readline().decode('utf-8').strip().split(',')
+        offset = file.tell()
+
+    # Structured arrays need unique field names.
+    names = []
+    for name in header:
+        unique_name = name
+        count       = 1
+        while unique_name in names:
+            unique_name = "%s_%d" % (name, count)
+            count += 1
+        names.append(unique_name)
+
+    dtype        = np.dtype([(name, '<f8') for name in names])
+    record_count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if record_count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(record_count,))
@@ -0,0 +1,173 @@
+import threading
+import collections
+import heapq
+
+
+class LogQueue(object):
+    """
+    This is a thread safe, bounded queue of lines waiting to be written to a log file by the Logger thread.
+
+    Every flight software thread puts lines into these queues, only the Logger thread takes them out. Adding and
+    removing lines at either end is O(1). When the queue holds max_length lines the full_policy decides what happens:
+
+    drop_oldest     -- The oldest line in the queue is dropped to make room.
+    drop_info_first -- The oldest INFO line in the queue is dropped to make room, falling back to the oldest line.
+    block           -- The putting thread waits up to block_timeout for room, then falls back to drop_oldest so a
+                       dead Logger thread can never hang the rest of the flight software.
+
+    Dropped lines are counted per level so the Logger can report what was lost.
+
+    INFO lines are kept in their own deque, so the oldest of them can be dropped without searching. Every line is
+    numbered as it is put in, and lines are taken out in that order by comparing the heads of the two deques.
+
+    If a new_line_event is given it is set on every put so the Logger thread can sleep until there is work to do. The
+    asyncio runtime uses wake_event_loop to do the same for the logger task.
+    """
+    DROP_OLDEST     = "drop_oldest"
+    DROP_INFO_FIRST = "drop_info_first"
+    BLOCK           = "block"
+
+    def __init__(self, max_length: int = 10000, full_policy: str = "drop_oldest", block_timeout: float = 0.5,
+                 new_line_event: threading.Event = None) -> None:
+        """
+        Init of class.
+
+        :param max_length: Maximum number of lines held before full_policy applies.
+        :param full_policy: One of drop_oldest, drop_info_first or block.
+        :param block_timeout: Time [sec] the block policy waits for room before dropping the oldest line.
+        :param new_line_event: Event set whenever a line is put in the queue.
+        """
+        if full_policy not in [self.DROP_OLDEST, self.DROP_INFO_FIRST, self.BLOCK]:
+            raise ValueError("Unknown log queue full policy [%s]" % full_policy)
+        self.max_length          = max_length
+        self.full_policy         = full_policy
+        self.block_timeout       = block_timeout
+        self.new_line_event      = new_line_event
+        self.info_entries        = collections.deque()  # Queued [order, level, line] INFO entries, oldest left.
+        self.other_entries       = collections.deque()  # Queued [order, level, line] entries of other levels.
+        self.next_order          = 0                    # Order given to the next line put at the back.
+        self.front_order         = 0                    # Order given to the last line put back at the front.
+        self.dropped_line_counts = dict()               # Number of dropped lines keyed by level.
+        self.event_loop          = None                 # Loop of the task waiting on loop_new_line_event, if any.
+        self.loop_new_line_event = None                 # asyncio.Event set on the event_loop whenever a line is put.
+        self.mutex               = threading.Lock()
+        self.not_full            = threading.Condition(self.mutex)
+
+    def __len__(self) -> int:
+        return len(self.info_entries) + len(self.other_entries)
+
+    def oldest_deque(self) -> collections.deque:
+        """
+        :return: The deque holding the oldest entry, None if the queue is empty. The mutex must be held by the caller.
+        """
+        if len(self.info_entries) == 0:
+            return self.other_entries if len(self.other_entries) > 0 else None
+        if len(self.other_entries) == 0 or self.info_entries[0][0] < self.other_entries[0][0]:
+            return self.info_entries
+        return self.other_entries
+
+    def append(self, level: str, line: str) -> None:
+        """
+        This function puts an entry at the back of the queue. The mutex must be held by the caller.
+
+        :param level: Level of the line.
+        :param line: Complete line to write to the log file.
+        :return: None
+        """
+        entries = self.info_entries if level == "INFO" else self.other_entries
+        entries.append((self.next_order, level, line))
+        self.next_order += 1
+
+    def put(self, line: str, level: str = "INFO") -> None:
+        """
+        This function adds a line to the end of the queue, applying the full policy if there is no room.
+
+        :param line: Complete line to write to the log file, including the newline.
+        :param level: Level of the line (ERROR, WARNING, INFO, DATA, ...), used to pick and count dropped lines.
+        :return: None
+        """
+        with self.not_full:
+            if len(self) >= self.max_length:
+                if self.full_policy == self.BLOCK:
+                    self.not_full.wait_for(lambda: len(self) < self.max_length, self.block_timeout)
+                if len(self) >= self.max_length:
+                    self.drop_line()
+            self.append(level, line)
+        if self.new_line_event is not None:
+            self.new_line_event.set()
+        loop = self.event_loop
+        if loop is not None and not self.loop_new_line_event.is_set():
+            loop.call_soon_threadsafe(self.loop_new_line_event.set)
+
+    def wake_event_loop(self, loop, event) -> None:
+        """
+        This function makes put also set an asyncio.Event, which can only be set from its own event loop.
+
+        :param loop: Event loop of the task waiting on event, None to stop setting it.
+        :param event: asyncio.Event to set whenever a line is put.
+        :return: None
+        """
+        self.loop_new_line_event = event
+        self.event_loop          = loop
+
+    def drop_line(self) -> None:
+        """
+        This function drops one line from the queue to make room for a new one. The mutex must be held by the caller.
+
+        :return: None
+        """
+        if self.full_policy == self.DROP_INFO_FIRST and len(self.info_entries) > 0:
+            entries = self.info_entries
+        else:
+            entries = self.oldest_deque()
+        level = entries.popleft()[1]
+        self.dropped_line_counts[level] = self.dropped_line_counts.get(level, 0) + 1
+
+    def take_one(self) -> tuple:
+        """
+        This function removes and returns the oldest entry in the queue.
+
+        :return: Oldest [level, line] pair, or None if the queue is empty.
+        """
+        with self.not_full:
+            entries = self.oldest_deque()
+            if entries is None:
+                return None
+            entry = entries.popleft()
+            self.not_full.notify()
+        return entry[1:]
+
+    def take_all(self) -> list:
+        """
+        This function removes every entry currently in the queue and returns them oldest first.
+
+        :return: List of [level, line] pairs.
+        """
+        with self.not_full:
+            entries = list(heapq.merge(self.info_entries, self.other_entries))
+            self.info_entries.clear()
+            self.other_entries.clear()
+            self.not_full.notify_all()
+        return [entry[1:] for entry in entries]
+
+    def put_back(self, entries: list) -> None:
+        """
+        This function returns entries which failed to be written to the front of the queue, keeping their order.
+        Entries which no longer fit are dropped according to the full policy.
+
+        :param entries: [level, line] pairs taken from the queue that should be retried.
+        :return: None
+        """
+        with self.not_full:
+            for level, line in reversed(entries):
+                self.front_order -= 1
+                queued = self.info_entries if level == "INFO" else self.other_entries
+                queued.appendleft((self.front_order, level, line))
+            while len(self) > self.max_length:
+                self.drop_line()
+
+    def total_dropped(self) -> int:
+        """
+        :return: Total number of lines dropped since the queue was made.
+        """
+        return sum(self.dropped_line_counts.values())
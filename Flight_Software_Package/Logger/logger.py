@@ -3,8 +3,12 @@ import yaml
 import os
 import datetime
 import time
+import heapq
 import socket
 from sys import platform
+from Logger.log_queue import LogQueue
+from Logger.timestamp import utc_timestamp, log_line_timestamp
+from Logger.binary_log import BinaryDataLog
 
 class Logger(threading.Thread):
     """
@@ -28,6 +32,16 @@ class Logger(threading.Thread):
         self.notifications_log_path  = None  # Path to where the notification file for today is stored.
         self.data_log_path           = None  # Path to where the data file for today is stored.
         self.main_delay              = None  # Thread delay time.
+        self.max_flush_delay         = 1     # Longest time [sec] the batched writer sleeps while waiting for lines.
+        self.batch_window            = 0.005 # Time [sec] the batched writer waits after waking so a burst is one write.
+        self.batched_writer          = True  # Keep log files open and write the whole buffer each tick.
+        self.fsync_interval          = 5     # How often [sec] the open log files are forced to disk.
+        self.stats_report_interval   = 60    # How often [sec] the writer reports backlog and throughput.
+        self.notifications_buffer_size = 20000             # Max lines waiting to be written to the notifications file.
+        self.data_buffer_size          = 20000             # Max lines waiting to be written to the data file.
+        self.buffer_full_policy        = "drop_info_first" # What to do when a buffer is full, see LogQueue.
+        self.buffer_block_timeout      = 0.5               # Max wait [sec] of a logging thread under the block policy.
+        self.binary_data_log           = False             # Also write data lines to the binary data log.
 
         self.should_thread_run       = True  # Should thread be running.
         self.log_file_verbose        = False # Should print log file activity to console.
@@ -41,8 +55,15 @@ class Logger(threading.Thread):
         self.class_name  = "Logger"             # Class name for logger
         self.system_name = socket.gethostname() # System name for logger
 
-        self.notifications_logging_buffer = []  # Buffer of information to be logged to the notifications file.
-        self.data_logging_buffer          = []  # Buffer of information to be logged to the data file.
+        # Batched writer state. The log files are held open for the life of the thread when in batched mode.
+        self.notifications_file        = None  # Open handle of the notifications log file.
+        self.data_file                 = None  # Open handle of the data log file.
+        self.last_fsync_time           = time.time()
+        self.last_stats_report_time    = time.time()
+        self.lines_written_since_stats = 0     # Lines written since the last statistics report.
+        self.backlog_depth             = 0     # Number of lines waiting in the buffers at the last write.
+        self.lines_per_second          = 0.0   # Write rate measured over the last statistics interval.
+        self.binary_data_log_writer    = None  # Writer of the binary data log, made when the log files are opened.
 
         # Checks for current operating system and defines paths to configuration file. Linux path needs to be absolute
         # since the method of starting the program on pi power up needs absolute path for the proper file to be found.
@@ -57,6 +78,18 @@ class Logger(threading.Thread):
             self.yaml_config_path = None
 
         self.load_yaml_settings()
+
+        # Buffers of information to be logged to the notifications and data files. Both set new_line_event when a
+        # line is added, which wakes the batched writer.
+        self.new_line_event               = threading.Event()
+        self.notifications_logging_buffer = LogQueue(self.notifications_buffer_size, self.buffer_full_policy,
+                                                     self.buffer_block_timeout, self.new_line_event)
+        # The data buffer holds no INFO lines, so dropping INFO first there is dropping the oldest.
+        data_full_policy = self.buffer_full_policy
+        if data_full_policy == LogQueue.DROP_INFO_FIRST:
+            data_full_policy = LogQueue.DROP_OLDEST
+        self.data_logging_buffer          = LogQueue(self.data_buffer_size, data_full_policy,
+                                                     self.buffer_block_timeout, self.new_line_event)
         self.instantiate_log_files()
 
     def load_yaml_settings(self)->None:
@@ -85,6 +118,16 @@ class Logger(threading.Thread):
         self.log_file_verbose       = content['log_file_verbose']
         self.run_logger_diagnostics = content['run_logger_diagnostics']
         self.main_delay             = content['main_delay']
+        self.max_flush_delay        = content['max_flush_delay']
+        self.batch_window           = content['batch_window']
+        self.batched_writer         = content['batched_writer']
+        self.fsync_interval         = content['fsync_interval']
+        self.stats_report_interval  = content['stats_report_interval']
+        self.notifications_buffer_size = content['notifications_buffer_size']
+        self.data_buffer_size          = content['data_buffer_size']
+        self.buffer_full_policy        = content['buffer_full_policy']
+        self.buffer_block_timeout      = content['buffer_block_timeout']
+        self.binary_data_log           = content['binary_data_log']
 
     def instantiate_log_files(self)->None:
         """
@@ -113,8 +156,8 @@ class Logger(threading.Thread):
         This function will write a item in the notifications log buffer to the appropriate log file and print it to
         console.
 
-        Since new items are appended to the buffer write the first index (oldest in time) lines first and then delete
-        them from the buffer.
+        Since new items are appended to the buffer write the first (oldest in time) lines first. If the write fails
+        the line is put back at the front of the buffer.
 
         Written by Daniel Letros, 2018-06-27
 
@@ -123,14 +166,15 @@ class Logger(threading.Thread):
 
         # Do a try except here since there is no need to crash the program if something goes wrong with the file write.
         self.start_logger_diagnostics("write_notification_to_log")
+        entry = self.notifications_logging_buffer.take_one()
         try:
             with open(self.notifications_log_path, 'a') as file:
-                file.write(self.notifications_logging_buffer[0])
+                file.write(entry[1])
             if self.log_file_verbose:
-                print("NOTIFICATION << " + self.notifications_logging_buffer[0])
-            del self.notifications_logging_buffer[0]
+                print("NOTIFICATION << " + entry[1])
         except:
-            print('FAILED TO WRITE [%s] TO LOG FILE' %(self.notifications_logging_buffer[0]))
+            print('FAILED TO WRITE [%s] TO LOG FILE' %(entry[1]))
+            self.notifications_logging_buffer.put_back([entry])
         self.end_logger_diagnostics("write_notification_to_log")
 
     def write_data_to_log(self)->None:
@@ -138,8 +182,8 @@ class Logger(threading.Thread):
         This function will write a item in the data log buffer to the appropriate log file and print it to
         console.
 
-        Since new items are appended to the buffer write the first index (oldest in time) lines first and then delete
-        them from the buffer.
+        Since new items are appended to the buffer write the first (oldest in time) lines first. If the write fails
+        the line is put back at the front of the buffer.
 
         Written by Daniel Letros, 2018-06-27
 
@@ -148,16 +192,154 @@ class Logger(threading.Thread):
 
         # Do a try except here since there is no need to crash the program if something goes wrong with the file write.
         self.start_logger_diagnostics("write_data_to_log")
+        entry = self.data_logging_buffer.take_one()
         try:
             with open(self.data_log_path, 'a') as file:
-                file.write(self.data_logging_buffer[0])
+                file.write(entry[1])
             if self.log_file_verbose:
-                print("DATA << " + self.data_logging_buffer[0])
-            del self.data_logging_buffer[0]
+                print("DATA << " + entry[1])
         except:
-            print('FAILED TO WRITE [%s] TO LOG FILE' % (self.data_logging_buffer[0]))
+            print('FAILED TO WRITE [%s] TO LOG FILE' % (entry[1]))
+            self.data_logging_buffer.put_back([entry])
         self.end_logger_diagnostics("write_data_to_log")
 
+    def open_log_files(self)->None:
+        """
+        This function opens the notifications and data log files for appending and keeps the handles for the batched
+        writer. Line buffering is not used, the files are flushed once per write cycle instead.
+
+        :return: None
+        """
+        self.close_log_files()
+        self.notifications_file = open(self.notifications_log_path, 'a')
+        self.data_file          = open(self.data_log_path, 'a')
+        self.last_fsync_time    = time.time()
+        if self.binary_data_log:
+            self.binary_data_log_writer = BinaryDataLog(self.log_file_path, os.path.basename(self.log_file_path))
+
+    def close_log_files(self)->None:
+        """
+        This function flushes, syncs and closes the log files held open by the batched writer.
+
+        :return: None
+        """
+        for file in [self.notifications_file, self.data_file]:
+            if file is not None:
+                try:
+                    file.flush()
+                    os.fsync(file.fileno())
+                    file.close()
+                except:
+                    print('FAILED TO CLOSE LOG FILE [%s]' % file.name)
+        self.notifications_file = None
+        self.data_file          = None
+        if self.binary_data_log_writer is not None:
+            try:
+                self.binary_data_log_writer.close()
+            except:
+                print('FAILED TO CLOSE BINARY DATA LOG')
+
+    def write_buffers_to_log(self)->None:
+        """
+        This function writes everything in both logging buffers to the open log files with one writelines call per file.
+
+        If a write fails the lines are put back at the front of their buffer so they are tried again next cycle.
+        Taking the lines out of a buffer is O(1) per line, and other threads can keep logging while the files are
+        written.
+
+        Lines are stamped before they are queued, so lines from threads running at the same time (e.g. the serial port
+        workers) can reach a buffer slightly out of order. Each batch is sorted by timestamp before it is written.
+
+        The lines written from both buffers are merged in time order for the binary data log, so a header change
+        lands between the data lines logged before and after it.
+
+        :return: None
+        """
+        self.start_logger_diagnostics("write_buffers_to_log")
+        written_batches = []
+        for buffer, file, verbose_tag in [(self.notifications_logging_buffer, self.notifications_file, "NOTIFICATION"),
+                                          (self.data_logging_buffer,          self.data_file,          "DATA")]:
+            if len(buffer) == 0:
+                continue
+            entries = sorted(buffer.take_all(), key=log_line_timestamp)
+            lines   = [entry[1] for entry in entries]
+            try:
+                file.writelines(lines)
+                file.flush()
+                self.lines_written_since_stats += len(lines)
+                if self.log_file_verbose:
+                    print("".join(["%s << %s" % (verbose_tag, line) for line in lines]), end="")
+            except:
+                print('FAILED TO WRITE [%d] LINES TO LOG FILE [%s]' % (len(lines), file.name))
+                buffer.put_back(entries)
+                continue
+            written_batches.append(entries)
+        if self.binary_data_log_writer is not None and len(written_batches) > 0:
+            self.write_entries_to_binary_log(list(heapq.merge(*written_batches, key=log_line_timestamp)))
+        self.backlog_depth = len(self.notifications_logging_buffer) + len(self.data_logging_buffer)
+
+        if (time.time() - self.last_fsync_time) >= self.fsync_interval:
+            self.fsync_log_files()
+        self.end_logger_diagnostics("write_buffers_to_log")
+
+    def write_entries_to_binary_log(self, entries: list)->None:
+        """
+        This function passes lines just written to the text logs on to the binary data log. HEADER lines switch the
+        binary log to the file for that header, data lines are appended as records.
+
+        :param entries: [level, line] pairs written to the text logs, in time order.
+        :return: None
+        """
+        try:
+            data_lines = []
+            for level, line in entries:
+                if level == "HEADER":
+                    self.binary_data_log_writer.write_lines(data_lines)
+                    data_lines = []
+                    self.binary_data_log_writer.set_header(line.split("<<")[-1])
+                elif level == "DATA":
+                    data_lines.append(line)
+            self.binary_data_log_writer.write_lines(data_lines)
+        except Exception as err:
+            print('FAILED TO WRITE TO BINARY DATA LOG [%s]' % str(err))
+
+    def fsync_log_files(self)->None:
+        """
+        This function forces the open log files to disk so a power loss does not lose more than fsync_interval of logs.
+
+        :return: None
+        """
+        try:
+            os.fsync(self.notifications_file.fileno())
+            os.fsync(self.data_file.fileno())
+            if self.binary_data_log_writer is not None:
+                self.binary_data_log_writer.fsync()
+        except:
+            print('FAILED TO FSYNC LOG FILES')
+        self.last_fsync_time = time.time()
+
+    def report_writer_statistics(self)->None:
+        """
+        This function reports the backlog depth and write rate of the batched writer to the notifications log.
+
+        :return: None
+        """
+        elapsed = time.time() - self.last_stats_report_time
+        if elapsed < self.stats_report_interval:
+            return
+        self.lines_per_second          = self.lines_written_since_stats / elapsed
+        self.lines_written_since_stats = 0
+        self.last_stats_report_time    = time.time()
+        message = "Writer backlog [%d] lines, writing [%.2f] lines/s" % (self.backlog_depth, self.lines_per_second)
+        level   = "INFO"
+        for name, buffer in [("notifications", self.notifications_logging_buffer), ("data", self.data_logging_buffer)]:
+            if buffer.total_dropped() > 0:
+                # Report losses as a warning so they are not the first thing dropped under drop_info_first.
+                level    = "WARNING"
+                message += ", dropped %s lines %s" % (name, str(buffer.dropped_line_counts))
+        self.notifications_logging_buffer.put("%s << %s << %s << %s << %s\n" % (
+            level, utc_timestamp(), self.system_name, self.class_name, message), level)
+
     def start_logger_diagnostics(self, function_name: str):
         """
         This function will start function diagnostics on all logger functions
@@ -189,6 +371,21 @@ class Logger(threading.Thread):
                      self.function_logger_diagnostics_start_time).total_seconds()))
             print("\n")
 
+    def run_once(self)->None:
+        """
+        This function does one pass of the logging main loop. The batched writer writes everything buffered, otherwise
+        one line is written.
+
+        :return: None
+        """
+        if self.batched_writer:
+            self.write_buffers_to_log()
+            self.report_writer_statistics()
+        elif len(self.notifications_logging_buffer) > 0:
+            self.write_notification_to_log()
+        elif len(self.data_logging_buffer) > 0:
+            self.write_data_to_log()
+
     def run(self):
         """
         This is the main function of the logging thread.
@@ -198,11 +395,21 @@ class Logger(threading.Thread):
         :return: None
         """
         print("%s << %s << Starting Thread" % (self.system_name, self.class_name))
-        while self.should_thread_run:
-            if len(self.notifications_logging_buffer) > 0:
-                self.write_notification_to_log()
-            elif len(self.data_logging_buffer) > 0:
-                self.write_data_to_log()
-            time.sleep(self.main_delay)
+        if self.batched_writer:
+            # Keep the files open and sleep until a line is logged. The wait is bounded by max_flush_delay so fsyncs,
+            # statistics and the should_thread_run check still happen when nothing is being logged.
+            self.open_log_files()
+            while self.should_thread_run:
+                if self.new_line_event.wait(self.max_flush_delay):
+                    time.sleep(self.batch_window)
+                self.new_line_event.clear()
+                self.run_once()
+            # Get anything logged during shutdown onto disk before closing.
+            self.write_buffers_to_log()
+            self.close_log_files()
+        else:
+            while self.should_thread_run:
+                self.run_once()
+                time.sleep(self.main_delay)
         print("%s << %s << Ending Thread" % (self.system_name, self.class_name))
 
@@ -0,0 +1,194 @@
+import asyncio
+import time
+from Serial_Communication.serial_request import SerialRequestQueue
+
+"""
+Serial I/O for the asyncio runtime (general: runtime: asyncio, see Common/async_runtime.py).
+
+AsyncPortWorker stands in for SerialPortWorker, with the same start/stop/request_queue interface, so
+SerialCommunication opens, routes to and resets ports the same way in both runtimes. Instead of a thread blocking in
+readline, the port is put in non-blocking mode and the event loop is told to call back when its file descriptor has
+something to read. Needs file descriptors the loop can watch, so Linux/macOS only. Speaks the unframed protocol only,
+one request at a time, whatever serial_communication: framed_protocol is set to.
+"""
+
+
+class AsyncRequestQueue(SerialRequestQueue):
+    """
+    SerialRequestQueue which a coroutine can wait on. Requests can still be put from any thread.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Init of class.
+
+        :param loop: Event loop the waiting coroutine runs on.
+        """
+        super().__init__()
+        self.loop         = loop
+        self.has_requests = asyncio.Event()  # Set when a request is put, cleared by the waiting coroutine.
+
+    def put(self, request):
+        super().put(request)
+        self.loop.call_soon_threadsafe(self.has_requests.set)
+        return request
+
+    async def get_async(self):
+        """
+        This function takes the most urgent request, waiting for one if there are none.
+
+        :return: The request.
+        """
+        while True:
+            request = self.get(0)
+            if request is not None:
+                return request
+            self.has_requests.clear()
+            if len(self) == 0:
+                await self.has_requests.wait()
+
+
+class AsyncLineReader(object):
+    """
+    Collects what arrives on a serial port into lines, without blocking the event loop.
+    """
+
+    def __init__(self, serial_port, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Init of class. Puts the port in non-blocking mode and starts watching it.
+
+        :param serial_port: Open serial.Serial object.
+        :param loop: Event loop to watch the port on.
+        """
+        self.serial_port = serial_port
+        self.loop        = loop
+        self.buffer      = bytearray()  # Bytes read and not yet returned as a line.
+        self.waiter      = None         # Future readline is waiting on, if any.
+        self.closed      = False        # True once the port is no longer watched.
+        self.serial_port.timeout = 0    # read() returns whatever is there right away.
+        self.loop.add_reader(self.serial_port.fileno(), self.on_readable)
+
+    def on_readable(self) -> None:
+        """
+        This function is called by the event loop when the port has data.
+
+        :return: None
+        """
+        try:
+            self.buffer += self.serial_port.read(max(self.serial_port.in_waiting, 1))
+        except Exception:
+            # Port is gone. Stop watching it and let the waiting readline return what it has.
+            self.close()
+        if self.waiter is not None and not self.waiter.done() and (b"\n" in self.buffer or self.closed):
+            self.waiter.set_result(None)
+
+    async def readline(self, timeout: float) -> bytes:
+        """
+        This function waits for a line, like serial.Serial.readline.
+
+        :param timeout: Most time [sec] to wait.
+        :return: The line, with its EOL. A partial line or b"" on time out, as pyserial returns.
+        """
+        if b"\n" not in self.buffer:
+            self.waiter = self.loop.create_future()
+            try:
+                await asyncio.wait_for(self.waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.waiter = None
+        end = self.buffer.find(b"\n") + 1
+        if end == 0:
+            end = len(self.buffer)
+        line = bytes(self.buffer[0:end])
+        del self.buffer[0:end]
+        return line
+
+    def close(self) -> None:
+        """
+        This function stops watching the port. The port itself is closed by SerialCommunication.
+
+        :return: None
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.loop.remove_reader(self.serial_port.fileno())
+        except Exception:
+            pass
+
+
+class AsyncPortWorker(object):
+    """
+    Serves the requests to one port as a task on the event loop of SerialCommunication.
+    """
+
+    def __init__(self, serial_object, port: str) -> None:
+        """
+        Init of class.
+
+        :param serial_object: Reference to the SerialCommunication object which owns the port.
+        :param port: Port this worker serves.
+        """
+        self.serial_object = serial_object
+        self.port          = port
+        self.loop          = serial_object.event_loop
+        self.request_queue = AsyncRequestQueue(self.loop)  # Transactions waiting for this port.
+        self.reader        = None                          # Line reader of the port, made on start.
+        self.task          = None                          # Task serving the queue.
+
+    def start(self) -> None:
+        self.reader = AsyncLineReader(self.serial_object.port_list[self.port], self.loop)
+        self.task   = self.loop.create_task(self.run())
+
+    def is_alive(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def stop(self, error: Exception) -> None:
+        """
+        This function cancels the worker task and fails the requests waiting for it.
+
+        :param error: Exception to set on the waiting requests.
+        :return: None
+        """
+        self.request_queue.clear(error)
+        if self.task is not None:
+            self.task.cancel()
+        if self.reader is not None:
+            self.reader.close()
+
+    def clear_requests(self, error: Exception, keep_priority: int = None) -> None:
+        self.request_queue.clear(error, keep_priority)
+
+    def join(self, timeout: float = None) -> None:
+        # Nothing to wait for. The task ends at its next await after being cancelled.
+        pass
+
+    async def run(self) -> None:
+        """
+        This function is the main loop of the worker task. It serves the requests to its port one at a time.
+
+        :return: None
+        """
+        while True:
+            if not self.serial_object.link_is_up():
+                # Hold the requests until the link is back, see SerialCommunication.step_link_state.
+                await asyncio.sleep(self.serial_object.main_delay)
+                continue
+            request = await self.request_queue.get_async()
+            try:
+                if self.serial_object.begin_request(request):
+                    raw_line  = await self.reader.readline(self.serial_object.default_timeout)
+                    line_time = time.monotonic()
+                    self.serial_object.finish_request(request, self.serial_object.readline_from_serial(
+                        self.port, request.response_type, raw_line, line_time))
+            except asyncio.CancelledError:
+                if not request.future.done():
+                    request.future.set_exception(ConnectionResetError("[%s] worker stopped" % self.port))
+                raise
+            except Exception as err:
+                self.serial_object.log_error("Main function error [%s] on [%s] request to [%s]" % (
+                    str(err), request.response_type, request.port))
+                if not request.future.done():
+                    request.future.set_exception(err)
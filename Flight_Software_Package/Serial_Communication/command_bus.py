@@ -0,0 +1,68 @@
+import queue
+import threading
+import time
+
+
+class CommandBus(object):
+    """
+    This class hands uplink commands from the serial object to the threads which act on them. Each consumer subscribes
+    a mailbox to the command names it handles and waits on it, so it is woken as soon as a command for it is read.
+
+    The subscriptions are a dict which is replaced, never changed, when a subscription is added or removed. Publishing
+    only reads it, so the serial thread never waits on a lock to hand over a command.
+    """
+
+    def __init__(self) -> None:
+        """
+        Init of class.
+        """
+        self.subscriptions = dict()            # Command name (lower case): tuple of mailboxes. Replaced on change.
+        self.mutex         = threading.Lock()  # Lock on changing the subscriptions, publishing does not take it.
+
+    def subscribe(self, command_names: list, mailbox=None):
+        """
+        This function subscribes a mailbox to commands.
+
+        :param command_names: Commands to receive, matched without regard to case.
+        :param mailbox: Object with a put method to deliver to, a new queue.SimpleQueue if None.
+        :return: The mailbox. It gets a (command, time.monotonic() it was published) pair for each command.
+        """
+        if mailbox is None:
+            mailbox = queue.SimpleQueue()
+        with self.mutex:
+            subscriptions = dict(self.subscriptions)
+            for name in command_names:
+                name = name.lower()
+                if mailbox not in subscriptions.get(name, ()):
+                    subscriptions[name] = subscriptions.get(name, ()) + (mailbox,)
+            self.subscriptions = subscriptions
+        return mailbox
+
+    def unsubscribe(self, mailbox) -> None:
+        """
+        This function stops delivering commands to a mailbox.
+
+        :param mailbox: Mailbox returned by subscribe.
+        :return: None
+        """
+        with self.mutex:
+            subscriptions = dict()
+            for name, mailboxes in self.subscriptions.items():
+                mailboxes = tuple(subscribed for subscribed in mailboxes if subscribed is not mailbox)
+                if len(mailboxes) > 0:
+                    subscriptions[name] = mailboxes
+            self.subscriptions = subscriptions
+
+    def publish(self, command: str) -> int:
+        """
+        This function delivers a command to every mailbox subscribed to it.
+
+        :param command: Command as uplinked, surrounding whitespace is ignored.
+        :return: Number of mailboxes it was delivered to.
+        """
+        command   = command.strip()
+        mailboxes = self.subscriptions.get(command.lower(), ())
+        published = time.monotonic()
+        for mailbox in mailboxes:
+            mailbox.put((command, published))
+        return len(mailboxes)
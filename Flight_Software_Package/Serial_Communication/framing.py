@@ -0,0 +1,172 @@
+import threading
+import time
+
+"""
+Framed protocol over the arduino serial link (serial_communication: framed_protocol: True in master_config.yaml).
+
+Without it every command waits for its response line before the next one is written, so a round trip per command is
+spent idle. With it a command is sent as
+
+    @<seq><length><command>     seq as 2 hex digits, length of command as 3 hex digits, no EOL
+
+and the arduino answers with the line
+
+    @<seq>:<response>
+
+so several commands can be written before the first response is back, and each response is matched to its command by
+seq. The arduino still answers bare commands the old way, see handleCommand in arduino_thread_controller.ino.
+"""
+
+MAX_SEQ         = 256  # seq is 2 hex digits.
+MAX_PAYLOAD_LEN = 250  # Size of the command buffer on the arduino.
+
+
+def encode_frame(seq: int, message) -> bytes:
+    """
+    This function makes the frame for a command.
+
+    :param seq: Sequence number, 0 to 255.
+    :param message: Command, str or bytes.
+    :raises ValueError: If the command is too long for the arduino.
+    :return: The frame.
+    """
+    if type(message) is str:
+        message = message.encode('utf-8')
+    if len(message) > MAX_PAYLOAD_LEN:
+        raise ValueError("message of %d bytes is longer than the %d allowed in a frame" % (len(message),
+                                                                                         MAX_PAYLOAD_LEN))
+    return b"@%02X%03X" % (seq % MAX_SEQ, len(message)) + message
+
+
+class FrameParser(object):
+    """
+    Splits the bytes read from the arduino into response lines and the seq of the command each answers.
+    """
+
+    def __init__(self) -> None:
+        """
+        Init of class.
+        """
+        self.buffer = bytearray()  # Bytes of a line not yet complete.
+
+    def feed(self, data: bytes) -> list:
+        """
+        This function takes bytes read from the port and returns the lines they complete.
+
+        :param data: Bytes read.
+        :return: List of (seq, response) tuples, response without its EOL. seq is None for a line which is not framed.
+        """
+        self.buffer += data
+        lines = []
+        end   = self.buffer.find(b"\n")
+        while end >= 0:
+            line = bytes(self.buffer[0:end]).rstrip(b"\r")
+            del self.buffer[0:end + 1]
+            lines.append(self.parse_line(line))
+            end = self.buffer.find(b"\n")
+        return lines
+
+    @staticmethod
+    def parse_line(line: bytes) -> tuple:
+        """
+        :param line: One line, without its EOL.
+        :return: (seq, response). seq is None if the line is not framed.
+        """
+        if len(line) >= 4 and line[0:1] == b"@" and line[3:4] == b":":
+            try:
+                return int(line[1:3], 16), line[4:]
+            except ValueError:
+                pass
+        return None, line
+
+
+class InFlightTable(object):
+    """
+    Requests written to a port and waiting for their response, keyed by the seq they were sent with.
+
+    Holds at most max_in_flight requests, so the arduino serial buffer is not overrun and a response which never comes
+    only holds up a few requests.
+    """
+
+    def __init__(self, max_in_flight: int) -> None:
+        """
+        Init of class.
+
+        :param max_in_flight: Most requests waiting for a response at once.
+        """
+        self.max_in_flight = max(1, min(max_in_flight, MAX_SEQ))
+        self.requests      = dict()  # seq: (request, time.monotonic() it was sent)
+        self.next_seq      = 0
+        self.has_room      = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+    def wait_for_room(self, timeout: float = None) -> bool:
+        """
+        This function waits until another request can be sent.
+
+        :param timeout: Most time [sec] to wait, None to wait forever.
+        :return: True if there is room.
+        """
+        with self.has_room:
+            return self.has_room.wait_for(lambda: len(self.requests) < self.max_in_flight, timeout)
+
+    def add(self, request) -> int:
+        """
+        This function gives a request the next free seq. Call wait_for_room first.
+
+        :param request: Request about to be sent.
+        :return: The seq to send it with.
+        """
+        with self.has_room:
+            while self.next_seq in self.requests:
+                self.next_seq = (self.next_seq + 1) % MAX_SEQ
+            seq = self.next_seq
+            self.next_seq = (self.next_seq + 1) % MAX_SEQ
+            self.requests[seq] = (request, time.monotonic())
+            return seq
+
+    def pop(self, seq: int):
+        """
+        This function takes the request sent with seq out of the table.
+
+        :param seq: seq of the response.
+        :return: The request, None if there is no request waiting with that seq.
+        """
+        with self.has_room:
+            entry = self.requests.pop(seq, None)
+            self.has_room.notify()
+        if entry is None:
+            return None
+        return entry[0]
+
+    def pop_expired(self, timeout: float) -> list:
+        """
+        This function takes out the requests which have waited too long for their response.
+
+        :param timeout: Time [sec] a response may take.
+        :return: List of the requests taken out.
+        """
+        now = time.monotonic()
+        with self.has_room:
+            expired = [seq for seq in self.requests if now - self.requests[seq][1] > timeout]
+            requests = [self.requests.pop(seq)[0] for seq in expired]
+            if len(requests) > 0:
+                self.has_room.notify_all()
+        return requests
+
+    def clear(self, error: Exception) -> None:
+        """
+        This function fails every request in the table with the given error and empties it.
+
+        :param error: Exception to set on the requests.
+        :return: None
+        """
+        with self.has_room:
+            entries       = list(self.requests.values())
+            self.requests = dict()
+            self.has_room.notify_all()
+        for request, sent_time in entries:
+            if not request.future.done():
+                request.future.set_exception(error)
@@ -0,0 +1,93 @@
+import collections
+import threading
+
+
+class LatestValueCache(object):
+    """
+    This class holds the most recent value of something one thread produces and other threads read, such as the last
+    data line read from the arduino.
+
+    Each update bumps a version counter. A reader keeps the version it last saw and compares it to tell if a new value
+    has arrived since then, without reading any log files.
+    """
+
+    def __init__(self) -> None:
+        """
+        Init of class.
+        """
+        self.mutex   = threading.Lock()
+        self.value   = None  # Most recent value, None until the first update.
+        self.version = 0     # Number of updates so far.
+
+    def update(self, value) -> int:
+        """
+        This function replaces the cached value.
+
+        :param value: New value.
+        :return: Version of the new value.
+        """
+        with self.mutex:
+            self.value    = value
+            self.version += 1
+            return self.version
+
+    def get(self) -> tuple:
+        """
+        This function reads the cached value.
+
+        :return: [version, value] pair. Version is 0 and value is None if nothing has been cached yet.
+        """
+        with self.mutex:
+            return self.version, self.value
+
+    def has_changed_since(self, version: int) -> bool:
+        """
+        :param version: Version a reader last saw.
+        :return: True if the value has been updated since that version.
+        """
+        return self.version != version
+
+
+class SampleHistory(object):
+    """
+    This class keeps the most recent values of something one thread produces, such as the data lines read from the
+    arduino, so a reader which only checks in now and then can get everything produced since it last looked.
+
+    Values are numbered with the same kind of version counter as LatestValueCache. Only the newest max_length values
+    are kept, older ones are dropped as new ones come in.
+    """
+
+    def __init__(self, max_length: int = 512) -> None:
+        """
+        Init of class.
+
+        :param max_length: Most values kept.
+        """
+        self.mutex   = threading.Lock()
+        self.values  = collections.deque(maxlen=max_length)  # Newest values, oldest first.
+        self.version = 0                                     # Number of values appended so far.
+
+    def append(self, value) -> int:
+        """
+        This function adds a value to the history.
+
+        :param value: New value.
+        :return: Version of the new value.
+        """
+        with self.mutex:
+            self.values.append(value)
+            self.version += 1
+            return self.version
+
+    def get_since(self, version: int) -> tuple:
+        """
+        This function reads the values appended after a given version which are still kept.
+
+        :param version: Version a reader last saw, 0 for everything kept.
+        :return: [version, values] pair, version being that of the newest value and values a list, oldest first.
+        """
+        with self.mutex:
+            new_count = min(self.version - version, len(self.values))
+            if new_count <= 0:
+                return self.version, []
+            return self.version, list(self.values)[-new_count:]
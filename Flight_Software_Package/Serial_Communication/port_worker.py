@@ -0,0 +1,212 @@
+from Common.FSW_Common import *
+from Serial_Communication.serial_request import SerialRequestQueue, HIGH_PRIORITY
+from Serial_Communication.framing import encode_frame, FrameParser, InFlightTable
+
+
+class SerialPortWorker(FlightSoftwareParent):
+    """
+    This class does the serial I/O for one port. Every open port gets its own worker and request queue, so a slow or
+    silent device only holds up requests to itself.
+
+    Workers are started and stopped by SerialCommunication, which owns the ports. The transaction itself (write,
+    readline, logging of the response) is still done by SerialCommunication.serve_request.
+    """
+
+    def __init__(self, serial_object, port: str) -> None:
+        """
+        Init of class.
+
+        :param serial_object: Reference to the SerialCommunication object which owns the port.
+        :param port: Port this worker serves.
+        """
+        self.serial_object = serial_object                 # Reference to serial object.
+        self.port          = port                          # Port this worker serves.
+        self.main_delay    = serial_object.main_delay      # Longest wait for a request before checking for a stop.
+        super().__init__("SerialPortWorker", serial_object.logger)  # Run parent init.
+        self.name          = "SerialPortWorker %s" % port  # Thread name.
+        self.request_queue = SerialRequestQueue()          # Transactions waiting for this port.
+
+    def load_yaml_settings(self) -> None:
+        """
+        Workers use the settings of the SerialCommunication object that owns them.
+
+        :return: None
+        """
+        self.run_function_diagnostics = self.serial_object.run_function_diagnostics
+
+    def stop(self, error: Exception) -> None:
+        """
+        This function asks the worker to stop and fails the requests still waiting for it. The request being served,
+        if any, is finished first.
+
+        :param error: Exception to set on the waiting requests.
+        :return: None
+        """
+        self.should_thread_run = False
+        self.request_queue.clear(error)
+
+    def clear_requests(self, error: Exception, keep_priority: int = None) -> None:
+        """
+        This function fails every request waiting for this worker, as on a connection reset.
+
+        :param error: Exception to set on the requests.
+        :param keep_priority: If given, queued requests of this priority or more urgent are kept.
+        :return: None
+        """
+        self.request_queue.clear(error, keep_priority)
+
+    def run(self) -> None:
+        """
+        This function is the main loop of the worker. It waits for requests to its port and serves them one at a
+        time.
+
+        :return: None
+        """
+        print("%s << %s << Starting Thread [%s]" % (self.system_name, self.class_name, self.port))
+        while self.should_thread_run:
+            if not self.serial_object.link_is_up():
+                # Hold the requests until the link is back, see SerialCommunication.step_link_state.
+                time.sleep(self.main_delay)
+                continue
+            request = self.request_queue.get(self.main_delay)
+            if request is None:
+                continue
+            try:
+                self.serial_object.serve_request(request)
+            except Exception as err:
+                self.log_error("Main function error [%s] on [%s] request to [%s]" % (str(err), request.response_type,
+                                                                                  request.port))
+                if not request.future.done():
+                    request.future.set_exception(err)
+        # Anything queued while stopping will not be served.
+        self.request_queue.clear(ConnectionResetError("[%s] worker stopped" % self.port))
+        print("%s << %s << Exiting Thread [%s]" % (self.system_name, self.class_name, self.port))
+
+
+class FramedPortWorker(SerialPortWorker):
+    """
+    Port worker for the framed protocol (see framing.py). Up to max_in_flight requests are written before their
+    responses are back, and a second thread reads the responses and completes the request each one answers.
+    """
+
+    def __init__(self, serial_object, port: str) -> None:
+        """
+        Init of class.
+
+        :param serial_object: Reference to the SerialCommunication object which owns the port.
+        :param port: Port this worker serves.
+        """
+        super().__init__(serial_object, port)
+        self.in_flight     = InFlightTable(serial_object.max_in_flight)  # Requests sent and waiting for a response.
+        self.parser        = FrameParser()                               # Splits what is read into responses.
+        self.reader_thread = threading.Thread(target=self.read_responses, name="SerialPortReader %s" % port)
+        self.reader_thread.daemon = True
+
+    def stop(self, error: Exception) -> None:
+        """
+        This function asks the worker to stop and fails the requests waiting for it, sent or not.
+
+        :param error: Exception to set on the requests.
+        :return: None
+        """
+        super().stop(error)
+        self.in_flight.clear(error)
+
+    def clear_requests(self, error: Exception, keep_priority: int = None) -> None:
+        """
+        This function fails every request waiting for this worker, as on a connection reset. Requests already sent
+        are failed whatever their priority, their responses are lost with the connection.
+
+        :param error: Exception to set on the requests.
+        :param keep_priority: If given, queued requests of this priority or more urgent are kept.
+        :return: None
+        """
+        self.request_queue.clear(error, keep_priority)
+        self.in_flight.clear(error)
+
+    def fail_expired_requests(self) -> None:
+        """
+        This function fails the requests which got no response in time. A missing response is treated like an empty
+        line in the unframed protocol, as a sign the connection needs a reset.
+
+        :return: None
+        """
+        expired = self.in_flight.pop_expired(self.serial_object.default_timeout)
+        for request in expired:
+            self.log_error("[%s] returned no [%s] response. Attempting reconnect." % (self.port,
+                                                                                      request.response_type))
+            if not request.future.done():
+                request.future.set_exception(ConnectionError("no [%s] response from [%s]" % (request.response_type,
+                                                                                            self.port)))
+        if len(expired) > 0:
+            self.serial_object.reset_serial_connection()
+
+    def read_responses(self) -> None:
+        """
+        This function is the main loop of the reader thread. It reads response lines and completes the request each
+        one answers. It stops at the first failed read, the port is not read again until the worker is replaced when
+        the link is reset.
+
+        :return: None
+        """
+        serial_port = self.serial_object.port_list[self.port]
+        while self.should_thread_run:
+            try:
+                data      = serial_port.read(max(serial_port.in_waiting, 1))
+                read_time = time.monotonic()
+                for seq, response in self.parser.feed(data):
+                    if seq is None:
+                        if response != b"":
+                            self.log_warning("[%s] sent a line which is not framed, ignoring it." % self.port)
+                        continue
+                    request = self.in_flight.pop(seq)
+                    if request is None:
+                        self.log_warning("[%s] sent a response to [%02X] which is not waiting, ignoring it." % (
+                            self.port, seq))
+                        continue
+                    self.serial_object.finish_request(request, self.serial_object.readline_from_serial(
+                        self.port, request.response_type, response + b"\n", read_time))
+            except Exception as err:
+                if not self.should_thread_run:
+                    break  # Port closed as the worker was stopped.
+                self.log_error("read_responses error [%s] on [%s]" % (str(err), self.port))
+                self.serial_object.reset_serial_connection()
+                break  # The read would fail again straight away, a new worker reads the port after the reset.
+
+    def run(self) -> None:
+        """
+        This function is the main loop of the worker. It writes requests to its port as long as there are less than
+        max_in_flight waiting for a response, most urgent first. The last free place is kept for high and critical
+        priority requests, so an uplinked command does not wait behind a full window of data requests.
+
+        :return: None
+        """
+        print("%s << %s << Starting Thread [%s]" % (self.system_name, self.class_name, self.port))
+        self.reader_thread.start()
+        while self.should_thread_run:
+            self.fail_expired_requests()
+            if not self.serial_object.link_is_up():
+                time.sleep(self.main_delay)
+                continue
+            if not self.in_flight.wait_for_room(self.main_delay):
+                continue
+            max_priority = None
+            if 1 < self.in_flight.max_in_flight <= len(self.in_flight) + 1:
+                max_priority = HIGH_PRIORITY
+            request = self.request_queue.get(self.main_delay, max_priority)
+            if request is None:
+                continue
+            # Put in the table before writing, the response may be back before write returns.
+            seq = self.in_flight.add(request)
+            try:
+                if not self.serial_object.begin_request(request, encode_frame(seq, request.message)):
+                    self.in_flight.pop(seq)
+            except Exception as err:
+                self.in_flight.pop(seq)
+                self.log_error("Main function error [%s] on [%s] request to [%s]" % (str(err), request.response_type,
+                                                                                  request.port))
+                if not request.future.done():
+                    request.future.set_exception(err)
+        # Anything queued or sent while stopping will not be answered.
+        self.clear_requests(ConnectionResetError("[%s] worker stopped" % self.port))
+        print("%s << %s << Exiting Thread [%s]" % (self.system_name, self.class_name, self.port))
@@ -1,13 +1,27 @@
 from Common.FSW_Common import *
+import concurrent.futures
+from Serial_Communication.latest_value import LatestValueCache, SampleHistory
+from Serial_Communication.command_bus import CommandBus
+from Serial_Communication.serial_request import *
+from Serial_Communication.port_worker import SerialPortWorker, FramedPortWorker
+from I2C.photosensor_sampler import PhotosensorSampler
+
+# States of the serial link, see SerialCommunication.step_link_state.
+LINK_HEALTHY   = "HEALTHY"    # Ports are open and answering.
+LINK_DEGRADED  = "DEGRADED"   # A communication failed, waiting for things to settle before a reset.
+LINK_RESETTING = "RESETTING"  # Arduino reset pin is held low.
+LINK_PROBING   = "PROBING"    # Looking for ports to open.
 
 
 class SerialCommunication(FlightSoftwareParent):
     """
     This class is designed to handle generic serial communication for the RMC 549 balloon(s).
-    There is an enforced "call and respond" scheme but it can be intentionally circumvented by when needed.
+    Other threads talk to the devices by submitting SerialRequests, each a message written to a port and the line read
+    back in response. Each open port has a SerialPortWorker thread which serves the requests to that port one at a
+    time, most urgent first, so devices are talked to concurrently. This thread supervises the workers.
 
-    The i2c photosensors are handled by this class as well. It is not a elegant way of integrating the sensors code wise
-    but it was the quickest so it was done due to time constraints.
+    The i2c photosensors are read by a PhotosensorSampler thread owned by this class, and the reading nearest in time
+    is attached to each data line from the arduino.
 
     Written by Daniel Letros, 2018-06-27
     """
@@ -22,38 +36,65 @@ class SerialCommunication(FlightSoftwareParent):
         :param list_of_photosensors: List of photosensors.
         """
         # Serial_communication class will handle the data acq from the i2c pi sensors.
-        # If they are good load them up to be queued on data calls.
+        # If they are good load them up to be sampled and attached to data lines.
         self.list_of_photosensors = []
         for sensor in list_of_photosensors:
             if sensor.sensor_is_valid:
                 self.list_of_photosensors.append(sensor)
+        self.photosensor_sampler = PhotosensorSampler(logging_object, self.list_of_photosensors)
 
         self.default_buadrate  = 9600  # Buadrate of the serial communication.
         self.default_timeout   = 8     # Default time out on serial communication calls.
         self.main_delay        = 0.5   # Main delay for the thread.
         self.reconnection_wait = 5     # Time to wait when attempting a reconnection if something is wrong.
+        self.max_reconnection_wait = 60  # Longest wait between reconnection attempts as they back off.
         self.arduino_reset_pin = 23    # A BCM layout pi pin which can trigger a power cycle on the arduino.
+        self.framed_protocol   = False # Talk to the arduino with the framed protocol, see framing.py.
+        self.max_in_flight     = 4     # Most framed requests to a port waiting for a response at once.
+        self.port_patterns     = []    # Globs of ports to look for devices on, all ttys if empty.
+        self.probe_threads     = 8     # Most ports opened at once when finding ports.
+        self.priority_report_interval = 60  # How often the queue wait of each priority class is logged.
 
         super().__init__("SerialCommunication", logging_object) # Run parent init.
 
         # Keep track of active serial ports and if they have a problem or not.
         self.port_list        = dict()
         self.ports_are_good   = False
+        self.last_good_ports  = []  # Ports opened last time, tried first when finding ports again.
 
-        # Locks so different threads won't try to access the same variable at the same time.
-        self.serial_mutex          = threading.Lock()  # General lock on serial communication
-        self.uplink_commands_mutex = threading.Lock()  # Lock on accessing and using uplink commands
-
-        # Keeps track uplink commands and if they have been processed.
-        self.last_uplink_commands_valid         = False
-        self.last_uplink_seen_by_system_control = False
-        self.last_uplink_commands               = [""]
+        # State of the link, one of the LINK_ constants. Read it with link_state.get(), it never blocks.
+        self.link_state       = LatestValueCache()
+        self.link_state.update(LINK_PROBING)
+        self.link_step_time   = 0.0  # time.monotonic() at which step_link_state moves on from the current state.
+        self.reset_attempts   = 0    # Resets since the link was last healthy, sets the backoff.
+        self.connections_made = 0    # Number of times ports were found, so other threads can tell a reconnect.
 
-        self.expect_read_after_write = False  # Used to facilitate a call and respond system by default.
-                                              # Can be circumvented by changing state elsewhere in code.
-
-        self.read_request_buffer  = []  # buffer of ports to read from, [port, message_type], ...]
-        self.write_request_buffer = []  # buffer of ports to write to, [[port, message], ...]
+        # Locks so different threads won't try to access the same variable at the same time.
+        self.port_workers_mutex    = threading.Lock()  # Lock on starting and stopping port workers
+        self.link_mutex            = threading.Lock()  # Lock on changing the link state
+        self.queue_wait_mutex      = threading.Lock()  # Lock on the queue wait stats
+
+        # Uplink commands are published here as soon as they are read, threads which act on them subscribe.
+        self.command_bus = CommandBus()
+
+        # Newest data line (as written to the data log) for other threads to read without touching the log file.
+        self.latest_sample = LatestValueCache()
+        # Recent data lines, so telemetry can downlink the samples logged between transmissions too.
+        self.sample_history = SampleHistory()
+        # Newest ID and header lines read from the arduino, as logged to the notifications file.
+        self.latest_board_id    = LatestValueCache()
+        self.latest_data_header = LatestValueCache()
+
+        self.port_workers      = dict()            # SerialPortWorker of each open port, keyed by port.
+        self.port_worker_class = SerialPortWorker  # Made for each open port. AsyncPortWorker in the asyncio runtime.
+        if self.framed_protocol:
+            self.port_worker_class = FramedPortWorker
+        self.event_loop        = None              # Event loop of the asyncio runtime, None when running threads.
+
+        # Time requests waited before being sent, by priority: [requests sent, total wait, longest wait]. Reset on
+        # each report.
+        self.queue_wait_stats      = dict()
+        self.last_priority_report  = time.monotonic()
 
         try:
             # Configure the cutoff pin
@@ -79,8 +120,14 @@ class SerialCommunication(FlightSoftwareParent):
         self.default_buadrate  = content['default_baud_rate']
         self.default_timeout   = content['default_timeout']
         self.reconnection_wait = content['reconnection_wait']
+        self.max_reconnection_wait = content['max_reconnection_wait']
         self.main_delay        = content['main_delay']
         self.arduino_reset_pin = content['arduino_reset_pin']
+        self.framed_protocol   = content['framed_protocol']
+        self.max_in_flight     = content['max_in_flight']
+        self.port_patterns     = content['port_patterns']
+        self.probe_threads     = content['probe_threads']
+        self.priority_report_interval = content['priority_report_interval']
 
 
     def find_serial_ports(self, baudrate: int = None, timeout: float = None) -> None:
@@ -88,6 +135,9 @@ class SerialCommunication(FlightSoftwareParent):
         This function finds active serial ports and makes the serial connections. This function should
         only be run on startup or if something has changed with the connections.
 
+        The ports found last time are tried first, so a reconnect does not have to scan again. If any of them can not
+        be opened the candidate ports (see list_candidate_ports) are all tried. Ports are opened in parallel.
+
         Code from : https://stackoverflow.com/questions/12090503/listing-available-com-ports-with-python
 
         Adapted by: Daniel Letros, 2018-06-27
@@ -95,7 +145,7 @@ class SerialCommunication(FlightSoftwareParent):
         :param baudrate: buadrate of the connection
         :param timeout: Communication timeout
         :raises EnvironmentError: On unsupported platform
-        :return: List of the serial ports available
+        :return: None
         """
         self.start_function_diagnostics("find_serial_ports")
 
@@ -104,127 +154,316 @@ class SerialCommunication(FlightSoftwareParent):
         if timeout is None:
             timeout = self.default_timeout
 
-        # Clear old connections if any.
+        # Clear old connections if any. Requests still queued are handed to the new workers.
+        with self.port_workers_mutex:
+            held_requests = [request for worker in self.port_workers.values()
+                             for request in worker.request_queue.take_all()]
+        self.stop_port_workers(ConnectionResetError("serial ports are being found again"))
         for port in self.port_list:
             self.port_list[port].close()
         self.port_list.clear()
 
-        # Determine ports on current OS.
+        opened = dict()
+        if len(self.last_good_ports) > 0:
+            opened = self.open_serial_ports(self.last_good_ports, baudrate, timeout)
+            if len(opened) < len(self.last_good_ports):
+                # Something changed, look at everything again.
+                for port in opened:
+                    opened[port].close()
+                opened = dict()
+        if len(opened) == 0:
+            opened = self.open_serial_ports(self.list_candidate_ports(), baudrate, timeout)
+
+        self.port_list.update(opened)
+        if len(self.port_list) > 0:
+            self.last_good_ports = sorted(self.port_list)
+        self.start_port_workers()
+        for request in held_requests:
+            worker = self.port_workers.get(request.port)
+            if worker is None:
+                if not request.future.done():
+                    request.future.set_exception(ConnectionError("[%s] is not open" % request.port))
+            else:
+                worker.request_queue.put(request)
+
+        self.end_function_diagnostics("find_serial_ports")
+
+    def list_candidate_ports(self) -> list:
+        """
+        This function lists the ports which may have a device on them. On Linux and macOS these are the ports matching
+        port_patterns, in order, with ports which are links to the same device listed once. On Windows every COM port.
+
+        :raises EnvironmentError: On unsupported platform
+        :return: List of ports.
+        """
         if sys.platform.startswith('win'):
-            ports = ['COM%s' % (i + 1) for i in range(256)]
+            return ['COM%s' % (i + 1) for i in range(256)]
         elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
             # this excludes your current terminal "/dev/tty".
-            ports = glob.glob('/dev/tty[A-Za-z]*')
+            default_patterns = ['/dev/tty[A-Za-z]*']
         elif sys.platform.startswith('darwin'):
-            ports = glob.glob('/dev/tty.*')
+            default_patterns = ['/dev/tty.*']
         else:
             raise EnvironmentError('Unsupported platform')
+        patterns = self.port_patterns
+        if len(patterns) == 0:
+            patterns = default_patterns
+
+        ports   = []
+        devices = set()
+        for pattern in patterns:
+            for port in sorted(glob.glob(pattern)):
+                # /dev/serial/by-id entries are links to the /dev/tty* device.
+                device = os.path.realpath(port)
+                if device in devices:
+                    continue
+                if device == '/dev/ttyAMA0' and (self.system_name == 'MajorTom' or self.system_name == 'Rocky' or
+                                                 self.system_name == 'ColonelTom' or self.system_name == 'Creed'):
+                    continue  # AMA0 seems to be always "active" as is the Pi's PL011, leave it out.
+                devices.add(device)
+                ports.append(port)
+        return ports
+
+    def open_serial_ports(self, ports: list, baudrate: int, timeout: float) -> dict:
+        """
+        This function tries to open each port, several at a time.
 
-        result = []
-        for port in ports:
-            # Try opening port. If fail ignore it, else add it.
+        :param ports: Ports to try.
+        :param baudrate: buadrate of the connection
+        :param timeout: Communication timeout
+        :return: Dict of the opened serial.Serial objects, keyed by port.
+        """
+        def open_port(port):
+            # Try opening port. If fail ignore it, else keep it.
             try:
-                s = serial.Serial(port)
-                s.close()
-                result.append(port)
+                return serial.Serial(port=port, baudrate=baudrate,
+                                     parity=serial.PARITY_NONE,
+                                     stopbits=serial.STOPBITS_ONE,
+                                     bytesize=serial.EIGHTBITS,
+                                     timeout=timeout,
+                                     writeTimeout=timeout)
             except (OSError, serial.SerialException):
-                pass
+                return None
+
+        opened = dict()
+        if len(ports) == 0:
+            return opened
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.probe_threads, len(ports))) as pool:
+            for port, serial_port in zip(ports, pool.map(open_port, ports)):
+                if serial_port is not None:
+                    opened[port] = serial_port
+        return opened
+
+    def start_port_workers(self) -> None:
+        """
+        This function starts a worker for each open port which does not have a running one.
 
-        # Open ports.
-        if self.system_name == 'MajorTom' or self.system_name == 'Rocky' or self.system_name == 'ColonelTom' or self.system_name == 'Creed':
-            try:
-                result.remove('/dev/ttyAMA0')  # AMA0 seems to be always "active" as is the Pi's PL011, remove it.
-            except:
-                self.log_error("Could not remove [/dev/ttyAMA0] from port list.")
-        for port in result:
-            self.port_list[port] = serial.Serial(port=port, baudrate=baudrate,
-                               parity=serial.PARITY_NONE,
-                               stopbits=serial.STOPBITS_ONE,
-                               bytesize=serial.EIGHTBITS,
-                               timeout=timeout,
-                               writeTimeout=timeout)
+        :return: None
+        """
+        with self.port_workers_mutex:
+            for port in self.port_list:
+                if port not in self.port_workers or not self.port_workers[port].is_alive():
+                    self.port_workers[port] = self.port_worker_class(self, port)
+                    self.port_workers[port].start()
 
-        self.end_function_diagnostics("find_serial_ports")
+    def stop_port_workers(self, error: Exception) -> None:
+        """
+        This function stops every port worker and waits for them to finish the request they are serving.
+
+        :param error: Exception to set on the requests still waiting for a worker.
+        :return: None
+        """
+        with self.port_workers_mutex:
+            workers = list(self.port_workers.values())
+            self.port_workers.clear()
+        for worker in workers:
+            worker.stop(error)
+        for worker in workers:
+            if worker is not threading.current_thread():
+                worker.join()
+
+    def submit_request(self, port: str, message, response_type: str, priority: int = NORMAL_PRIORITY,
+                       timeout: float = None) -> SerialRequest:
+        """
+        This function queues a transaction with a device. It does not wait for it, wait on the returned request to
+        get the response.
+
+        :param port: Port to do the communication over.
+        :param message: Message to write, str or bytes.
+        :param response_type: Type of line expected back, dictates which file it is logged to.
+        :param priority: One of the _PRIORITY constants, lower is more urgent.
+        :param timeout: Time [sec] the request may wait in the queue before it is dropped, None to wait forever.
+        :return: The queued request. Fails with ConnectionError if the port has no worker.
+        """
+        request = SerialRequest(port, message, response_type, priority, timeout)
+        worker  = self.port_workers.get(port)
+        if worker is None:
+            request.future.set_exception(ConnectionError("[%s] is not open" % port))
+            return request
+        return worker.request_queue.put(request)
+
+    def serve_request(self, request: SerialRequest) -> None:
+        """
+        This function does one transaction: writes the request message and reads the response line, then completes
+        the request future with the line or the reason there is none.
+
+        :param request: Request to serve.
+        :return: None
+        """
+        if self.begin_request(request):
+            self.finish_request(request, self.readline_from_serial(request.port, request.response_type))
+
+    def begin_request(self, request: SerialRequest, message=None) -> bool:
+        """
+        This function does the first half of a transaction, writing the request message unless the request was
+        cancelled or has expired.
 
-    def readline_from_serial(self, port: str, type: str) -> None:
+        :param request: Request to serve.
+        :param message: What to write instead of the request message, e.g. the message in a frame.
+        :return: True if the message was written and the response should be read.
+        """
+        if not request.future.set_running_or_notify_cancel():
+            return False
+        if request.has_expired():
+            request.future.set_exception(TimeoutError("[%s] request expired before it was sent" % request.response_type))
+            return False
+        if message is None:
+            message = request.message
+        self.record_queue_wait(request)
+        if not self.write_to_serial(request.port, message):
+            request.future.set_exception(ConnectionError("could not write to [%s]" % request.port))
+            return False
+        return True
+
+    def record_queue_wait(self, request: SerialRequest) -> None:
+        """
+        This function adds the time a request waited before being sent to the stats of its priority class.
+
+        :param request: Request about to be sent.
+        :return: None
+        """
+        wait = time.monotonic() - request.created_time
+        with self.queue_wait_mutex:
+            stats = self.queue_wait_stats.setdefault(request.priority, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += wait
+            stats[2]  = max(stats[2], wait)
+
+    def report_queue_waits(self) -> None:
+        """
+        This function logs how long the requests of each priority class waited to be sent since the last report, and
+        starts the counts again.
+
+        :return: None
+        """
+        with self.queue_wait_mutex:
+            report                = self.queue_wait_stats
+            self.queue_wait_stats = dict()
+        names = {priority: name for name, priority in PRIORITY_CLASSES.items()}
+        for priority in sorted(report):
+            sent, total_wait, longest_wait = report[priority]
+            self.log_info("Priority [%s]: [%d] requests sent, queue wait mean [%.1f] max [%.1f] ms" % (
+                names.get(priority, priority), sent, total_wait / sent * 1000, longest_wait * 1000))
+
+    def finish_request(self, request: SerialRequest, response: str) -> None:
+        """
+        This function completes a request with its response line.
+
+        :param request: Request being served.
+        :param response: Line returned by readline_from_serial, None if the read failed.
+        :return: None
+        """
+        if response is not None:
+            self.reset_attempts = 0
+        if response is None:
+            request.future.set_exception(ConnectionError("no [%s] response from [%s]" % (request.response_type,
+                                                                                        request.port)))
+        else:
+            request.future.set_result(response)
+
+    def readline_from_serial(self, port: str, type: str, raw_line: bytes = None, line_time: float = None) -> str:
         """
         This function will read data on the port up to a EOL char and return it.
 
-        If the expected information to be read in is science data then append the i2c photosensor stuff
-        onto it.
+        If the expected information to be read in is science data then append the i2c photosensor reading nearest in
+        time onto it.
 
         Written by Daniel Letros, 2018-06-27
 
         :param port: port to do the communication over.
         :param type: type of data expected, dictated which file it is logged to.
-        :return: None
+        :param raw_line: Line already read from the port, as the asyncio runtime does. Read from the port if None.
+        :param line_time: time.monotonic() when raw_line arrived. Taken when the read returns if None.
+        :return: The line as logged, None if the read failed.
         """
         self.start_function_diagnostics("readline_from_serial")
+        line = None
         try:
             # Read in data and strip it of unwanted chars.
-            new_data = self.port_list[port].readline().decode('utf-8').strip()
+            if raw_line is None:
+                raw_line = self.port_list[port].readline()
+            if line_time is None:
+                line_time = time.monotonic()
+            new_data = raw_line.decode('utf-8').strip()
             new_data = new_data.replace("\n", "")
             new_data = new_data.replace("\r", "")
             if new_data == "" and type != "RX":
                 self.log_error("[%s] returned no data. Attempting reconnect." % port)
                 self.reset_serial_connection()
-                return
+                self.end_function_diagnostics("readline_from_serial")
+                return None
             elif type == "DATA":
-                # Try to get sensor data quickly. Should be multithreaded for
-                # max time resolution but this has to be quick and dirty right now.
-                current_sensor_data   = []
-                for sensor in self.list_of_photosensors:
-                    if sensor.sensor_is_valid:
-                        current_sensor_data.append(sensor._get_data())
-                # Append Pi photo sensor data if valid.
-                for data in current_sensor_data:
-                    # Valid photo sensor so append the header information.
-                    if new_data[-1] != ",":
-                        # Append ',' if not there at end.
-                        new_data += ","
-                    new_data += str(data[0])
-                    new_data += ","
-                    new_data += str(data[1])
+                # Sensors are read by the sampler thread, take its reading from when the line arrived. Fields are
+                # left empty if there is none, so the columns still match the header.
                 # remove ',' at end if needed.
                 if new_data[-1] == ",":
                     new_data = new_data[0:-1]
-
-                self.log_data(new_data)
+                readings = self.photosensor_sampler.nearest(line_time)
+                for i in range(len(self.photosensor_sampler.sensors)):
+                    if readings is None or readings[i] is None:
+                        new_data += ",,"
+                    else:
+                        new_data += ",%d,%d" % (readings[i][0], readings[i][1])
+
+                data_line = self.log_data(new_data)
+                self.latest_sample.update(data_line)
+                self.sample_history.append(data_line)
             elif type == "ID":
                 self.log_id(new_data)
+                self.latest_board_id.update(new_data)
             elif type == "HEADER":
 
-                # Append Pi photo sensor data if valid.
-                for sensor in self.list_of_photosensors:
-                    if sensor.sensor_is_valid:
-                        # Valid photo sensor so append the header information.
-                        if new_data[-1] != ",":
-                            # Append ',' if not there at end.
-                            new_data += ","
-                        new_data += sensor.data_header_addition
+                # Append the header information of the photosensors being sampled.
+                for sensor in self.photosensor_sampler.sensors:
+                    if new_data[-1] != ",":
+                        # Append ',' if not there at end.
+                        new_data += ","
+                    new_data += sensor.data_header_addition
                     # remove ',' at end if needed.
                     if new_data[-1] == ",":
                         new_data = new_data[0:-1]
                 new_data = "PiTS," + new_data
                 self.log_header(new_data)
+                self.latest_data_header.update(new_data)
             elif type == "TX":
                 self.log_tx_event(new_data)
             elif type == "RX" and new_data != "":
                 self.log_rx_event(new_data)
                 # Assume uplink commands will be a comma delimited list joined in one string.
-                with self.uplink_commands_mutex:
-                    self.last_uplink_commands               = new_data.split(',')
-                    self.last_uplink_commands_valid         = True
-                    self.last_uplink_seen_by_system_control = False
+                for command in new_data.split(','):
+                    if command.strip() != "" and self.command_bus.publish(command) == 0:
+                        self.log_warning("Nothing handles uplink command [%s], ignoring it." % command.strip())
             if new_data != "":
                 self.log_info("received [%s] information over [%s]" % (type, port))
+            line = new_data
 
         except Exception as err:
             self.log_error("readline_from_serial %s"%str(err))
             self.reset_serial_connection()
         self.end_function_diagnostics("readline_from_serial")
+        return line
 
-    def write_to_serial(self, port: str, message) -> None:
+    def write_to_serial(self, port: str, message) -> bool:
         """
         This function will write data to the port during serial communication.
 
@@ -232,9 +471,10 @@ class SerialCommunication(FlightSoftwareParent):
 
         :param port: The port for the serial communication
         :param message: The message/data to write
-        :return: None
+        :return: True if the message was written.
         """
         self.start_function_diagnostics("write_to_serial")
+        written = False
         # self.log_info("sending [%s] over [%s] with type [%s]" % (message, port,type(message)))
         if type(message) is str:
             msg = message.encode('utf-8')
@@ -243,15 +483,13 @@ class SerialCommunication(FlightSoftwareParent):
         try:
             # self.log_info("msg form is [%s] and is of type %s" % (msg,type(msg)))
             self.port_list[port].write(serial.to_bytes(msg))
-            if message is not "RX":
-                message.strip()
-                message = message.replace("\n", "")
-                message = message.replace("\r", "")
-                # self.log_info("sent [%s] over [%s]" % (message, port))
+            # self.log_info("sent [%s] over [%s]" % (message, port))
+            written = True
         except Exception as err:
             self.log_error("write_to_serial %s with message %s and the message is a %s" % (str(err),str(msg),type(msg)))
             self.reset_serial_connection()
         self.end_function_diagnostics("write_to_serial")
+        return written
 
     def log_id(self, log_message: str) -> None:
         """
@@ -262,8 +500,8 @@ class SerialCommunication(FlightSoftwareParent):
         :param log_message: ID message to log
         :return: None
         """
-        self.logger.notifications_logging_buffer.append("ID << %s << %s << %s << %s\n" % (
-            datetime.datetime.utcnow().strftime("%Y%m%d_%H:%M:%S.%f"), self.system_name, self.class_name, log_message))
+        self.logger.notifications_logging_buffer.put("ID << %s << %s << %s << %s\n" % (
+            utc_timestamp(), self.system_name, self.class_name, log_message), "ID")
 
     def log_header(self, log_message: str) -> None:
         """
@@ -274,8 +512,8 @@ class SerialCommunication(FlightSoftwareParent):
         :param log_message: Header message to log
         :return: None
         """
-        self.logger.notifications_logging_buffer.append("HEADER << %s << %s << %s << %s\n" % (
-            datetime.datetime.utcnow().strftime("%Y%m%d_%H:%M:%S.%f"), self.system_name, self.class_name, log_message))
+        self.logger.notifications_logging_buffer.put("HEADER << %s << %s << %s << %s\n" % (
+            utc_timestamp(), self.system_name, self.class_name, log_message), "HEADER")
 
     def log_tx_event(self, log_message: str) -> None:
         """
@@ -286,8 +524,8 @@ class SerialCommunication(FlightSoftwareParent):
         :param log_message: TX message to log
         :return: None
         """
-        self.logger.notifications_logging_buffer.append("TX << %s << %s << %s << %s\n" % (
-            datetime.datetime.utcnow().strftime("%Y%m%d_%H:%M:%S.%f"), self.system_name, self.class_name, log_message))
+        self.logger.notifications_logging_buffer.put("TX << %s << %s << %s << %s\n" % (
+            utc_timestamp(), self.system_name, self.class_name, log_message), "TX")
 
     def log_rx_event(self, log_message: str) -> None:
         """
@@ -298,64 +536,135 @@ class SerialCommunication(FlightSoftwareParent):
         :param log_message: RX message to log
         :return: None
         """
-        self.logger.notifications_logging_buffer.append("RX << %s << %s << %s << %s\n" % (
-            datetime.datetime.utcnow().strftime("%Y%m%d_%H:%M:%S.%f"), self.system_name, self.class_name, log_message))
+        self.logger.notifications_logging_buffer.put("RX << %s << %s << %s << %s\n" % (
+            utc_timestamp(), self.system_name, self.class_name, log_message), "RX")
 
     def reset_serial_connection(self):
         """
-        This function attempts a reset and reconnection to all serial connected devices in event of fail.
+        This function reports a failed communication, which starts a reset and reconnection to all serial connected
+        devices. The reset itself is done by step_link_state, so the caller does not wait for it.
 
         Written by Daniel Letros, 2018-07-06
 
         :return: None
         """
-        self.start_function_diagnostics("reset_serial_connection")
-        # Something is wrong. Wait for some data transition to get stable.
-        time.sleep(self.reconnection_wait)
-        if self.system_name == 'MajorTom' or self.system_name == 'Rocky' or self.system_name == 'ColonelTom' or self.system_name == 'Creed':
-            # Do power cycle pin for arduino.
-            GPIO.output(self.arduino_reset_pin, GPIO.LOW)
-            time.sleep(self.reconnection_wait/2)
-            GPIO.output(self.arduino_reset_pin, GPIO.HIGH)
-        # Do a full communication reset in this software.
-        self.ports_are_good          = False
-        self.read_request_buffer     = []
-        self.write_request_buffer    = []
-        self.expect_read_after_write = False
-        for port in self.port_list:
-            self.port_list[port].reset_input_buffer()
-            self.port_list[port].reset_output_buffer()
-        self.end_function_diagnostics("reset_serial_connection")
+        with self.link_mutex:
+            if self.link_state.get()[1] != LINK_HEALTHY:
+                return  # Already recovering.
+            # Something is wrong. Wait for some data transition to get stable, longer each failed attempt.
+            self.set_link_state(LINK_DEGRADED, self.backoff_delay())
+
+    def link_is_up(self) -> bool:
+        """
+        :return: True if the link is healthy and the port workers should serve requests.
+        """
+        return self.link_state.get()[1] == LINK_HEALTHY
 
-    def run(self):
+    def backoff_delay(self) -> float:
+        """
+        :return: Time [sec] to wait before the next reconnection attempt, doubling with each attempt since the link
+                 was last healthy.
+        """
+        return min(self.reconnection_wait * 2 ** min(self.reset_attempts, 16), self.max_reconnection_wait)
+
+    def set_link_state(self, state: str, delay: float = 0.0) -> None:
+        """
+        This function changes the link state.
+
+        :param state: One of the LINK_ constants.
+        :param delay: Time [sec] before step_link_state moves on from the new state.
+        :return: None
+        """
+        self.link_step_time = time.monotonic() + delay
+        if self.link_state.get()[1] != state:
+            self.link_state.update(state)
+            self.log_info("Serial link is [%s]" % state)
+
+    def step_link_state(self) -> None:
+        """
+        This function moves the reconnection along once the time for its current step has come, without waiting:
+
+        HEALTHY   -> DEGRADED   on a failure reported by reset_serial_connection.
+        DEGRADED  -> RESETTING  after the backoff delay. Pulls the arduino reset pin low and drops the queued requests,
+                                except high and critical priority ones such as uplinked commands.
+        RESETTING -> PROBING    after reconnection_wait/2. Releases the reset pin.
+        PROBING   -> HEALTHY    if ports are found. If not, tries again after the backoff delay.
+
+        :return: None
+        """
+        # Only this function moves the state on from anything but HEALTHY, so the lock is not needed here. Not
+        # holding it lets port workers report failures while ports are being found.
+        state = self.link_state.get()[1]
+        if state == LINK_HEALTHY or time.monotonic() < self.link_step_time:
+            return
+        if state == LINK_DEGRADED:
+            self.start_function_diagnostics("reset_serial_connection")
+            self.ports_are_good  = False
+            self.reset_attempts += 1
+            if self.system_name == 'MajorTom' or self.system_name == 'Rocky' or self.system_name == 'ColonelTom' or self.system_name == 'Creed':
+                # Do power cycle pin for arduino.
+                GPIO.output(self.arduino_reset_pin, GPIO.LOW)
+            # Do a full communication reset in this software.
+            with self.port_workers_mutex:
+                for worker in self.port_workers.values():
+                    worker.clear_requests(ConnectionResetError("serial connection was reset"), HIGH_PRIORITY)
+            for port in self.port_list:
+                try:
+                    self.port_list[port].reset_input_buffer()
+                    self.port_list[port].reset_output_buffer()
+                except Exception as err:
+                    self.log_error("Could not flush [%s] [%s]" % (port, str(err)))
+            self.set_link_state(LINK_RESETTING, self.reconnection_wait / 2)
+            self.end_function_diagnostics("reset_serial_connection")
+        elif state == LINK_RESETTING:
+            if self.system_name == 'MajorTom' or self.system_name == 'Rocky' or self.system_name == 'ColonelTom' or self.system_name == 'Creed':
+                GPIO.output(self.arduino_reset_pin, GPIO.HIGH)
+            self.set_link_state(LINK_PROBING)
+        elif state == LINK_PROBING:
+            self.find_serial_ports()
+            if len(self.port_list) > 0:
+                # Found some devices, YAY!
+                self.connections_made += 1
+                self.ports_are_good    = True
+                self.set_link_state(LINK_HEALTHY)
+            else:
+                self.log_warning("Don't see any devices. Looking again in [%s] sec." % self.backoff_delay())
+                self.set_link_state(LINK_PROBING, self.backoff_delay())
+                self.reset_attempts += 1
+
+    def run_once(self) -> None:
+        """
+        This function does one pass of the serial communication main loop: restarts any port worker which has died
+        while its port is still open, moves the link state along and now and then logs the queue wait stats.
+
+        :return: None
+        """
+        try:
+            with self.port_workers_mutex:
+                dead_ports = [port for port in self.port_workers if not self.port_workers[port].is_alive()]
+            if len(dead_ports) > 0:
+                self.log_error("Port workers %s stopped unexpectedly, restarting them." % str(dead_ports))
+                self.start_port_workers()
+            self.step_link_state()
+            if time.monotonic() - self.last_priority_report > self.priority_report_interval:
+                self.last_priority_report = time.monotonic()
+                self.report_queue_waits()
+        except Exception as err:
+            self.log_error("Main function error [%s]" % str(err))
+
+    def run(self) -> None:
+        """
+        This function is the main loop of the serial communication. The port workers do the I/O, this thread looks
+        after them and the link state, and stops them and the photosensor sampler when the thread ends.
+
+        :return: None
+        """
         print("%s << %s << Starting Thread" % (self.system_name, self.class_name))
+        self.photosensor_sampler.start()
         while self.should_thread_run:
-            msg="No assigned"
-            if len(self.write_request_buffer) > 0:
-                wmsg=self.write_request_buffer
-                # self.log_info("Messages in buffer: %s" % str(wmsg))
-                # self.log_info("To send: %s at type %s" % (str(wmsg[0]),type(wmsg[0][1])))
-                if not self.expect_read_after_write:
-                    msg=wmsg
-            elif len(self.read_request_buffer) > 0:
-                rmsg=self.read_request_buffer
-                # self.log_info("Reading: %s" % str(rmsg))
-                if self.expect_read_after_write:
-                    msg=rmsg
-            try:
-                if len(self.read_request_buffer) > 0 and self.expect_read_after_write:
-                    self.readline_from_serial(self.read_request_buffer[0][0], self.read_request_buffer[0][1])
-                    del self.read_request_buffer[0]
-                    self.expect_read_after_write = False
-                elif len(self.write_request_buffer) > 0 and not self.expect_read_after_write:                    
-#                    self.log_info("sending [%s] " % self.write_request_buffer[0][1])
-#                    self.log_info("over [%s] " % self.write_request_buffer[0][0])
-#                    self.log_info("with type [%s]" % type(self.write_request_buffer[0][1]))
-                    self.write_to_serial(self.write_request_buffer[0][0], self.write_request_buffer[0][1])
-                    del self.write_request_buffer[0]
-                    self.expect_read_after_write = True
-            except Exception as err:
-                self.log_error("Main function error [%s] on message %s" % (str(err),str(msg)))
-
+            self.run_once()
             time.sleep(self.main_delay)
+        self.stop_port_workers(ConnectionResetError("serial communication stopped"))
+        self.photosensor_sampler.should_thread_run = False
+        self.photosensor_sampler.join()
         print("%s << %s << Exiting Thread" % (self.system_name, self.class_name))
@@ -0,0 +1,158 @@
+import heapq
+import itertools
+import threading
+import time
+import concurrent.futures
+
+CRITICAL_PRIORITY = 0  # Acting on uplinked commands, served before anything else.
+HIGH_PRIORITY     = 1  # Uplink checks and device registration.
+NORMAL_PRIORITY   = 2  # Data collection and downlink.
+LOW_PRIORITY      = 3  # Anything which can wait.
+
+# Priority class names, as given to each stream in the streams section of master_config.yaml.
+PRIORITY_CLASSES = {"critical": CRITICAL_PRIORITY,
+                    "high":     HIGH_PRIORITY,
+                    "normal":   NORMAL_PRIORITY,
+                    "low":      LOW_PRIORITY}
+
+
+def priority_from_name(name: str) -> int:
+    """
+    This function turns a priority class name from master_config.yaml into the priority of a request.
+
+    :param name: critical, high, normal or low.
+    :raises ValueError: If the name is not a priority class.
+    :return: The priority, lower is more urgent.
+    """
+    try:
+        return PRIORITY_CLASSES[str(name).lower()]
+    except KeyError:
+        raise ValueError("[%s] is not a priority class, use one of %s" % (name, list(PRIORITY_CLASSES)))
+
+
+class SerialRequest(object):
+    """
+    One transaction with a device on a serial port: a message written to the port and the line read back in response.
+
+    The outcome is delivered through a concurrent.futures.Future. The serial thread sets the response line as its
+    result, or an exception if the request expired before it was served or the connection failed. Callers which care
+    about the response wait on the future, others can just submit the request and move on.
+    """
+
+    def __init__(self, port: str, message, response_type: str, priority: int = NORMAL_PRIORITY,
+                 timeout: float = None) -> None:
+        """
+        Init of class.
+
+        :param port: Port to do the communication over.
+        :param message: Message to write, str or bytes.
+        :param response_type: Type of line expected back, dictates how it is logged, e.g. DATA, ID, HEADER, TX, RX.
+        :param priority: One of the _PRIORITY constants, lower is more urgent.
+        :param timeout: Time [sec] the request may wait in the queue before it is dropped, None to wait forever.
+        """
+        self.port          = port
+        self.message       = message
+        self.response_type = response_type
+        self.priority      = priority
+        self.timeout       = timeout
+        self.created_time  = time.monotonic()
+        self.future        = concurrent.futures.Future()  # Result is the response line.
+
+    def has_expired(self, now: float = None) -> bool:
+        """
+        :param now: time.monotonic() time to check at. Defaults to now.
+        :return: True if the request has waited longer than its timeout.
+        """
+        if self.timeout is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return now - self.created_time > self.timeout
+
+    def result(self, timeout: float = None) -> str:
+        """
+        This function waits for the response.
+
+        :param timeout: Most time [sec] to wait, None to wait forever.
+        :raises TimeoutError: If there is no response in time or the request expired in the queue.
+        :raises ConnectionError: If the serial connection failed or was reset before the response.
+        :return: Response line.
+        """
+        return self.future.result(timeout)
+
+
+class SerialRequestQueue(object):
+    """
+    Priority queue of SerialRequests. Requests of the same priority are served in the order they were put in.
+
+    The serial thread blocks in get until there is something to do, instead of polling.
+    """
+
+    def __init__(self) -> None:
+        """
+        Init of class.
+        """
+        self.heap       = []                 # [priority, order, request] entries.
+        self.order      = itertools.count()  # Keeps requests of one priority first in first out.
+        self.not_empty  = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def put(self, request: SerialRequest) -> SerialRequest:
+        """
+        This function queues a request.
+
+        :param request: Request to queue.
+        :return: The request.
+        """
+        with self.not_empty:
+            heapq.heappush(self.heap, (request.priority, next(self.order), request))
+            self.not_empty.notify()
+        return request
+
+    def get(self, timeout: float = None, max_priority: int = None) -> SerialRequest:
+        """
+        This function takes the most urgent request, waiting for one if there are none.
+
+        :param timeout: Most time [sec] to wait, None to wait forever.
+        :param max_priority: If given, only take a request of this priority or more urgent.
+        :return: The request, None if there was none in time.
+        """
+        with self.not_empty:
+            if not self.not_empty.wait_for(lambda: len(self.heap) > 0 and (max_priority is None or
+                                                                          self.heap[0][0] <= max_priority), timeout):
+                return None
+            return heapq.heappop(self.heap)[2]
+
+    def clear(self, error: Exception, keep_priority: int = None) -> None:
+        """
+        This function fails every queued request with the given error and empties the queue. Requests the caller
+        has cancelled meanwhile are left as they are.
+
+        :param error: Exception to set on the requests.
+        :param keep_priority: If given, requests of this priority or more urgent are kept in the queue.
+        :return: None
+        """
+        with self.not_empty:
+            heap = self.heap
+            if keep_priority is None:
+                self.heap = []
+            else:
+                self.heap = [entry for entry in heap if entry[0] <= keep_priority]
+                heap      = [entry for entry in heap if entry[0] > keep_priority]
+                heapq.heapify(self.heap)
+        for entry in heap:
+            if not entry[2].future.done():
+                entry[2].future.set_exception(error)
+
+    def take_all(self) -> list:
+        """
+        This function empties the queue without failing the requests, to move them to another queue.
+
+        :return: List of the requests, most urgent first.
+        """
+        with self.not_empty:
+            heap      = self.heap
+            self.heap = []
+        return [entry[2] for entry in sorted(heap, key=lambda entry: entry[0:2])]
@@ -0,0 +1,530 @@
+import argparse
+import heapq
+import math
+import os
+import random
+import sys
+import threading
+import time
+import tty
+import datetime
+
+"""
+Stand-in for the arduino running arduino_thread_controller.ino, for running the flight software without hardware.
+
+Each simulated arduino is a pseudo-terminal pair. The flight software opens the slave side like any serial port, the
+simulator answers ID, HEADER, DATA, TX and RX commands on the master side, bare or framed (see
+Serial_Communication/framing.py), with configurable latency, line noise and dropped responses. DATA lines have the
+fields of DataCrush.txt and follow a made up flight, so telemetry compresses them as it would real ones.
+
+Run from the Flight_Software_Package directory:
+
+    python3 -m Simulator.arduino_simulator --link /tmp/ttySIM0
+
+serves until Ctrl+C. Add the link (or the printed /dev/pts port) to serial_communication: port_patterns in
+master_config.yaml and start main.py as usual. With --load-test RATE the flight software threads are started in this
+process instead, DATA is asked for RATE times a second, and the throughput and latency seen are printed at the end.
+With --disconnect-test the simulated arduino is taken away under a framed port worker, and the exit status says
+whether the worker stopped reading the dead port.
+"""
+
+DEFAULT_DEVICE_NAME = "MajorTomLight"
+
+
+class FlightProfile(object):
+    """
+    Made up balloon flight the simulated sensors read from: ascent, burst, descent, drifting east with the wind.
+    """
+
+    def __init__(self, speedup: float = 1.0, seed: int = None) -> None:
+        """
+        Init of class.
+
+        :param speedup: How many seconds of flight pass per real second.
+        :param seed: Seed for the sensor noise, None for a different flight each run.
+        """
+        self.speedup       = speedup
+        self.random        = random.Random(seed)
+        self.start_time    = time.monotonic()
+        self.start_utc     = datetime.datetime.utcnow()
+        self.ascent_rate   = 5.0      # [m/s]
+        self.descent_rate  = 8.0      # [m/s]
+        self.burst_alt     = 31000.0  # [m]
+        self.ground_alt    = 90.0     # [m]
+        self.start_lat     = 44.2297  # [deg] north
+        self.start_lon     = 76.4950  # [deg] west
+        self.wind_speed    = 12.0     # [m/s] towards the east
+
+    def flight_time(self) -> float:
+        """
+        :return: Time [sec] since launch.
+        """
+        return (time.monotonic() - self.start_time) * self.speedup
+
+    def altitude(self, t: float) -> float:
+        """
+        :param t: Time [sec] since launch.
+        :return: Altitude [m].
+        """
+        burst_time = (self.burst_alt - self.ground_alt) / self.ascent_rate
+        if t < burst_time:
+            return self.ground_alt + self.ascent_rate * t
+        return max(self.ground_alt, self.burst_alt - self.descent_rate * (t - burst_time))
+
+    def fields(self) -> dict:
+        """
+        This function reads all the simulated sensors at the current flight time.
+
+        :return: Dict of field value strings, keyed by the DataCrush.txt field names.
+        """
+        t     = self.flight_time()
+        alt   = self.altitude(t)
+        noise = self.random.gauss
+        utc   = self.start_utc + datetime.timedelta(seconds=t)
+        lat   = self.start_lat + noise(0, 1e-6)
+        lon   = self.start_lon - self.wind_speed * t / (111320.0 * math.cos(math.radians(self.start_lat)))
+        temp  = max(15.0 - 6.5 * alt / 1000.0, -56.5) + noise(0, 0.1)
+        # Cosmic ray counts peak near 20 km (Pfotzer maximum).
+        counts = 2.0 + 80.0 * math.exp(-((alt - 20000.0) / 8000.0) ** 2)
+        light  = 900.0 + 30.0 * alt / 1000.0
+
+        values = {"UTC":    "%02d%02d%05.2f" % (utc.hour, utc.minute, utc.second + utc.microsecond / 1e6),
+                  "LtDgMn": "%010.5f" % (int(lat) * 100 + (lat % 1) * 60),
+                  "NS":     "N",
+                  "LnDgMn": "%011.5f" % (int(lon) * 100 + (lon % 1) * 60),
+                  "EW":     "W",
+                  "Nsat":   "%02d" % self.random.randint(6, 12),
+                  "Alt":    "%05d" % round(alt),
+                  "Altu":   "M",
+                  "TC":     "%d" % round(temp + 20.0),
+                  "C1":     "%d" % self.poisson(counts),
+                  "C2":     "%d" % self.poisson(counts),
+                  "GN":     "0",
+                  "temp":   "%.2f" % temp}
+        for axis in "xyz":
+            gravity = 9.80 if axis == "z" else 0.0
+            values["Ac%sms2" % axis]  = "%.2f" % (gravity + noise(0, 0.2))
+            values["LAc%sms2" % axis] = "%.2f" % noise(0, 0.2)
+            values["Gv%sms2" % axis]  = "%.2f" % (gravity + noise(0, 0.01))
+            values["Gy%srs" % axis]   = "%.2f" % noise(0, 0.1)
+            values["Mg%suT" % axis]   = "%.2f" % (20.0 + noise(0, 1.0))
+            values["El%sdg" % axis]   = "%.2f" % (self.random.uniform(-180.0, 180.0) if axis == "x" else noise(0, 2))
+        for sensor in ["Sy", "Gy", "Ac", "Mg"]:
+            values["%sCl03" % sensor] = "3"
+        for number in "123":
+            values["BBL%s" % number] = "%d" % round(light + noise(0, 10.0))
+            values["IRL%s" % number] = "%d" % round(light / 10.0 + noise(0, 2.0))
+        return values
+
+    def poisson(self, mean: float) -> int:
+        """
+        :param mean: Mean count.
+        :return: Random count with a Poisson distribution, normal approximation for large means.
+        """
+        if mean > 30.0:
+            return max(0, round(self.random.gauss(mean, math.sqrt(mean))))
+        limit = math.exp(-mean)
+        count = 0
+        p     = self.random.random()
+        while p > limit:
+            count += 1
+            p     *= self.random.random()
+        return count
+
+
+class ArduinoSimulator(object):
+    """
+    One simulated arduino on a pseudo-terminal, see the module docstring.
+    """
+
+    def __init__(self, field_names: list, latency: float = 0.005, jitter: float = 0.0, noise: float = 0.0,
+                 dropout: float = 0.0, baud_rate: int = 115200, tx_airtime: float = 0.05, speedup: float = 1.0,
+                 device_name: str = DEFAULT_DEVICE_NAME, seed: int = None) -> None:
+        """
+        Init of class. Opens the pseudo-terminal, call start to begin answering.
+
+        :param field_names: Fields of the DATA line after ATSms, as in the HEADER line.
+        :param latency: Time [sec] taken to answer a command.
+        :param jitter: Standard deviation [sec] added to the latency.
+        :param noise: Chance of a character being garbled in a response line.
+        :param dropout: Chance of a command getting no response.
+        :param baud_rate: Speed of the simulated serial link, responses are held back to fit it. 0 for no limit.
+        :param tx_airtime: Time [sec] a TX takes to go out on the radio before OK is sent back.
+        :param speedup: How many seconds of flight pass per real second.
+        :param device_name: Name given in the ID line.
+        :param seed: Seed for noise, dropouts and sensor values, None for different ones each run.
+        """
+        self.field_names  = [name for name in field_names if name != "ATSms"]
+        self.latency      = latency
+        self.jitter       = jitter
+        self.noise        = noise
+        self.dropout      = dropout
+        self.baud_rate    = baud_rate
+        self.tx_airtime   = tx_airtime
+        self.device_name  = device_name
+        self.random       = random.Random(seed)
+        self.flight       = FlightProfile(speedup, seed)
+        self.start_time   = time.monotonic()
+
+        self.ground_commands = ""  # Sent in the response to the next RX, as uplinked commands would be.
+        self.stats           = dict(commands=0, dropped=0, garbled=0, bytes_out=0)
+        self.stats_mutex     = threading.Lock()
+
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+
+        self.responses       = []  # (due time.monotonic(), order, line) entries waiting to be written.
+        self.response_order  = 0
+        self.has_responses   = threading.Condition()
+        self.should_run      = True
+        self.reader_thread   = threading.Thread(target=self.read_commands, name="ArduinoSim %s" % self.port)
+        self.writer_thread   = threading.Thread(target=self.write_responses, name="ArduinoSimOut %s" % self.port)
+        self.reader_thread.daemon = True
+        self.writer_thread.daemon = True
+
+    def start(self) -> None:
+        self.reader_thread.start()
+        self.writer_thread.start()
+
+    def stop(self) -> None:
+        """
+        This function stops answering and closes the pseudo-terminal.
+
+        :return: None
+        """
+        self.should_run = False
+        with self.has_responses:
+            self.has_responses.notify()
+        # The reader thread holds the master side open while it waits in os.read, wake it so the port really closes
+        # and the other end sees the hang up, as when an arduino is unplugged.
+        if self.reader_thread.is_alive():
+            try:
+                os.write(self.slave_fd, b"\n")
+            except OSError:
+                pass
+            self.reader_thread.join(1.0)
+        for fd in (self.master_fd, self.slave_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def count(self, name: str) -> None:
+        with self.stats_mutex:
+            self.stats[name] += 1
+
+    def read_commands(self) -> None:
+        """
+        This function is the main loop of the reader thread. Like the arduino, it takes everything which has arrived
+        as one bare command, unless it starts with '@', in which case it is split into frames.
+
+        :return: None
+        """
+        buffer = b""
+        while self.should_run:
+            try:
+                data = os.read(self.master_fd, 1024)
+            except OSError:
+                break
+            if buffer == b"" and not data.startswith(b"@"):
+                self.handle_command(data.rstrip(b" \r\n"), None)
+                continue
+            buffer += data
+            while len(buffer) >= 6:
+                if buffer[0:1] != b"@":
+                    # Not the start of a frame, skip to the next '@'.
+                    skip   = buffer.find(b"@", 1)
+                    buffer = buffer[skip:] if skip > 0 else b""
+                    continue
+                try:
+                    seq    = int(buffer[1:3], 16)
+                    length = int(buffer[3:6], 16)
+                except ValueError:
+                    buffer = buffer[1:]
+                    continue
+                if len(buffer) < 6 + length:
+                    break
+                self.handle_command(buffer[6:6 + length], seq)
+                buffer = buffer[6 + length:]
+
+    def handle_command(self, command: bytes, seq: int) -> None:
+        """
+        This function works out the response to one command and queues it, as handleCommand does on the arduino.
+
+        :param command: Command, without frame or EOL.
+        :param seq: seq of a framed command, None for a bare one.
+        :return: None
+        """
+        self.count("commands")
+        delay = self.latency
+        if command.startswith(b"ID"):
+            response = ",".join([self.device_name, "SimGPS", "SimIMU", "SimGeiger", "SimLight", "SimTemp"])
+        elif command.startswith(b"HEADER"):
+            response = ",".join(["ATSms"] + self.field_names)
+        elif command.startswith(b"DATA"):
+            response = self.data_line()
+        elif command.startswith(b"TX"):
+            response = "OK"
+            delay   += self.tx_airtime
+        elif command.startswith(b"RX"):
+            response             = self.ground_commands
+            self.ground_commands = ""
+        else:
+            return  # Do nothing. Pi will know of error on timeout.
+        if self.random.random() < self.dropout:
+            self.count("dropped")
+            return
+        if self.noise > 0.0 and len(response) > 0 and self.random.random() < self.noise:
+            self.count("garbled")
+            position = self.random.randrange(len(response))
+            response = response[0:position] + chr(self.random.randint(33, 126)) + response[position + 1:]
+        if seq is not None:
+            response = "@%02X:%s" % (seq, response)
+        if self.jitter > 0.0:
+            delay = max(0.0, delay + self.random.gauss(0.0, self.jitter))
+        with self.has_responses:
+            heapq.heappush(self.responses, (time.monotonic() + delay, self.response_order,
+                                            (response + "\r\n").encode('utf-8')))
+            self.response_order += 1
+            self.has_responses.notify()
+
+    def data_line(self) -> str:
+        """
+        :return: DATA response, milliseconds since start then a value for each field.
+        """
+        values = self.flight.fields()
+        return ",".join(["%d" % ((time.monotonic() - self.start_time) * 1000)] +
+                        [values.get(name, "0") for name in self.field_names])
+
+    def write_responses(self) -> None:
+        """
+        This function is the main loop of the writer thread. It writes each queued response once it is due, no faster
+        than the baud rate allows.
+
+        :return: None
+        """
+        while self.should_run:
+            with self.has_responses:
+                if len(self.responses) == 0:
+                    self.has_responses.wait(0.5)
+                    continue
+                wait = self.responses[0][0] - time.monotonic()
+                if wait > 0.0:
+                    self.has_responses.wait(wait)
+                    continue
+                line = heapq.heappop(self.responses)[2]
+            try:
+                os.write(self.master_fd, line)
+            except OSError:
+                break
+            with self.stats_mutex:
+                self.stats["bytes_out"] += len(line)
+            if self.baud_rate > 0:
+                time.sleep(len(line) * 10.0 / self.baud_rate)  # 8N1, 10 bits a byte.
+
+
+def load_field_names(crush_file: str = None) -> list:
+    """
+    This function reads the DATA line fields from DataCrush.txt.
+
+    :param crush_file: crushForm file, DataCrush.txt if None.
+    :return: Field names after the Pi timestamp, ATSms first.
+    """
+    from SydCompress import LoadCrushSchema
+    return [str(name) for name in LoadCrushSchema(crush_file).name[1:]]
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    :param values: Sorted values.
+    :param fraction: 0 to 1.
+    :return: Value at that fraction of the way through, nan if there are none.
+    """
+    if len(values) == 0:
+        return float('nan')
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_load_test(simulators: list, rate: float, duration: float, framed: bool) -> None:
+    """
+    This function runs the flight software threads against the simulators, asks each for DATA rate times a second
+    and prints the throughput and latency of the requests, and how long the requests of each priority class (the
+    uplink checks of the telemetry thread too) waited to be sent.
+
+    :param simulators: Started ArduinoSimulators.
+    :param rate: DATA requests per second to each simulator.
+    :param duration: Time [sec] to run for.
+    :param framed: Use the framed protocol.
+    :return: None
+    """
+    from Logger.logger import Logger
+    from Serial_Communication.serial_communication import SerialCommunication
+    from Serial_Communication.port_worker import FramedPortWorker
+    from Serial_Communication.serial_request import PRIORITY_CLASSES
+    from Telemetry.telemetry import Telemetry
+    from System_Control.system_control import SystemControl
+    from Command_and_Control.command_and_control import CommandAndControl
+
+    logger         = Logger()
+    serial_object  = SerialCommunication(logger, [])
+    serial_object.port_patterns   = [simulator.port for simulator in simulators]
+    serial_object.last_good_ports = []
+    serial_object.priority_report_interval = float('inf')  # Reported at the end instead.
+    if framed:
+        serial_object.port_worker_class = FramedPortWorker
+    telemetry      = Telemetry(logger, serial_object)
+    system_control = SystemControl(logger, serial_object)
+    cnc            = CommandAndControl(logger, serial_object, telemetry, system_control)
+    cnc.que_data_delay     = max(cnc.que_data_delay, duration)  # Data is asked for below instead.
+    cnc.device_data_delays = {}
+    threads = [logger, serial_object, telemetry, system_control, cnc]
+    for thread in threads:
+        thread.start()
+
+    while not serial_object.link_is_up():
+        time.sleep(0.01)
+    latencies = []
+    failures  = [0]
+    mutex     = threading.Lock()
+
+    def done(request):
+        with mutex:
+            if request.future.exception() is None:
+                latencies.append(time.monotonic() - request.created_time)
+            else:
+                failures[0] += 1
+
+    start_version = serial_object.sample_history.version
+    start_time    = time.monotonic()
+    next_time     = start_time
+    requested     = 0
+    while time.monotonic() - start_time < duration:
+        for port in list(serial_object.port_list):
+            request = serial_object.submit_request(port, "DATA", "DATA", cnc.data_priority, timeout=1.0)
+            request.future.add_done_callback(lambda future, request=request: done(request))
+            requested += 1
+        next_time += 1.0 / rate
+        time.sleep(max(0.0, next_time - time.monotonic()))
+    elapsed = time.monotonic() - start_time
+    time.sleep(min(2.0, serial_object.default_timeout))  # Let the last requests finish.
+
+    for thread in reversed(threads):
+        thread.should_thread_run = False
+    for thread in reversed(threads):
+        thread.join()
+
+    with mutex:
+        latencies.sort()
+        print("requested %d DATA in %.1f sec, %d answered, %d failed, %d lines logged" % (
+            requested, elapsed, len(latencies), failures[0], serial_object.sample_history.version - start_version))
+        print("latency [ms] p50 %.1f  p95 %.1f  p99 %.1f  max %.1f" % tuple(
+            1000.0 * percentile(latencies, fraction) for fraction in (0.5, 0.95, 0.99, 1.0)))
+    names = {priority: name for name, priority in PRIORITY_CLASSES.items()}
+    for priority, (sent, total_wait, longest_wait) in sorted(serial_object.queue_wait_stats.items()):
+        print("%-8s %6d sent, queue wait [ms] mean %.1f  max %.1f" % (names[priority], sent,
+                                                                       1000.0 * total_wait / sent,
+                                                                       1000.0 * longest_wait))
+    for simulator in simulators:
+        print("%s %s" % (simulator.port, simulator.stats))
+
+
+def run_disconnect_test(simulator) -> bool:
+    """
+    This function runs the serial thread with the framed protocol against the simulator, then takes the simulator away
+    as if the arduino was unplugged, and checks the port reader stops reading instead of retrying the failed read
+    until the link is reset.
+
+    :param simulator: Started ArduinoSimulator, stopped by this function.
+    :return: True if the reader stopped and only a few errors were logged.
+    """
+    from Logger.logger import Logger
+    from Serial_Communication.serial_communication import SerialCommunication
+    from Serial_Communication.port_worker import FramedPortWorker
+
+    logger        = Logger()  # Not started, so the logged lines stay in its buffers to be counted.
+    serial_object = SerialCommunication(logger, [])
+    serial_object.port_patterns     = [simulator.port]
+    serial_object.last_good_ports   = []
+    serial_object.port_worker_class = FramedPortWorker
+    serial_object.start()
+    while not serial_object.link_is_up():
+        time.sleep(0.01)
+    workers      = list(serial_object.port_workers.values())
+    start_errors = len(logger.notifications_logging_buffer)
+
+    simulator.stop()
+    time.sleep(1.0)
+    errors  = len(logger.notifications_logging_buffer) - start_errors
+    settled = all(not worker.reader_thread.is_alive() for worker in workers)
+
+    serial_object.should_thread_run = False
+    serial_object.join()
+    print("after the disconnect: %d lines logged in 1 sec, port readers %s" % (
+        errors, "stopped" if settled else "still reading"))
+    return settled and errors < 20
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulated arduino(s) on pseudo-terminals.")
+    parser.add_argument('--count', type=int, default=1, help='number of simulated arduinos')
+    parser.add_argument('--link', help='make a symlink to the port at this path, numbered if --count > 1')
+    parser.add_argument('--latency', type=float, default=0.005, help='time [sec] to answer a command')
+    parser.add_argument('--jitter', type=float, default=0.0, help='standard deviation [sec] of the latency')
+    parser.add_argument('--noise', type=float, default=0.0, help='chance of a response line being garbled')
+    parser.add_argument('--dropout', type=float, default=0.0, help='chance of a command getting no response')
+    parser.add_argument('--baud', type=int, default=115200, help='simulated link speed, 0 for no limit')
+    parser.add_argument('--tx-airtime', type=float, default=0.05, help='time [sec] a TX takes before OK')
+    parser.add_argument('--speedup', type=float, default=1.0, help='seconds of flight per real second')
+    parser.add_argument('--uplink', default="", help='commands given to the first RX, comma separated')
+    parser.add_argument('--crush-file', help='crushForm file giving the DATA fields, DataCrush.txt by default')
+    parser.add_argument('--seed', type=int, help='random seed')
+    parser.add_argument('--load-test', type=float, metavar='RATE',
+                        help='run the flight software here and ask for DATA RATE times a second')
+    parser.add_argument('--duration', type=float, default=30.0, help='length [sec] of the load test')
+    parser.add_argument('--framed', action='store_true', help='use the framed protocol in the load test')
+    parser.add_argument('--disconnect-test', action='store_true',
+                        help='check the framed port reader settles when the first simulated arduino goes away')
+    args = parser.parse_args()
+
+    field_names = load_field_names(args.crush_file)
+    simulators  = []
+    links       = []
+    for i in range(args.count):
+        seed      = None if args.seed is None else args.seed + i
+        simulator = ArduinoSimulator(field_names, args.latency, args.jitter, args.noise, args.dropout, args.baud,
+                                     args.tx_airtime, args.speedup, seed=seed)
+        simulator.ground_commands = args.uplink
+        simulator.start()
+        simulators.append(simulator)
+        if args.link is not None:
+            link = args.link if args.count == 1 else "%s%d" % (args.link, i)
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(simulator.port, link)
+            links.append(link)
+        print("simulated arduino on %s%s" % (simulator.port, "" if args.link is None else " (%s)" % links[-1]))
+    sys.stdout.flush()
+
+    passed = True
+    try:
+        if args.disconnect_test:
+            passed = run_disconnect_test(simulators[0])
+        elif args.load_test is not None:
+            run_load_test(simulators, args.load_test, args.duration, args.framed)
+        else:
+            while True:
+                time.sleep(10)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+        for link in links:
+            os.remove(link)
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,14 @@
 # Author:      Syd
 # Created:     13-04-2019
 #-------------------------------------------------------------------------------
+import ast
+import hashlib
 import math
 import numpy as np
 import os
 import time
+from itertools import chain
+from operator import and_,itemgetter,lshift
 #import zlib
 
 def Float2Long(flt,np=0,lng=0):
@@ -68,105 +72,519 @@ def Force2Int(num):
         return(0)
 
 
+class BitPacker(object):
+    """Packs integers into fields of fixed bit widths, first field in the most significant bits, and back again.
+    Shifts and masks are worked out once per layout, then a frame is one big integer built from the masked and
+    shifted fields, which gives the same bytes as filling a bit array one bit at a time."""
+    def __init__(self,size,sign=None):
+        self.size=[int(s) for s in size]
+        if sign is None:
+            sign=[1]*len(self.size)
+        self.sign=[int(s) for s in sign]
+        self.nbits=sum(self.size)
+        self.nbytes=(self.nbits+7)//8
+        self.pad=self.nbytes*8-self.nbits #zero bits at the end of the last byte
+        self.mask=[(1<<s)-1 for s in self.size]
+        self.shift=[]
+        offset=self.nbits
+        for s in self.size:
+            offset-=s
+            self.shift.append(offset+self.pad)
+        #signed fields are only made negative above 2**(size-1), as Bin2Int always has
+        self.half=[1<<(s-1) if s>0 else 0 for s in self.size]
+        self.full=[1<<s for s in self.size]
+        #for the many frame versions: first and last byte of each field, the bits of other fields at the top of its
+        #first byte and the bits after it at the bottom of its last byte
+        self.first=[]
+        self.last=[]
+        self.skip=[]
+        self.drop=[]
+        offset=0
+        for s in self.size:
+            self.first.append(offset//8)
+            self.skip.append(offset%8)
+            self.last.append((offset+s-1)//8)
+            self.drop.append((8-(offset+s)%8)%8)
+            offset+=s
+
+    def pack(self,num):
+        """num is a python int per field. numpy ints would overflow the shifts, Int2Bin takes anything.
+        masking gives two's complement for negatives, like n%2 and n//=2 did. fields do not overlap so summing
+        them is the same as or-ing them"""
+        return(sum(map(lshift,map(and_,num,self.mask),self.shift)).to_bytes(self.nbytes,'big'))
+
+    def unpack(self,data):
+        if len(data)<self.nbytes:
+            raise ValueError("need %d bytes, got %d"%(self.nbytes,len(data)))
+        acc=int.from_bytes(bytes(data[0:self.nbytes]),'big')
+        ret=[(acc>>sh)&m for sh,m in zip(self.shift,self.mask)]
+        for i in range(len(ret)):
+            if self.sign[i]==-1 and ret[i]>self.half[i]:
+                ret[i]-=self.full[i] #signs
+        return(ret)
+
+    def normalize(self,num):
+        """the values unpack would give back for num, i.e. cut to the field widths and signed where needed"""
+        ret=[int(n)&m for n,m in zip(num,self.mask)]
+        for i in range(len(ret)):
+            if self.sign[i]==-1 and ret[i]>self.half[i]:
+                ret[i]-=self.full[i]
+        return(ret)
+
+    def pack_many(self,nums,chunk=65536):
+        """packs each row of an N x fields integer matrix as a frame, returns one contiguous buffer of N frames.
+        works a byte column at a time on chunk frames at once, each field written from its last byte backwards"""
+        nums=np.asarray(nums,dtype=np.int64).reshape(-1,len(self.size))
+        frames=np.zeros((len(nums),self.nbytes),dtype=np.uint8)
+        byte=np.uint64(0xFF)
+        for start in range(0,len(nums),chunk):
+            rows=slice(start,start+chunk)
+            for i in range(len(self.size)):
+                if self.size[i]==0:
+                    continue
+                vals=nums[rows,i].astype(np.uint64)&np.uint64(self.mask[i]) #two's complement for negatives
+                frames[rows,self.last[i]]|=((vals<<np.uint64(self.drop[i]))&byte).astype(np.uint8)
+                vals>>=np.uint64(8-self.drop[i])
+                for b in range(self.last[i]-1,self.first[i]-1,-1):
+                    frames[rows,b]|=(vals&byte).astype(np.uint8)
+                    vals>>=np.uint64(8)
+        return(frames.tobytes())
+
+    def unpack_many(self,data,chunk=65536):
+        """unpacks a buffer of whole frames into an N x fields integer matrix. each field is put together from the
+        byte columns it covers with shifts and masks, chunk frames at a time so the temporaries stay small"""
+        frames=np.frombuffer(data,dtype=np.uint8)
+        frames=frames[0:len(frames)//self.nbytes*self.nbytes].reshape(-1,self.nbytes)
+        ret=np.zeros((len(frames),len(self.size)),dtype=np.int64)
+        for start in range(0,len(frames),chunk):
+            part=frames[start:start+chunk]
+            for i in range(len(self.size)):
+                if self.size[i]==0:
+                    continue
+                f,l,d=self.first[i],self.last[i],self.drop[i]
+                if f==l:
+                    vals=(part[:,f]>>d).astype(np.uint64)&np.uint64(self.mask[i])
+                else:
+                    vals=(part[:,f]&(0xFF>>self.skip[i])).astype(np.uint64)
+                    for b in range(f+1,l):
+                        vals=(vals<<np.uint64(8))|part[:,b]
+                    vals=(vals<<np.uint64(8-d))|(part[:,l]>>d)
+                if self.sign[i]==-1:
+                    vals[vals>np.uint64(self.half[i])]-=np.uint64(self.full[i]) #signs, wraps round to negative
+                ret[start:start+chunk,i]=vals.view(np.int64)
+        return(ret)
+
+
+_packers={} #BitPackers already made, keyed by layout
+_int2BinPackers={} #BitPacker for each Int2Bin (size,bitwise), so repeat calls skip the size arithmetic
+def GetPacker(size,sign=None):
+    key=(tuple(size),None if sign is None else tuple(sign))
+    if key not in _packers:
+        _packers[key]=BitPacker(size,sign)
+    return(_packers[key])
+
+
 def Int2Bin(num,size=None,bitwise=0):
     try: #safety
         len(num)
     except TypeError:
         num=[num]
-    except Excepttion as e:
+    except Exception as e:
         print(e)
         return(0)
 
     if size is None:
-        size=np.log2(num) #smallest possible size
-    if not bitwise:
-        size=np.ceil(np.array(size)/8).astype(np.uint)*8 #size in bytes
-
-    ret=np.zeros(np.sum(size),dtype=np.bool)
-    offset=0
-    for i in range(len(num)):
-        n=num[i] #grab a number
-        for j in range(size[i]-1,-1,-1):
-            ret[offset+j]=n%2 #get the least bit
-            n//=2 #shift the bits of the number
-        offset+=size[i] #move to next spot in output
-    return(np.packbits(ret[0:offset])) #convert bits to bytes
+        size=np.ceil(np.log2(num)) #smallest possible size
+    key=(tuple(size[0:len(num)]),bool(bitwise))
+    packer=_int2BinPackers.get(key)
+    if packer is None:
+        size=key[0]
+        if not bitwise:
+            size=np.ceil(np.array(size)/8).astype(np.uint)*8 #size in bytes
+        packer=GetPacker(size)
+        _int2BinPackers[key]=packer
+    if {*map(type,num)}!={int}:
+        num=[*map(int,num)] #python ints for the shifts
+    return(np.frombuffer(packer.pack(num),dtype=np.uint8))
 
 
 def Bin2Int(data,size=[8],sign=[1]):
-    bits=np.unpackbits(data)
-    offset=0
-    ret=[0]*len(size)
-    for elem in range(len(size)):
-        offset+=size[elem]
-        exps=np.arange(size[elem])
-        raised=bits[offset-exps-1]*np.power(2,exps)
-        ret[elem]=np.sum(raised)
-        if sign[elem]==-1 and ret[elem]>2**(size[elem]-1):
-            ret[elem]=ret[elem]-2**size[elem] #signs
-    return(ret)
+    return(GetPacker(size,sign).unpack(data))
+
+
+class CrushSchema(object):
+    """the crushForm from DataCrush.txt as arrays, one entry per data line field. made by LoadCrushSchema"""
+    def __init__(self,name,mult,digt,bits,clip,fileHash=""):
+        self.name=np.asarray(name,dtype=str)
+        self.mult=np.asarray(mult,dtype=np.int64)
+        self.digt=np.asarray(digt,dtype=np.int64) #10**digits, 1 to keep all
+        self.bits=np.asarray(bits,dtype=np.int64)
+        self.clip=np.asarray(clip,dtype=np.float64)
+        self.fileHash=fileHash
+        self.sent=np.flatnonzero(self.bits) #downlinked fields
+        self.szs=self.bits[self.sent]
+        self.tmul=self.mult[self.sent]
+
+    @staticmethod
+    def Parse(text,fileHash=""):
+        """checks the crushForm text and makes a schema from it, raises ValueError if it is bad"""
+        try:
+            form=ast.literal_eval(text) #a list of tuples, never run it
+        except (ValueError,SyntaxError) as err:
+            raise ValueError("crushForm is not a python literal: %s"%err)
+        if not isinstance(form,(list,tuple)) or len(form)==0:
+            raise ValueError("crushForm must be a list of field tuples")
+        ln=len(form)
+        name=[""]*ln
+        mult=[1]*ln
+        digt=[1]*ln
+        bits=[16]*ln
+        clip=[0]*ln
+        for i in range(ln):
+            entry=form[i]
+            if not isinstance(entry,tuple) or not 1<=len(entry)<=5 or not isinstance(entry[0],str):
+                raise ValueError("crushForm field %d must be (name[,mult,digt,bits,clip]), got %r"%(i,entry))
+            if not all(isinstance(x,int) for x in entry[1:4]) or not all(isinstance(x,(int,float)) for x in entry[4:]):
+                raise ValueError("crushForm field %s has a non numeric setting"%entry[0])
+            name[i]=entry[0]
+            if len(entry)>1: mult[i]=entry[1]
+            if len(entry)>2: digt[i]=10**entry[2]
+            if len(entry)>3: bits[i]=entry[3]
+            if len(entry)>4: clip[i]=entry[4]
+            if not 0<=bits[i]<=63:
+                raise ValueError("crushForm field %s has %d bits, must be 0 to 63"%(name[i],bits[i]))
+            if i>0 and mult[i]==0 and bits[i]!=0:
+                raise ValueError("crushForm field %s is downlinked but has mult 0"%name[i])
+        if len(set(name))!=ln:
+            raise ValueError("crushForm has repeated field names")
+        if bits[0]==0:
+            raise ValueError("crushForm field %s (the Pi timestamp) must be downlinked"%name[0])
+        return(CrushSchema(name,mult,digt,bits,clip,fileHash))
+
+    def Save(self,path):
+        np.savez(path,name=self.name,mult=self.mult,digt=self.digt,bits=self.bits,clip=self.clip,
+                 fileHash=np.asarray(self.fileHash))
+
+    @staticmethod
+    def Load(path):
+        with np.load(path,allow_pickle=False) as npz:
+            return(CrushSchema(npz["name"],npz["mult"],npz["digt"],npz["bits"],npz["clip"],str(npz["fileHash"])))
+
+
+DEFAULT_CRUSH_FILE=os.path.join(os.path.dirname(os.path.abspath(__file__)),"DataCrush.txt")
+_schemas={} #schemas already loaded, keyed by file hash, shared by every SydCompress in the process
+def LoadCrushSchema(crushFile=None):
+    """loads the crushForm, the flight Telemetry thread and ground decoders both get it from here.
+    the compiled arrays are kept next to the text file as <file>.npz and only remade when the text changes"""
+    if crushFile is None:
+        crushFile=DEFAULT_CRUSH_FILE
+    with open(crushFile,"rb") as f:
+        raw=f.read()
+    fileHash=hashlib.sha1(raw).hexdigest()
+    if fileHash in _schemas:
+        return(_schemas[fileHash])
+    schema=None
+    cacheFile=crushFile+".npz"
+    try:
+        schema=CrushSchema.Load(cacheFile)
+        if schema.fileHash!=fileHash:
+            schema=None #text was edited since
+    except (OSError,ValueError,KeyError):
+        pass
+    if schema is None:
+        schema=CrushSchema.Parse(raw.decode("utf-8"),fileHash)
+        try:
+            schema.Save(cacheFile)
+        except OSError as err:
+            print("could not cache crushForm: ",err) #read only, still works
+        print("loaded crushForm")
+    _schemas[fileHash]=schema
+    return(schema)
 
 
 class SydCompress(object): #use an object mainly to load crushForm and keep it loaded
-    def __init__(self,hard=0):
-        #dcf=os.path.dirname(__file__)+"\\RMC549_Group1\\Flight_Software_Package\\DataCrush.txt"
-        dcf="/home/pi/RMC549Repos/RMC549_Group1/Flight_Software_Package/DataCrush.txt"
-        with open(dcf) as f:
-            form=eval(f.read()) #loads my dictionary
-            ln=len(form)
-            self.name=[""]*ln
-            self.mult=[1]*ln
-            self.digt=[0]*ln
-            self.bits=[16]*ln
-            self.clip=[0]*ln
-            for i in range(ln):
-                try:
-                    self.name[i]=form[i][0]
-                    self.mult[i]=form[i][1]
-                    self.digt[i]=10**form[i][2]
-                    self.bits[i]=form[i][3]
-                    self.clip[i]=form[i][4]
-                except IndexError:
-                    pass
-            print("loaded crushForm")
+    def __init__(self,hard=0,crushFile=None):
+        schema=LoadCrushSchema(crushFile)
+        self.schema=schema
+        self.name=schema.name
+        self.mult=schema.mult
+        self.digt=schema.digt
+        self.bits=schema.bits
+        self.clip=schema.clip
         self.hard=hard #try to go bitwise for compression
+        #the downlinked fields and their bit layout
+        self.sent=schema.sent.tolist()
+        self.szs=schema.szs.tolist()
+        self.tmul=schema.tmul.tolist()
+        self.tclip=schema.clip[schema.sent].tolist()
+        #field index, |mult|, digt and error value of each number Break converts, plain ints for speed
+        self.breakCols=[(i,abs(int(self.mult[i])),int(self.digt[i]),2**int(self.bits[i])-1) for i in self.sent if self.mult[i]!=0]
+        #the same as columns for BreakMany: the line parts to take, and lines need more parts than breakNeed
+        cols=[c[0] for c in self.breakCols]
+        self.breakGet=itemgetter(*cols) if len(cols)>1 else lambda parts:tuple(parts[i] for i in cols)
+        self.breakNeed=max(cols,default=0)
+        self.breakMult=np.array([c[1] for c in self.breakCols],dtype=np.float64)
+        self.breakDigt=[(k,float(c[2])) for k,c in enumerate(self.breakCols) if c[2]>1]
+        bszs=self.szs
+        if not self.hard:
+            bszs=[int(np.ceil(y/8)*8) for y in self.szs]
+        self.breakPacker=GetPacker(bszs)
+        self.rebuildPacker=GetPacker(self.szs,np.sign(self.tmul))
+        self.manyPacker=GetPacker(bszs,np.sign(self.tmul)) #same layout as breakPacker, for RebuildMany
 
     def Break(self,message):
+        out=self.BreakInts(message)
+        if len(out)==len(self.szs):
+            return(self.breakPacker.pack(out))
+        byt=Int2Bin(out,self.szs,bitwise=self.hard) #short line, only some fields
+        return(byt.tobytes())
+
+    def BreakInts(self,message):
         out=[] #a bunch of integers
         parts=message.split(",")
         out.append(BreakPiTime(parts[0]))
-        for i in range(len(parts)):
-            if self.mult[i] is not 0 and self.bits[i] is not 0:
-                try:          
-                    num=float(parts[i])*abs(self.mult[i])
-                    if self.digt[i]>1:
-                        num=num%self.digt[i]
-                    clip=round(num)
-                    out.append(int(clip))
-                except Exception as err:
-                    out.append(2**self.bits[i]-1)
-                    print(self.name[i]," had error: ",err)
-        szs=[y for y in self.bits if y != 0]
-        byt=Int2Bin(out,szs,bitwise=self.hard)
-        return(byt.tobytes())
+        for i,mult,digt,bad in self.breakCols:
+            if i>=len(parts):
+                break
+            try:
+                num=float(parts[i])*mult
+                if digt>1:
+                    num=num%digt
+                clip=round(num)
+                out.append(int(clip))
+            except Exception as err:
+                out.append(bad)
+                print(self.name[i]," had error: ",err)
+        return(out)
+
+    def BreakFull(self,message):
+        """BreakInts, with fields missing from short lines set to the error value 2**bits-1"""
+        out=self.BreakInts(message)
+        for i in range(len(out),len(self.szs)):
+            out.append(2**self.szs[i]-1)
+        return(out)
 
     def Rebuild(self,data:bytes):
+        return(self.RebuildInts(self.rebuildPacker.unpack(data)))
+
+    def RebuildInts(self,dats):
         out=[]
-        szs=[]
-        tmul=[]
-        sent=[]
-        for i in range(len(self.name)):
-            if self.bits[i]!=0:
-                szs.append(self.bits[i])
-                tmul.append(self.mult[i])
-                sent.append(i)
-        dats=Bin2Int(np.frombuffer(data,dtype=np.uint8),szs,sign=np.sign(tmul))
-        for i in range(len(tmul)):
-            rediv=dats[i]/max(abs(tmul[i]),1)
-            out.append(rediv+self.clip[sent[i]])
+        for i in range(len(self.tmul)):
+            rediv=dats[i]/max(abs(self.tmul[i]),1)
+            out.append(rediv+self.tclip[i])
         out[0]=FixPiTime(out[0])
         return(out)
 
+    def BreakMany(self,messages,chunk=4096):
+        """Break for a list of lines, giving one contiguous buffer of frames. Every frame has all the fields,
+        fields missing from short lines are sent as the error value 2**bits-1 like fields that fail to convert"""
+        nums=np.zeros((len(messages),len(self.szs)),dtype=np.int64)
+        for start in range(0,len(messages),chunk):
+            nums[start:start+chunk]=self.BreakChunk(messages[start:start+chunk])
+        return(self.breakPacker.pack_many(nums))
+
+    def BreakChunk(self,messages):
+        """BreakFull for a chunk of lines as an N x fields matrix. the numbers are converted with float, as BreakInts
+        does, then scaled a column at a time. short lines, values that come out too big or not finite, and the
+        whole chunk if something will not convert go through BreakFull a line at a time"""
+        nums=np.zeros((len(messages),len(self.szs)),dtype=np.int64)
+        nums[:,len(self.breakCols)+1:]=[2**s-1 for s in self.szs[len(self.breakCols)+1:]] #as BreakFull pads
+        parts=[m.split(",") for m in messages]
+        rows=[r for r in range(len(parts)) if len(parts[r])>self.breakNeed]
+        try:
+            vals=np.fromiter(map(float,chain.from_iterable(map(self.breakGet,[parts[r] for r in rows]))),
+                             dtype=np.float64,count=len(rows)*len(self.breakCols))
+        except ValueError:
+            rows=[] #BreakFull prints which field
+            vals=np.zeros(0)
+        vals=vals.reshape(len(rows),len(self.breakCols))*self.breakMult
+        with np.errstate(invalid="ignore"): #inf, those lines are redone below
+            for k,digt in self.breakDigt:
+                vals[:,k]=np.mod(vals[:,k],digt) #same sign rule as %
+        vals=np.rint(vals) #round half to even like round
+        good=np.all(np.abs(vals)<2**62,axis=1) #also false for nan and inf
+        rows=np.array(rows,dtype=np.intp)
+        nums[rows[good],1:len(self.breakCols)+1]=vals[good]
+        nums[rows[good],0]=list(map(BreakPiTime,[parts[r][0] for r in rows[good]]))
+        done=np.zeros(len(messages),dtype=bool)
+        done[rows[good]]=True
+        for r in np.flatnonzero(~done):
+            nums[r]=self.breakPacker.normalize(self.BreakFull(messages[r])) #cut to the field widths as Break does
+        return(nums)
+
+    def RebuildMany(self,data:bytes):
+        """Rebuild for a buffer of whole frames, in one pass over all of them. Gives a structured array with a float
+        field per downlinked field. PiTS stays as seconds into the day, use FixPiTime to get the string"""
+        dats=self.manyPacker.unpack_many(data)
+        out=np.zeros(len(dats),dtype=[(self.name[i],np.float64) for i in self.sent])
+        for i in range(len(self.tmul)):
+            out[self.name[self.sent[i]]]=dats[:,i]/max(abs(self.tmul[i]),1)+self.tclip[i]
+        return(out)
+
+
+#keyframe + delta frames. most fields only move a little between samples, so instead of every frame carrying all
+#the bits, a full keyframe is sent every so often and the frames between only carry what changed since it:
+#  keyframe   b"K" seq <all fields bitwise, as Break with hard=1>
+#  delta      b"D" seq <one bit per field, set if it changed, first field in the top bit> <varint per changed field>
+#seq counts keyframes (mod 256) so the ground can tell which keyframe a delta goes with. varints are zigzag
+#(0,-1,1,-2,...) 7 bits a byte, low bits first, top bit set on all but the last byte
+def ZigZag(num):
+    return(num*2 if num>=0 else -num*2-1)
+
+def UnZigZag(num):
+    return(num>>1 if not num&1 else -(num>>1)-1)
+
+def PutVarint(num,out):
+    while num>0x7f:
+        out.append((num&0x7f)|0x80)
+        num>>=7
+    out.append(num)
+
+def GetVarint(data,pos):
+    num=0
+    shift=0
+    while True:
+        if pos>=len(data):
+            raise ValueError("frame ends inside a varint")
+        byt=data[pos]
+        pos+=1
+        num|=(byt&0x7f)<<shift
+        shift+=7
+        if not byt&0x80:
+            return(num,pos)
+
+
+class DeltaEncoder(object):
+    """makes keyframe and delta frames on the flight side, one per data line. there is no acknowledgement from the
+    ground, so deltas are against the last keyframe sent and a keyframe goes out every keyframeInterval frames to
+    resynchronise, or sooner with ForceKeyframe"""
+    def __init__(self,compressor,keyframeInterval=10):
+        self.compressor=compressor
+        self.packer=compressor.rebuildPacker
+        self.keyframeInterval=max(int(keyframeInterval),1)
+        self.maskBytes=(len(self.packer.size)+7)//8
+        self.keyframe=None #field values of the last keyframe, as the ground unpacks them
+        self.seq=0
+        self.sinceKeyframe=0
+
+    def ForceKeyframe(self):
+        self.keyframe=None
+
+    def Encode(self,message):
+        nums=self.packer.normalize(self.compressor.BreakFull(message))
+        if self.keyframe is None or self.sinceKeyframe>=self.keyframeInterval:
+            return(self.Keyframe(nums))
+        mask=0
+        body=bytearray()
+        for i in range(len(nums)):
+            mask<<=1
+            if nums[i]!=self.keyframe[i]:
+                mask|=1
+                PutVarint(ZigZag(nums[i]-self.keyframe[i]),body)
+        mask<<=self.maskBytes*8-len(nums)
+        frame=b"D"+bytes([self.seq])+mask.to_bytes(self.maskBytes,'big')+bytes(body)
+        if len(frame)>=2+self.packer.nbytes:
+            return(self.Keyframe(nums)) #moved too far, a keyframe is no bigger
+        self.sinceKeyframe+=1
+        return(frame)
+
+    def Keyframe(self,nums):
+        self.seq=(self.seq+1)%256
+        self.keyframe=nums
+        self.sinceKeyframe=1
+        return(b"K"+bytes([self.seq])+self.packer.pack(nums))
+
+
+class DeltaDecoder(object):
+    """ground side of DeltaEncoder. Decode gives what Rebuild does, or None for a delta whose keyframe was not
+    received, since those can not be rebuilt"""
+    def __init__(self,compressor):
+        self.compressor=compressor
+        self.packer=compressor.rebuildPacker
+        self.maskBytes=(len(self.packer.size)+7)//8
+        self.keyframe=None
+        self.seq=None
+
+    def Decode(self,frame:bytes):
+        nums=self.DecodeInts(frame)
+        if nums is None:
+            return(None)
+        return(self.compressor.RebuildInts(nums))
+
+    def DecodeInts(self,frame:bytes):
+        if len(frame)<2:
+            raise ValueError("frame too short")
+        kind=frame[0:1]
+        if kind==b"K":
+            self.keyframe=self.packer.unpack(frame[2:])
+            self.seq=frame[1]
+            return(list(self.keyframe))
+        if kind!=b"D":
+            raise ValueError("unknown frame type %r"%kind)
+        if self.keyframe is None or frame[1]!=self.seq:
+            return(None)
+        nfield=len(self.keyframe)
+        mask=int.from_bytes(frame[2:2+self.maskBytes],'big')>>(self.maskBytes*8-nfield)
+        nums=list(self.keyframe)
+        pos=2+self.maskBytes
+        for i in range(nfield):
+            if mask>>(nfield-1-i)&1:
+                num,pos=GetVarint(frame,pos)
+                nums[i]+=UnZigZag(num)
+        return(nums)
+
+
+class SampleAggregator(object):
+    """packs several data lines into one radio frame, keeping only some fields of each, so the ground gets the
+    samples logged between transmissions too:
+      b"A" count <count records, each the chosen fields bitwise, oldest first>
+    the Pi timestamp is always kept, as the first field. Pack on the flight side, Unpack on the ground"""
+    def __init__(self,compressor,fields,maxPayload=240):
+        self.compressor=compressor
+        sentNames=[compressor.name[i] for i in compressor.sent]
+        fields=[sentNames[0]]+[f for f in fields if f!=sentNames[0]]
+        for f in fields:
+            if f not in sentNames:
+                raise ValueError("%s is not a downlinked field"%f)
+        self.fields=fields
+        self.cols=[sentNames.index(f) for f in fields] #positions in a Break frame
+        self.szs=[compressor.szs[c] for c in self.cols]
+        self.sign=[int(np.sign(compressor.tmul[c])) for c in self.cols]
+        self.div=[max(abs(compressor.tmul[c]),1) for c in self.cols]
+        self.add=[compressor.tclip[c] for c in self.cols]
+        self.maxSamples=min(((maxPayload-2)*8)//sum(self.szs),255)
+        if self.maxSamples<1:
+            raise ValueError("one sample of %d bits does not fit in %d bytes"%(sum(self.szs),maxPayload))
+
+    def Pick(self,messages):
+        """the lines sent when there are too many, spread evenly over them and always including the newest"""
+        if len(messages)<=self.maxSamples:
+            return(list(messages))
+        step=len(messages)/self.maxSamples
+        return([messages[len(messages)-1-int(k*step)] for k in range(self.maxSamples-1,-1,-1)])
+
+    def Pack(self,messages):
+        picked=self.Pick(messages)
+        nums=[]
+        for message in picked:
+            out=self.compressor.BreakFull(message)
+            nums+=[out[c] for c in self.cols]
+        packer=GetPacker(self.szs*len(picked),self.sign*len(picked))
+        return(b"A"+bytes([len(picked)])+packer.pack(nums))
+
+    def Unpack(self,frame:bytes):
+        """gives a structured array, one row per sample and a float field per chosen field. PiTS stays as seconds
+        into the day, use FixPiTime to get the string"""
+        if frame[0:1]!=b"A" or len(frame)<2:
+            raise ValueError("not an aggregate frame")
+        count=frame[1]
+        packer=GetPacker(self.szs*count,self.sign*count)
+        nums=np.asarray(packer.unpack(frame[2:]),dtype=np.float64).reshape(count,len(self.szs))
+        out=np.zeros(count,dtype=[(f,np.float64) for f in self.fields])
+        for i in range(len(self.fields)):
+            out[self.fields[i]]=nums[:,i]/self.div[i]+self.add[i]
+        return(out)
+
 
 def BreakPiTime(timeStamp):
     #timestamp=20190717_08:32:39.021639
@@ -182,9 +600,107 @@ def FixPiTime(timeAmount):
 
 
 if __name__ == '__main__':
+    def Int2BinSlow(num,size=None,bitwise=0):
+        """bit at a time version of Int2Bin, the reference the fast one is checked and timed against"""
+        try: #safety
+            len(num)
+        except TypeError:
+            num=[num]
+
+        if size is None:
+            size=np.ceil(np.log2(num)) #smallest possible size
+        if not bitwise:
+            size=np.ceil(np.array(size)/8).astype(np.uint)*8 #size in bytes
+
+        ret=np.zeros(int(np.sum(size)),dtype=bool)
+        offset=0
+        for i in range(len(num)):
+            n=num[i] #grab a number
+            for j in range(int(size[i])-1,-1,-1):
+                ret[offset+j]=n%2 #get the least bit
+                n//=2 #shift the bits of the number
+            offset+=int(size[i]) #move to next spot in output
+        return(np.packbits(ret[0:offset])) #convert bits to bytes
+
+
+    def Bin2IntSlow(data,size=[8],sign=[1]):
+        """bit at a time version of Bin2Int, the reference the fast one is checked and timed against"""
+        bits=np.unpackbits(data)
+        offset=0
+        ret=[0]*len(size)
+        for elem in range(len(size)):
+            offset+=size[elem]
+            exps=np.arange(size[elem])
+            raised=bits[offset-exps-1]*np.power(2,exps)
+            ret[elem]=np.sum(raised)
+            if sign[elem]==-1 and ret[elem]>2**(size[elem]-1):
+                ret[elem]=ret[elem]-2**size[elem] #signs
+        return(ret)
+
     breaker=SydCompress(hard=1)
     msg="20190717_08:32:39.021639,43068,155920.00,5207.88309,N,10637.94724,W,04,00500,M,-0.11,-0.15,9.95,0.00,-0.19,0.00,20.06,3.25,-48.00,0.00,-0.75,1.00,0.00,0.00,0.11,-0.12,-0.17,9.80,27,0,3,0,0,907,0,16608,81,10,58,8,81,10,25.70"
     print(msg.split(","))
     these=breaker.Break(msg)
     recon=breaker.Rebuild(these)
-    print(recon)
\ No newline at end of file
+    print(recon)
+
+    #benchmark the bit packing of one frame against the bit at a time versions
+    ints=breaker.rebuildPacker.unpack(these)
+    ints=[n&m for n,m in zip(ints,breaker.rebuildPacker.mask)]
+    sign=np.sign(breaker.tmul)
+    data=np.frombuffer(these,dtype=np.uint8)
+    assert Int2Bin(ints,breaker.szs,bitwise=1).tobytes()==Int2BinSlow(ints,breaker.szs,bitwise=1).tobytes()==these
+    assert Bin2Int(data,breaker.szs,sign)==[int(n) for n in Bin2IntSlow(data,breaker.szs,sign)]
+    runs=2000
+    for name,func,args in [("Int2BinSlow",Int2BinSlow,(ints,breaker.szs,1)),("Int2Bin",Int2Bin,(ints,breaker.szs,1)),
+                           ("BitPacker.pack",breaker.breakPacker.pack,(ints,)),
+                           ("Bin2IntSlow",Bin2IntSlow,(data,breaker.szs,sign)),("Bin2Int",Bin2Int,(data,breaker.szs,sign)),
+                           ("BitPacker.unpack",breaker.rebuildPacker.unpack,(these,))]:
+        start=time.perf_counter()
+        for i in range(runs):
+            func(*args)
+        took=(time.perf_counter()-start)/runs
+        if name.endswith("Slow"):
+            slow=took
+        print("%-16s %8.1f us/frame %6.1fx"%(name,took*1e6,slow/took))
+
+    #benchmark encoding and decoding a lot of frames at once
+    start=time.perf_counter()
+    for i in range(runs):
+        breaker.Break(msg)
+    print("Break            %8.1f us/frame"%((time.perf_counter()-start)/runs*1e6))
+    start=time.perf_counter()
+    frames=breaker.BreakMany([msg]*100000)
+    print("BreakMany        %8.1f us/frame over %d frames"%((time.perf_counter()-start)/100000*1e6,100000))
+    start=time.perf_counter()
+    many=breaker.RebuildMany(frames)
+    print("RebuildMany      %8.1f us/frame over %d frames"%((time.perf_counter()-start)/len(many)*1e6,len(many)))
+    assert list(many[-1])[1:]==recon[1:]
+
+    #size of keyframe + delta frames over a made up flight, fields drifting by small amounts each sample
+    rng=np.random.default_rng(549)
+    parts=msg.split(",")
+    lines=[]
+    for k in range(200):
+        parts[0]="20190717_08:%02d:%02d.021639"%(32+(39+k*9)//60,(39+k*9)%60)
+        for i in [1,2,3,5,8]+list(range(10,len(parts))):
+            parts[i]="%.5f"%(float(parts[i])+rng.normal(0,0.02))
+        lines.append(",".join(parts))
+    encoder=DeltaEncoder(breaker,keyframeInterval=10)
+    decoder=DeltaDecoder(breaker)
+    full=0
+    delta=0
+    for line in lines:
+        frame=encoder.Encode(line)
+        assert decoder.Decode(frame)==breaker.Rebuild(breaker.Break(line))
+        full+=len(breaker.Break(line))
+        delta+=len(frame)
+    print("full frames %.1f bytes, keyframe + delta %.1f bytes per sample"%(full/len(lines),delta/len(lines)))
+
+    #samples per radio frame when aggregating a few fields
+    aggregator=SampleAggregator(breaker,["UTC","LtDgMn","LnDgMn","Alt","Nsat","C1","C2","temp"])
+    frame=aggregator.Pack(lines)
+    samples=aggregator.Unpack(frame)
+    recon=breaker.Rebuild(breaker.Break(lines[-1]))
+    assert FixPiTime(samples[-1][0])==recon[0] and list(samples[-1])[1:]==[recon[c] for c in aggregator.cols[1:]]
+    print("aggregate frame of %d bytes holds %d samples"%(len(frame),len(samples)))
\ No newline at end of file
@@ -0,0 +1,262 @@
+import datetime
+import numpy as np
+
+"""
+Automatic payload cutoff conditions which depend on the arduino data line.
+
+The data header is compiled once, whenever it changes, into a map of column indices and a list of cutoff predicates.
+Checking a data line then only touches the columns the predicates need. The same predicates can check a whole array
+of samples at once, e.g. a day of data loaded from the binary data log, for replay testing.
+
+GPS based cutoffs only count when the GPS has a satellite lock, since without one the GPS keeps reporting its last
+known good location.
+"""
+
+
+def convert_NEMA_to_deci(nmea):
+    """
+    Converts GPS degrees/minutes (DDMM.MMMM) to decimal degrees. Works on single values and NumPy arrays.
+
+    :param nmea: NMEA value(s)
+    :return: Decimal value(s)
+    """
+    degrees = np.trunc(np.asarray(nmea, dtype=float) / 100)
+    return degrees + (nmea - degrees * 100) / 60
+
+
+class CutoffColumnMap(object):
+    """
+    Map of data header column names to their index in a data line.
+    """
+
+    def __init__(self, data_header: str) -> None:
+        """
+        Init of class.
+
+        :param data_header: Comma separated data header line.
+        """
+        self.data_header   = data_header
+        self.column_index  = dict()
+        for index, name in enumerate(data_header.split(',')):
+            name = name.strip()
+            if name not in self.column_index:
+                self.column_index[name] = index
+
+    def get(self, name: str) -> int:
+        """
+        :param name: Column name.
+        :return: Index of the column, None if the header does not have it.
+        """
+        return self.column_index.get(name)
+
+
+class SatLockCondition(object):
+    """
+    GPS satellite lock, defined as 4 or more satellites being used.
+    """
+
+    error_description = "GPS sat lock"
+
+    def __init__(self, nsat_column: int, min_satellites: int = 4) -> None:
+        self.nsat_column    = nsat_column
+        self.min_satellites = min_satellites
+
+    def check(self, data_line: list, notes: list) -> bool:
+        n_sat = float(data_line[self.nsat_column])
+        if n_sat < self.min_satellites:
+            notes.append(("info", "GPS has bad sat lock [%f]" % n_sat))
+            return False
+        return True
+
+    def check_many(self, samples: np.ndarray) -> np.ndarray:
+        return samples[:, self.nsat_column] >= self.min_satellites
+
+
+class GpsTimeCutoff(object):
+    """
+    Cut when the GPS clock (HHMMSS) reaches the cutoff clock time. Assumes the same day.
+    """
+
+    error_description = "GPS timestamp payload cutoff"
+
+    def __init__(self, utc_column: int, cutoff_time: datetime.datetime) -> None:
+        self.utc_column        = utc_column
+        self.cutoff_time       = cutoff_time
+        self.cutoff_day_second = cutoff_time.hour * 3600 + cutoff_time.minute * 60 + cutoff_time.second
+
+    def check(self, data_line: list, notes: list) -> bool:
+        gps_HHMMSS = str(data_line[self.utc_column])
+        gps_second = int(gps_HHMMSS[0:2]) * 3600 + int(gps_HHMMSS[2:4]) * 60 + int(gps_HHMMSS[4:6])
+        if gps_second >= self.cutoff_day_second:
+            notes.append(("info", "Cutting payload due to GPS time trigger."))
+            return True
+        return False
+
+    def check_many(self, samples: np.ndarray) -> np.ndarray:
+        gps_HHMMSS = np.trunc(samples[:, self.utc_column])
+        gps_second = (gps_HHMMSS // 10000) * 3600 + ((gps_HHMMSS // 100) % 100) * 60 + gps_HHMMSS % 100
+        return gps_second >= self.cutoff_day_second
+
+
+class GeofenceCutoff(object):
+    """
+    Cut when a GPS coordinate reaches or crosses either of its limits. Hemisphere is not checked.
+    """
+
+    def __init__(self, column: int, limits: list, name: str) -> None:
+        self.column            = column
+        self.low               = float(np.min(limits))
+        self.high              = float(np.max(limits))
+        self.name              = name
+        self.error_description = "GPS %s payload cutoff" % name
+
+    def check(self, data_line: list, notes: list) -> bool:
+        deci_deg = float(convert_NEMA_to_deci(float(data_line[self.column])))
+        if deci_deg >= self.high or deci_deg <= self.low:
+            notes.append(("info", "Cutting payload due to GPS %s [%f, %f/%f] trigger." % (self.name, deci_deg,
+                                                                                         self.low, self.high)))
+            return True
+        return False
+
+    def check_many(self, samples: np.ndarray) -> np.ndarray:
+        deci_deg = convert_NEMA_to_deci(samples[:, self.column])
+        return (deci_deg >= self.high) | (deci_deg <= self.low)
+
+
+class AltitudeCutoff(object):
+    """
+    Cut when the GPS altitude has been at or above the limit for required_count consecutive readings with sat lock.
+    Altitude is taken as km unless the units column says M. A reading whose altitude can not be read (not a number,
+    including NaN) is skipped, it neither counts nor breaks the run. Losing sat lock does break it.
+    """
+
+    error_description = "GPS altitude cutoff"
+
+    def __init__(self, altitude_column: int, units_column: int, limit_km: float, required_count: int = 10) -> None:
+        self.altitude_column     = altitude_column
+        self.units_column        = units_column
+        self.limit_km            = limit_km
+        self.required_count      = required_count
+        self.good_altitude_count = 0  # Consecutive readings at or above the limit.
+
+    def altitude_km(self, data_line: list) -> float:
+        altitude = float(data_line[self.altitude_column])
+        if np.isnan(altitude):
+            raise ValueError("altitude is NaN")
+        if self.units_column is not None and str(data_line[self.units_column]).strip() == "M":
+            altitude /= 1000
+        return altitude
+
+    def check(self, data_line: list, notes: list) -> bool:
+        altitude = self.altitude_km(data_line)
+        if altitude >= self.limit_km:
+            self.good_altitude_count += 1
+            notes.append(("info", "Cutting payload due to GPS altitude [%f]" % altitude))
+            return self.good_altitude_count >= self.required_count
+        self.good_altitude_count = 0
+        return False
+
+    def check_many(self, samples: np.ndarray, have_lock: np.ndarray) -> np.ndarray:
+        # In sample arrays text columns hold character codes, see Logger/binary_log.py.
+        altitude = samples[:, self.altitude_column].copy()
+        if self.units_column is not None:
+            altitude[samples[:, self.units_column] == ord("M")] /= 1000
+        # Unreadable altitudes are NaN here. As in check they are skipped, unless there is no lock which breaks the
+        # run anyway, so the runs are counted over the other samples only.
+        counted = ~np.isnan(altitude) | ~have_lock
+        # Length of the run of consecutive good readings ending at each counted sample.
+        good       = (altitude[counted] >= self.limit_km) & have_lock[counted]
+        good_total = np.cumsum(good)
+        run_length = np.zeros(len(samples), dtype=int)
+        run_length[counted] = good_total - np.maximum.accumulate(np.where(good, 0, good_total))
+        return run_length >= self.required_count
+
+
+class CutoffEvaluator(object):
+    """
+    Cutoff predicates compiled from one data header.
+    """
+
+    def __init__(self, data_header: str, cutoff_conditions: dict, good_altitude_count: int = 0) -> None:
+        """
+        Init of class.
+
+        :param data_header: Comma separated data header line.
+        :param cutoff_conditions: Cutoff conditions as loaded by SystemControl, with the time already a datetime.
+        :param good_altitude_count: Consecutive good altitude count carried over from the previous header.
+        """
+        self.column_map = CutoffColumnMap(data_header)
+        self.sat_lock   = None
+        self.predicates = []
+        self.altitude   = None
+
+        nsat_column = self.column_map.get("Nsat")
+        if nsat_column is not None:
+            self.sat_lock = SatLockCondition(nsat_column)
+        if self.column_map.get("UTC") is not None:
+            self.predicates.append(GpsTimeCutoff(self.column_map.get("UTC"), cutoff_conditions['time'][0]))
+        if self.column_map.get("LtDgMn") is not None:
+            self.predicates.append(GeofenceCutoff(self.column_map.get("LtDgMn"), cutoff_conditions['gps_lat'],
+                                                  "latitude"))
+        if self.column_map.get("LnDgMn") is not None:
+            self.predicates.append(GeofenceCutoff(self.column_map.get("LnDgMn"), cutoff_conditions['gps_lon'],
+                                                  "longitude"))
+        if self.column_map.get("Alt") is not None:
+            self.altitude = AltitudeCutoff(self.column_map.get("Alt"), self.column_map.get("Altu"),
+                                           cutoff_conditions['gps_altitude'][0])
+            self.altitude.good_altitude_count = good_altitude_count
+            self.predicates.append(self.altitude)
+
+    def good_altitude_count(self) -> int:
+        """
+        :return: Current consecutive good altitude count, 0 if the header has no altitude.
+        """
+        if self.altitude is None:
+            return 0
+        return self.altitude.good_altitude_count
+
+    def evaluate(self, data_line: list) -> tuple:
+        """
+        This function checks one data line against the GPS cutoff conditions. A predicate which fails to read its
+        columns is skipped and reported as an error.
+
+        :param data_line: Data line split on ','.
+        :return: [should_cut, notes] where notes is a list of [level, message] pairs to log, level info or error.
+        """
+        notes      = []
+        should_cut = False
+        have_lock  = False
+        if self.sat_lock is not None:
+            try:
+                have_lock = self.sat_lock.check(data_line, notes)
+            except Exception as err:
+                notes.append(("error", "Error checking for %s [%s]" % (self.sat_lock.error_description, str(err))))
+        for predicate in self.predicates:
+            try:
+                if predicate.check(data_line, notes):
+                    should_cut = True
+            except Exception as err:
+                notes.append(("error", "Error checking for %s [%s]" % (predicate.error_description, str(err))))
+        if not have_lock and self.altitude is not None:
+            self.altitude.good_altitude_count = 0
+        return should_cut and have_lock, notes
+
+    def evaluate_many(self, samples: np.ndarray) -> np.ndarray:
+        """
+        This function checks an array of samples against the GPS cutoff conditions, as if they were read one after
+        another starting with a good altitude count of 0. Does not change the state used by evaluate.
+
+        :param samples: 2D float array, one row per sample and one column per header column.
+        :return: Boolean array, True where the payload would be cut.
+        """
+        samples = np.asarray(samples, dtype=float)
+        if self.sat_lock is None:
+            return np.zeros(len(samples), dtype=bool)
+        have_lock  = self.sat_lock.check_many(samples)
+        should_cut = np.zeros(len(samples), dtype=bool)
+        for predicate in self.predicates:
+            if predicate is self.altitude:
+                should_cut |= predicate.check_many(samples, have_lock)
+            else:
+                should_cut |= predicate.check_many(samples)
+        return should_cut & have_lock
@@ -0,0 +1,45 @@
+import os
+
+
+class NotificationsIndex(object):
+    """
+    This class keeps track of the newest ID and HEADER lines in the notifications log file.
+
+    The notifications file grows through the whole flight, so instead of reading all of it every time, the index
+    remembers how far into the file it has already looked and only parses lines appended since then.
+    """
+
+    def __init__(self, notifications_log_path: str) -> None:
+        """
+        Init of class.
+
+        :param notifications_log_path: Path to the notifications log file.
+        """
+        self.notifications_log_path = notifications_log_path
+        self.scanned_offset         = 0     # Bytes of the file already parsed. Always the end of a complete line.
+        self.board_ID               = None  # Newest ID line found, None if there is none.
+        self.data_header            = None  # Newest header line found, None if there is none.
+
+    def update(self) -> None:
+        """
+        This function parses the complete lines appended to the notifications file since the last update.
+
+        :return: None
+        """
+        if os.path.getsize(self.notifications_log_path) < self.scanned_offset:
+            # File is not the one indexed so far, start again.
+            self.scanned_offset = 0
+            self.board_ID       = None
+            self.data_header    = None
+        with open(self.notifications_log_path, 'rb') as f:
+            f.seek(self.scanned_offset)
+            new_content = f.read()
+        # Leave a line that is still being written for next time.
+        complete_length = new_content.rfind(b'\n') + 1
+        for line in new_content[0:complete_length].decode('utf-8', 'replace').splitlines():
+            line_type = line.split("<<", 1)[0].strip().lower()
+            if line_type == 'id':
+                self.board_ID = line.split("<<")[-1].strip()
+            elif line_type == 'header':
+                self.data_header = line.split("<<")[-1].strip()
+        self.scanned_offset += complete_length
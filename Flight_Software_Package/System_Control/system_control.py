@@ -1,5 +1,9 @@
 from Common.FSW_Common import *
+import queue
 from Serial_Communication.serial_communication import SerialCommunication
+from Serial_Communication.serial_request import CRITICAL_PRIORITY, priority_from_name
+from System_Control.notifications_index import NotificationsIndex
+from System_Control.cutoff_conditions import CutoffEvaluator
 
 class SystemControl(FlightSoftwareParent):
     """
@@ -17,8 +21,8 @@ class SystemControl(FlightSoftwareParent):
         :param logging_object: Reference to logging object
         :param serial_object: Reference to serial object
         """
-        self.main_delay        = 0.05                        # Main thread delay
-        self.buffering_delay   = 0.05                        # A time delay for parts of code. Used mostly to debug.
+        self.main_delay        = 0.05                        # Main thread delay, how often the cutoff is checked.
+        self.command_priority  = CRITICAL_PRIORITY           # Priority of requests acting on uplink commands.
         self.cutoff_pin_bcm    = 18                          # Pi pin in BCM layout which triggers the cutoff.
         self.cutoff_time_high  = 5                           # How long the cutoff trigger will remain high.
         # Declare some default cutoff conditions.
@@ -31,13 +35,25 @@ class SystemControl(FlightSoftwareParent):
         super().__init__("SystemControl", logging_object)  # Run init of parent.
         self.serial_object = serial_object                 # Reference to serial object.
 
+        # Uplink commands handled here, delivered to the mailbox by the serial object's command bus.
+        # "cut the mofo" = cut the payload.
+        # "send header"  = ask the payload for list of data headers
+        self.uplink_commands = ['cut the mofo', 'send header']
+        self.uplink_mailbox  = None
+        self.subscribe_to_uplink_commands()
+
         self.board_ID    = None  # ID line from arduino board
         self.data_header = None  # Header line from arduino
+        # Index of ID/header lines already in today's notifications log, from before the arduino was last asked.
+        self.notifications_index = NotificationsIndex(self.logger.notifications_log_path)
 
         self.has_already_cut_payload = False # Keeps track if payload is cut.
-        self.good_altitude_count     = 0     # Since altitude can be noisy there is a count of how many consecutive
-                                             # altitude readings agree with being >= the cutoff limit. This keeps track
-                                             # of that count.
+        self.cutoff_pin_is_high      = False # True while the cutoff pin is held high.
+        self.event_loop              = None  # Event loop of the asyncio runtime, None when running threads.
+        self.last_sample_version     = 0     # Version of the newest data sample already checked for cutoff.
+        self.cutoff_evaluator        = None  # GPS cutoff predicates compiled from the current data header. This also
+                                             # keeps the count of consecutive altitude readings >= the cutoff limit,
+                                             # since altitude can be noisy.
 
         # Rewrite time cutoff condition as a datetime object instead of a string clock time.
         temp_time = datetime.datetime.utcnow().strftime("%Y%m%d_")
@@ -64,75 +80,142 @@ class SystemControl(FlightSoftwareParent):
         dirname = os.path.dirname(__file__)
         filename = os.path.join(dirname, self.yaml_config_path)
         with open(filename, 'r') as stream:
-            content = yaml.load(stream)['system_control']
-        self.main_delay        = content['main_delay']
-        self.buffering_delay   = content['buffering_delay']
+            content = yaml.load(stream)
+        streams = content['streams']
+        content = content['system_control']
+        self.main_delay        = streams['cutoff_check']['period']
+        self.command_priority  = priority_from_name(streams['command']['priority'])
         self.cutoff_pin_bcm    = content['cutoff_BCM_pin_number']
         self.cutoff_conditions = content['cut_conditions']
         self.cutoff_time_high  = content['cutoff_time_high']
 
     def check_id_and_headers(self) -> None:
         """
-        This function just looks into the log file for the most recent header and data logging lines.
-        This might not be the most efficient way of doing it, it could take a lot of time.
+        This function gets the most recent ID and header lines.
+
+        The serial object keeps the ones it read from the arduino, which makes this a lookup. Until it has read them
+        (e.g. just after a restart) the newest ones in the notifications log are used. The log is indexed
+        incrementally so only lines added since the last check are read.
 
         Written by Daniel Letros, 2018-07-06
 
         :return: None
         """
         self.start_function_diagnostics("check_id_and_headers")
-        # Keep track of found files.
-        found_id     = False
-        found_header = False
-        # Read in whole file.
-        with open(self.logger.notifications_log_path, 'r') as f:
-            content = f.readlines()
-        # Loop through file in reverse to get newest lines and check if found a header or ID file.
-        for line_idx in range(len(content)-1, -1, -1):
-            if found_id and found_header:
-                # Found both, don't need to look anymore, break.
-                break
-            if content[line_idx].split("<<")[0].strip().lower() == 'id':
-                # Found newest ID line, save it.
-                found_id = True
-                self.board_ID = content[line_idx].split("<<")[-1].strip()
-            if content[line_idx].split("<<")[0].strip().lower() == 'header':
-                # Found newest header line, save it.
-                found_header     = True
-                self.data_header = content[line_idx].split("<<")[-1].strip()
-        # Declare header/ID none if not found.
-        if not found_header:
-            self.data_header = None
-        if not found_id:
-            self.board_ID = None
+        id_version, board_ID        = self.serial_object.latest_board_id.get()
+        header_version, data_header = self.serial_object.latest_data_header.get()
+        if id_version == 0 or header_version == 0:
+            self.notifications_index.update()
+        self.board_ID    = board_ID    if id_version     > 0 else self.notifications_index.board_ID
+        self.data_header = data_header if header_version > 0 else self.notifications_index.data_header
         self.end_function_diagnostics("check_id_and_headers")
 
-    def check_uplink_commands(self) -> list:
+    def subscribe_to_uplink_commands(self, mailbox=None) -> None:
+        """
+        This function subscribes to the uplink commands handled here, in place of any earlier subscription.
+
+        :param mailbox: Mailbox to deliver to, see CommandBus.subscribe. A new queue.SimpleQueue if None.
+        :return: None
         """
-        This function checks for any un-processed uplink commands relevant to system control
+        if self.uplink_mailbox is not None:
+            self.serial_object.command_bus.unsubscribe(self.uplink_mailbox)
+        self.uplink_mailbox = self.serial_object.command_bus.subscribe(self.uplink_commands, mailbox)
+
+    def check_uplink_commands(self, timeout: float = 0.0) -> list:
+        """
+        This function takes the uplink commands relevant to system control from its mailbox.
 
         Written by Daniel Letros, 2018-07-06
 
-        :return: Returns a list of the commands that need to be processed by this class
+        :param timeout: Most time [sec] to wait for a command if there are none yet.
+        :return: Returns a list of the (command, time.monotonic() it was read) pairs that need to be processed by
+                 this class
         """
-        # Loop through list of uplink commands and check if any of them are useful to this class.
-        # If they are delete them from main uplink list before use and then carry out the commands.
-        # if no commands are left in main uplink list then set valid flag to false.
-        # It is done this way to minimize time with mutex lock.
         self.start_function_diagnostics("check_uplink_commands")
-        with self.serial_object.uplink_commands_mutex:
-            commands_to_remove_and_use = []
-            for command in self.serial_object.last_uplink_commands:
-                # "cut the mofo" = cut the payload.
-                # "send header"  = ask the payload for list of data headers
-                if command.lower() == 'cut the mofo' or command.lower() == 'send header':
-                    commands_to_remove_and_use.append(command)
-            for command in commands_to_remove_and_use:
-                self.serial_object.last_uplink_commands.remove(command)
-            self.serial_object.last_uplink_seen_by_system_control = True
-            self.end_function_diagnostics("check_uplink_commands")
-
-        return commands_to_remove_and_use
+        commands = []
+        try:
+            if timeout > 0:
+                commands.append(self.uplink_mailbox.get(timeout=timeout))
+            while True:
+                commands.append(self.uplink_mailbox.get_nowait())
+        except queue.Empty:
+            pass
+        self.end_function_diagnostics("check_uplink_commands")
+        return commands
+
+    def handle_uplink_commands(self, commands: list) -> None:
+        """
+        This function carries out uplink commands.
+
+        :param commands: (command, time.monotonic() it was read) pairs from check_uplink_commands.
+        :return: None
+        """
+        for command, read_time in commands:
+            if command.lower() == 'cut the mofo':
+                # Ground said cut the payload so do it.
+                self.cut_payload("Cutting payload form uplink command, [%.1f] ms after it was read." % (
+                    (time.monotonic() - read_time) * 1000))
+
+            if command.lower() == 'send header':
+                if self.serial_object.ports_are_good:
+                    for port in self.serial_object.port_list:
+                        # send down the last known header file.
+                        self.serial_object.submit_request(port, "TX{%s" % self.data_header, "TX",
+                                                          self.command_priority)
+
+    def cut_payload(self, message: str) -> None:
+        """
+        This function cuts the payload, unless it has been cut already or this is not a Pi. The cutoff pin is held
+        high for cutoff_time_high. The threaded runtime waits for that here. In the asyncio runtime the pin is set low
+        later by the event loop, so the loop is not blocked meanwhile.
+
+        :param message: Reason for the cut, logged.
+        :return: None
+        """
+        try:
+            if (self.system_name == 'MajorTom' or self.system_name == 'Rocky'  or self.system_name == 'ColonelTom' or self.system_name == 'Creed') \
+                    and not self.has_already_cut_payload:
+                self.log_info(message)
+                GPIO.output(self.cutoff_pin_bcm, GPIO.HIGH)
+                self.cutoff_pin_is_high      = True
+                self.has_already_cut_payload = True
+                if self.event_loop is None:
+                    time.sleep(self.cutoff_time_high)
+                    self.end_cutoff()
+                else:
+                    self.event_loop.call_later(self.cutoff_time_high, self.end_cutoff)
+        except Exception as err:
+            self.log_error("Could not cut payload with reported error [%s]" % str(err))
+
+    def end_cutoff(self) -> None:
+        """
+        This function sets the cutoff pin low again if it is high.
+
+        :return: None
+        """
+        if not self.cutoff_pin_is_high:
+            return
+        try:
+            GPIO.output(self.cutoff_pin_bcm, GPIO.LOW)
+            self.cutoff_pin_is_high = False
+        except Exception as err:
+            self.log_error("Could not end payload cut with reported error [%s]" % str(err))
+
+    def wait_for_uplink_commands(self, timeout: float) -> None:
+        """
+        This function waits for uplink commands and carries out any which come in, without waiting for the next pass
+        of the main loop.
+
+        :param timeout: Most time [sec] to wait.
+        :return: None
+        """
+        try:
+            commands = self.check_uplink_commands(timeout)
+            if len(commands) > 0:
+                self.check_id_and_headers()  # Update ID and header information
+                self.handle_uplink_commands(commands)
+        except Exception as err:
+            self.log_error("Uplink command error [%s]" % str(err))
 
     def convert_NEMA_to_deci(self, nmea: str) -> float:
         """
@@ -169,101 +252,52 @@ class SystemControl(FlightSoftwareParent):
             except Exception as err:
                 self.log_error("Error checking for Pi timestamp payload cutoff [%s]" % str(err))
 
-            # Check GPS conditions if Pi timestamp did not trigger it already.
-            if self.data_header is not None and not should_cut and self.serial_object.ports_are_good:
-                # Get a list of data and data header. Search through the data header to find where in the data line
-                # the appropriate information is kept.
-                last_data_line = self.read_last_line_in_data_log().split(',')
-                header_list    = self.data_header.split(',')
-                col_count      = 0
-                have_gps_sat_lock = False  # This is a check to see if GPS data is good. The check is needed since the
-                                           # GPS will store and report its last known good location if it does not
-                                           # have a lock. If it does not have a lock then the invalid location is
-                                           # ignored.
-                for header in header_list:
-                    if header == "Nsat":
-                        # Check for good GPS as defined by 4 or more satellites being used.
-                        try:
-                            n_sat = float(last_data_line[col_count])
-                            if n_sat >= 4:
-                                have_gps_sat_lock = True
-                            else:
-                                have_gps_sat_lock = False
-                                self.log_info("GPS has bad sat lock [%f]" % n_sat)
-                        except Exception as err:
-                            self.log_error("Error checking for GPS sat lock [%s]" % str(err))
-                    elif header == "UTC":
-                        # Check GPS timestamp against clock cutoff.
-                        try:
-                            gps_HHMMSS = str(last_data_line[col_count])
-                            # reformat into datetime
-                            temp_time = datetime.datetime.utcnow().strftime("%Y%m%d_")
-                            temp_time = temp_time + gps_HHMMSS[0:2] + ":" + \
-                                        gps_HHMMSS[2:4] + ":" + gps_HHMMSS[4:6]
-                            if (self.cutoff_conditions['time'][0] -
-                                    datetime.datetime.strptime(temp_time, "%Y%m%d_%H:%M:%S")).total_seconds() <= 0:
-                                should_cut = True
-                                self.log_info("Cutting payload due to GPS time trigger.")
-                        except Exception as err:
-                            self.log_error("Error checking for GPS timestamp payload cutoff [%s]" % str(err))
-                    elif header == "LtDgMn":
-                        # Check for latitude boundaries.
-                        try:
-                            deci_deg    = self.convert_NEMA_to_deci(str(last_data_line[col_count]))
-                            if deci_deg >= np.max(self.cutoff_conditions['gps_lat']) or \
-                                    deci_deg <= np.min(self.cutoff_conditions['gps_lat']):
-                                should_cut = True
-                                self.log_info("Cutting payload due to GPS latitude [%f,%f/%f] trigger." % (deci_deg,
-                                                                                                           np.min(self.cutoff_conditions['gps_lat']),
-                                                                                                           np.max(self.cutoff_conditions['gps_lat'])))
-                        except Exception as err:
-                            self.log_error("Error checking for GPS latitude payload cutoff [%s]" % str(err))
-                    elif header == "LnDgMn":
-                        # Check for longitude boundaries.
-                        try:
-                            deci_deg = self.convert_NEMA_to_deci(str(last_data_line[col_count]))
-                            if deci_deg >= np.max(self.cutoff_conditions['gps_lon']) or \
-                                    deci_deg <= np.min(self.cutoff_conditions['gps_lon']):
-                                should_cut = True
-                                self.log_info("Cutting payload due to GPS longitude [%f, %f/%f] trigger." % (deci_deg,
-                                                                                                             np.min(self.cutoff_conditions['gps_lon']),
-                                                                                                             np.max(self.cutoff_conditions['gps_lon'])))
-                        except Exception as err:
-                            self.log_error("Error checking for GPS longitude payload cutoff [%s]" % str(err))
-                    elif header == "Alt":
-                        # Check for altitude boundaries.
-                        try:
-                            altitude        = float(last_data_line[col_count])
-                            alt_units       = None
-                            alt_units_count = 0
-                            for header in header_list:
-                                # Check altitude units. Assume km if they are not defined as m.
-                                if header == 'Altu':
-                                    alt_units = str(last_data_line[alt_units_count])
-                                alt_units_count += 1
-                            if alt_units == "M":
-                                # Convert to km if in m.
-                                altitude /= 1000
-                            if altitude >= self.cutoff_conditions['gps_altitude'][0]:
-                                self.good_altitude_count += 1
-                                if self.good_altitude_count >= 10:
-                                    should_cut = True
-                                self.log_info("Cutting payload due to GPS altitude [%f]" % altitude)
-                            else:
-                                self.good_altitude_count = 0
-                        except Exception as err:
-                            self.log_error("Error checking for GPS altitude cutoff [%s]" % str(err))
-                    col_count += 1
-                should_cut = should_cut and have_gps_sat_lock  # only have GPS cutoff if GPS data is good.
-                if not have_gps_sat_lock:
-                    self.good_altitude_count = 0
+            # Check GPS conditions if Pi timestamp did not trigger it already. Each data sample is only checked once,
+            # so the altitude count really is a count of consecutive readings.
+            sample_version, last_data_line = self.serial_object.latest_sample.get()
+            if self.data_header is not None and not should_cut and self.serial_object.ports_are_good and \
+                    last_data_line is not None and sample_version != self.last_sample_version:
+                self.last_sample_version = sample_version
+                if self.cutoff_evaluator is None or self.cutoff_evaluator.column_map.data_header != self.data_header:
+                    # Header changed, work out where in the data line the needed information is kept.
+                    good_altitude_count = 0
+                    if self.cutoff_evaluator is not None:
+                        good_altitude_count = self.cutoff_evaluator.good_altitude_count()
+                    self.cutoff_evaluator = CutoffEvaluator(self.data_header, self.cutoff_conditions,
+                                                            good_altitude_count)
+                should_cut, notes = self.cutoff_evaluator.evaluate(last_data_line.strip().split(','))
+                for level, message in notes:
+                    if level == "error":
+                        self.log_error(message)
+                    else:
+                        self.log_info(message)
         self.end_function_diagnostics("check_auto_cutoff_conditions")
         return should_cut
 
+    def run_once(self) -> None:
+        """
+        This function does one pass of the system control main loop: handles uplink commands and checks the cutoff
+        conditions.
+
+        :return: None
+        """
+        try:
+            self.check_id_and_headers()  # Update ID and header information
+
+            # Check for any uplink commands
+            self.handle_uplink_commands(self.check_uplink_commands())
+
+            # Check for other automatic cutoff conditions based off of data line.
+            if self.check_auto_cutoff_conditions():
+                self.cut_payload("Cutting payload from auto trigger.")
+        except Exception as err:
+            self.log_error("Main function error [%s]" % str(err))
+
     def run(self) -> None:
         """
         This function is the main loop of the system control for the RMC 549 balloon(s).
-        Payload cutoff is handled here.
+        Payload cutoff is handled here. Uplink commands are carried out as soon as they are read, the cutoff conditions
+        are checked every main_delay.
 
         Written by Daniel Letros, 2018-07-03
 
@@ -271,51 +305,13 @@ class SystemControl(FlightSoftwareParent):
         """
 
         print("%s << %s << Starting Thread" % (self.system_name, self.class_name))
+        next_check = time.monotonic()
         while self.should_thread_run:
-            try:
-                self.check_id_and_headers()  # Update ID and header information
-
-                # Check for any uplink commands
-                if self.serial_object.last_uplink_commands_valid:
-                    commands_to_remove_and_use = self.check_uplink_commands()
-                    for command in commands_to_remove_and_use:
-                        if command.lower() == 'cut the mofo':
-                            try:
-                                if (self.system_name == 'MajorTom' or self.system_name == 'Rocky'  or self.system_name == 'ColonelTom' or self.system_name == 'Creed') \
-                                        and not self.has_already_cut_payload:
-                                    # Ground said cut the payload so do it.
-                                    self.log_info("Cutting payload form uplink command.")
-                                    GPIO.output(self.cutoff_pin_bcm, GPIO.HIGH)
-                                    time.sleep(self.cutoff_time_high)
-                                    GPIO.output(self.cutoff_pin_bcm, GPIO.LOW)
-                                    self.has_already_cut_payload = True
-                            except Exception as err:
-                                self.log_error("Could not cut payload with reported error [%s]" % str(err))
-
-                        if command.lower() == 'send header':
-                            if self.serial_object.ports_are_good:
-                                for port in self.serial_object.port_list:
-                                    with self.serial_object.serial_mutex:
-                                        # send down the last known header file.
-                                        time.sleep(self.buffering_delay)
-                                        self.serial_object.write_request_buffer.append([port, "TX{%s" % self.data_header])
-                                        time.sleep(self.buffering_delay)
-                                        self.serial_object.read_request_buffer.append([port, "TX"])
-                                        time.sleep(self.buffering_delay)
-
-                # Check for other automatic cutoff conditions based off of data line.
-                if self.check_auto_cutoff_conditions():
-                    try:
-                        if (self.system_name == 'MajorTom' or self.system_name == 'Rocky'  or self.system_name == 'ColonelTom' or self.system_name == 'Creed') \
-                                and not self.has_already_cut_payload:
-                            self.log_info("Cutting payload from auto trigger.")
-                            GPIO.output(self.cutoff_pin_bcm, GPIO.HIGH)
-                            time.sleep(self.cutoff_time_high)
-                            GPIO.output(self.cutoff_pin_bcm, GPIO.LOW)
-                            self.has_already_cut_payload = True
-                    except Exception as err:
-                        self.log_error("Could not cut payload with reported error [%s]" % str(err))
-            except Exception as err:
-                self.log_error("Main function error [%s]" % str(err))
-            time.sleep(self.main_delay)
+            delay = next_check - time.monotonic()
+            if delay > 0:
+                # Act on uplink commands as soon as they are read while waiting for the next cutoff check.
+                self.wait_for_uplink_commands(delay)
+                continue
+            self.run_once()
+            next_check = time.monotonic() + self.main_delay
         print("%s << %s << End Thread" % (self.system_name, self.class_name))
@@ -1,5 +1,6 @@
 from Common.FSW_Common import *
 from Serial_Communication.serial_communication import SerialCommunication
+from Serial_Communication.serial_request import HIGH_PRIORITY, NORMAL_PRIORITY, priority_from_name
 from SydCompress import *
 
 class Telemetry(FlightSoftwareParent):
@@ -18,13 +19,25 @@ class Telemetry(FlightSoftwareParent):
         :param logging_object: Reference to the logging object
         :param serial_object: Reference to the serial object
         """
-        self.main_delay           = 0.5                # Main delay for thread.
+        self.main_delay           = 0.5                # Main delay for thread, how often to check for uplink commands.
         self.data_downlink_delay  = 9                  # How often in seconds to send down telemetry data.
-        self.buffering_delay      = 0.05               # A time delay for some aspects of code. Used mostly to debug.
+        self.uplink_priority      = HIGH_PRIORITY      # Priority of the uplink command checks.
+        self.downlink_priority    = NORMAL_PRIORITY    # Priority of sending down telemetry data.
         self.enable_telemetry     = True               # Enable/disable for the telemetry.
+        self.downlink_mode        = "full"             # full: every frame has all fields. delta: keyframe + deltas.
+                                                       # aggregate: some fields of every sample since the last frame.
+        self.keyframe_interval    = 10                 # In delta mode, send a full keyframe every this many frames.
+        self.aggregate_fields     = ["UTC", "LtDgMn", "LnDgMn", "Alt", "Nsat", "C1", "C2", "temp"]
+        self.max_payload_bytes    = 240                # Largest frame sent in aggregate mode.
         super().__init__("Telemetry", logging_object)  # Run init of parent object.
         self.serial_object         = serial_object     # Reference to serial object.
         self.syd_compress         = SydCompress(hard=1)
+        self.delta_encoder        = DeltaEncoder(self.syd_compress, self.keyframe_interval)
+        self.sample_aggregator    = SampleAggregator(self.syd_compress, self.aggregate_fields, self.max_payload_bytes)
+        # Timestamps which keep track of telemetry interval.
+        self.tx_timer_start          = datetime.datetime.now()
+        self.tx_timer_end            = datetime.datetime.now()
+        self.last_downlinked_version = 0  # Version of the newest data sample already sent down.
 
     def load_yaml_settings(self)->None:
         """
@@ -37,11 +50,60 @@ class Telemetry(FlightSoftwareParent):
         dirname = os.path.dirname(__file__)
         filename = os.path.join(dirname, self.yaml_config_path)
         with open(filename, 'r') as stream:
-            content = yaml.load(stream)['telemetry']
-        self.data_downlink_delay  = content['data_downlink_delay']
-        self.buffering_delay      = content['buffering_delay']
-        self.main_delay           = content['main_delay']
+            content = yaml.load(stream)
+        streams = content['streams']
+        content = content['telemetry']
+        self.main_delay           = streams['uplink']['period']
+        self.uplink_priority      = priority_from_name(streams['uplink']['priority'])
+        self.data_downlink_delay  = streams['downlink']['period']
+        self.downlink_priority    = priority_from_name(streams['downlink']['priority'])
         self.enable_telemetry     = content['enable_telemetry']
+        self.downlink_mode        = content['downlink_mode']
+        self.keyframe_interval    = content['keyframe_interval']
+        self.aggregate_fields     = content['aggregate_fields']
+        self.max_payload_bytes    = content['max_payload_bytes']
+
+    def run_once(self) -> None:
+        """
+        This function does one pass of the telemetry main loop: asks each port for uplink commands, which the serial
+        object publishes on its command bus, and, every data_downlink_delay, sends down the newest data.
+
+        :return: None
+        """
+        try:
+            if self.enable_telemetry:
+                if self.serial_object.ports_are_good:
+                    for port in self.serial_object.port_list:
+                        # Check for uplink command
+                        self.serial_object.submit_request(port, "RX", "RX", self.uplink_priority,
+                                                          timeout=self.main_delay)
+
+                        if (self.tx_timer_end - self.tx_timer_start).total_seconds() >= self.data_downlink_delay:
+                            # Send down some telemetry, as long as there is a sample which has not been sent.
+                            self.tx_timer_start = datetime.datetime.now()
+                            if self.downlink_mode == "aggregate":
+                                sample_version, log_lines = self.serial_object.sample_history.get_since(
+                                    self.last_downlinked_version)
+                                log_line = log_lines[-1] if len(log_lines) > 0 else None
+                            else:
+                                sample_version, log_line = self.serial_object.latest_sample.get()
+                            if sample_version == self.last_downlinked_version or log_line is None:
+                                self.log_warning("No new data sample to downlink.")
+                            else:
+                                self.last_downlinked_version = sample_version
+                                if self.downlink_mode == "aggregate":
+                                    msg=self.sample_aggregator.Pack([line.strip("\n") for line in log_lines])
+                                elif self.downlink_mode == "delta":
+                                    msg=self.delta_encoder.Encode(log_line.strip("\n"))
+                                else:
+                                    msg=self.syd_compress.Break(log_line.strip("\n"))
+                                # self.log_info("sending %s with length of %i bytes"%(msg,len(msg)))
+                                self.serial_object.submit_request(port, b"TX"+msg, "TX",
+                                                                  self.downlink_priority,
+                                                                  timeout=self.data_downlink_delay)
+        except Exception as err:
+            self.log_error("Main function error [%s]" % str(err))
+        self.tx_timer_end = datetime.datetime.now()
 
     def run(self) -> None:
         """
@@ -53,45 +115,7 @@ class Telemetry(FlightSoftwareParent):
         """
 
         print("%s << %s << Starting Thread" % (self.system_name, self.class_name))
-        # Declare timestamps which keep track of telemetry interval.
-        tx_timer_start = datetime.datetime.now()
-        tx_timer_end   = datetime.datetime.now()
         while self.should_thread_run:
-            try:
-                if self.enable_telemetry:
-                    if self.serial_object.ports_are_good:
-                        for port in self.serial_object.port_list:
-                            with self.serial_object.serial_mutex:
-                                # Check for uplink command
-                                time.sleep(self.buffering_delay)
-                                self.serial_object.write_request_buffer.append([port, "RX"])
-                                time.sleep(self.buffering_delay)
-                                self.serial_object.read_request_buffer.append([port, "RX"])
-                                time.sleep(self.buffering_delay)
-
-                            with self.serial_object.serial_mutex:
-                                if (tx_timer_end - tx_timer_start).total_seconds() >= self.data_downlink_delay:
-                                    # Send down some telemetry
-                                    tx_timer_start = datetime.datetime.now()
-                                    log_line = self.read_last_line_in_data_log()
-                                    time.sleep(self.buffering_delay)
-                                    msg=self.syd_compress.Break(log_line.strip("\n"))
-                                    # self.log_info("sending %s with length of %i bytes"%(msg,len(msg)))
-                                    self.serial_object.write_request_buffer.append([port, b"TX"+msg])
-                                    time.sleep(self.buffering_delay)
-                                    # self.log_info("sent succeeds")
-                                    self.serial_object.read_request_buffer.append([port, "TX"])
-                                    time.sleep(self.buffering_delay)
-
-                            with self.serial_object.uplink_commands_mutex:
-                                # All commands deleted OR all threads have seen what they want to.
-                                if len(self.serial_object.last_uplink_commands) == 0 or \
-                                        self.serial_object.last_uplink_seen_by_system_control:
-                                    # Reset uplink command cycle
-                                    self.serial_object.last_uplink_seen_by_system_control = False
-                                    self.serial_object.last_uplink_commands_valid         = False
-            except Exception as err:
-                self.log_error("Main function error [%s]" % str(err))
-            tx_timer_end = datetime.datetime.now()
+            self.run_once()
             time.sleep(self.main_delay)
-        print("%s << %s << End Thread" % (self.system_name, self.class_name))
\ No newline at end of file
+        print("%s << %s << End Thread" % (self.system_name, self.class_name))
@@ -5,6 +5,7 @@ from Serial_Communication.serial_communication import *
 from System_Control.system_control import *
 from Telemetry.telemetry import *
 from I2C.i2c import I2C_Photosensor
+from Common.async_runtime import AsyncRuntime, load_runtime_setting
 
 if __name__ == "__main__":
     """
@@ -31,30 +32,35 @@ if __name__ == "__main__":
                                                     Telemetry_Thread,
                                                     System_Control_Thread)
 
-    # Start threads
-    Logging_Thread.start()
-    Serial_Communication_Thread.start()
-    Telemetry_Thread.start()
-    System_Control_Thread.start()
-    Command_And_Control_Thread.start()
-
-    while True:
-        # Live forever for now
-        time.sleep(10000)
-
-    # End Threads
-    Command_And_Control_Thread.should_thread_run  = False
-    Command_And_Control_Thread.join()
-    System_Control_Thread.should_thread_run       = False
-    System_Control_Thread.join()
-    if socket.gethostname() == "Rocky" or socket.gethostname() == "MajorTom" or socket.gethostname() == "ColonelTom" or socket.gethostname() == "Creed":
-        GPIO.cleanup()
-    Telemetry_Thread.should_thread_run = False
-    Telemetry_Thread.join()
-    Serial_Communication_Thread.should_thread_run = False
-    Serial_Communication_Thread.join()
-    Logging_Thread.should_thread_run              = False
-    Logging_Thread.join()
+    if load_runtime_setting(Command_And_Control_Thread) == "asyncio":
+        # Run everything on one event loop instead of one thread each. Returns when stopped.
+        AsyncRuntime(Logging_Thread, Serial_Communication_Thread, Telemetry_Thread, System_Control_Thread,
+                     Command_And_Control_Thread).run()
+    else:
+        # Start threads
+        Logging_Thread.start()
+        Serial_Communication_Thread.start()
+        Telemetry_Thread.start()
+        System_Control_Thread.start()
+        Command_And_Control_Thread.start()
+
+        while True:
+            # Live forever for now
+            time.sleep(10000)
+
+        # End Threads
+        Command_And_Control_Thread.should_thread_run  = False
+        Command_And_Control_Thread.join()
+        System_Control_Thread.should_thread_run       = False
+        System_Control_Thread.join()
+        if socket.gethostname() == "Rocky" or socket.gethostname() == "MajorTom" or socket.gethostname() == "ColonelTom" or socket.gethostname() == "Creed":
+            GPIO.cleanup()
+        Telemetry_Thread.should_thread_run = False
+        Telemetry_Thread.join()
+        Serial_Communication_Thread.should_thread_run = False
+        Serial_Communication_Thread.join()
+        Logging_Thread.should_thread_run              = False
+        Logging_Thread.join()
 
 
 